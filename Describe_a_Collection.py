@@ -4,8 +4,9 @@ import streamlit as st
 import streamlit.components.v1 as components
 from streamlit_extras.switch_page_button import switch_page
 
+import listing
 from lib import init_page, value_or_default, SITE_ID, load_stored_data, PREFIX, load_files, MODE, MODE_CREATE, \
-    MODE_EDIT, FORMAT
+    MODE_EDIT, FORMAT, shared_cache, LISTING_CACHE
 
 init_page("WP11 Demo")
 
@@ -37,16 +38,24 @@ else:
                                               help="This is typically a string beginning with 'E'",
                                               value=value_or_default(SITE_ID, default=''))
     if SITE_ID in st.session_state and st.session_state[SITE_ID]:
-        info = load_stored_data(st.session_state[SITE_ID])
+        refresh = st.button("Reload published data", help="Discard unpublished changes and reload the "
+                                                           "data stored with this site")
+        info = load_stored_data(st.session_state[SITE_ID], refresh=refresh)
         st.markdown(f"Editing site at [{info.url()}]({info.url()})")
 
 if PREFIX in st.session_state and st.session_state[PREFIX]:
+    if st.button("Refresh file list", help="Check the storage location for files added or removed since "
+                                           "the dataset was last listed"):
+        shared_cache().invalidate(LISTING_CACHE, st.session_state[PREFIX])
     items = load_files(st.session_state.get(PREFIX))
     st.markdown(f"### Items found: {len(items)}")
+    stats = shared_cache().stats()
+    st.caption(f"Listing cache: {stats.hits} hits, {stats.misses} misses, {stats.entries} entries, "
+               f"{stats.size / 1024 / 1024:.1f}MB")
 
     view = """<style>body { font-family: sans-serif; } a { color: #771646} </style>"""
     view += """<div style="display: grid; grid-gap: 1rem; grid-template-columns: 1fr 1fr 1fr 1fr">"""
-    for i, (key, url, thumb_url) in enumerate(items):
+    for i, (key, url, thumb_url) in enumerate(listing.rows(items)):
         view += "<div>"
         view += f"""<a href="{url}" target="_blank">
     <img src="{thumb_url}" width="75" height="100" alt="{key}"  style="border: 1px solid #ccc"/></a>
@@ -0,0 +1,88 @@
+"""An asyncio interface to storage, for overlapping many requests"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Tuple, Dict, Callable, Any, Iterable
+
+from checkpoint import Journal
+from store import Store, Upload, MAX_CONNECTIONS, SEARCH_STATE
+
+
+class AsyncStore:
+    """Runs a `Store`'s blocking boto3 calls on a thread pool, allowing
+    at most `concurrency` of them in flight at once. boto3 clients are
+    thread-safe, so the store's client is shared between the threads."""
+    def __init__(self, store: Store, concurrency: int = MAX_CONNECTIONS):
+        self.store = store
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(concurrency, thread_name_prefix="store")
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def _run(self, func: Callable, *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        # NB: a semaphore can only be used by one event loop
+        if self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+        async with self._semaphore:
+            return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def load_files(self, prefix: Optional[str] = None) -> List[Tuple[str, str, str]]:
+        return await self._run(self.store.load_files, prefix)
+
+    async def load_many(self, prefixes: Iterable[str]) -> Dict[str, List[Tuple[str, str, str]]]:
+        """List several datasets at once"""
+        prefixes = list(prefixes)
+        listings = await asyncio.gather(*[self.load_files(prefix) for prefix in prefixes])
+        return dict(zip(prefixes, listings))
+
+    async def get_meta(self, origin: str, name: str = "<unnamed>") -> Optional[Dict]:
+        return await self._run(self.store.get_meta, origin, name)
+
+    async def get_metas(self, origins: Iterable[str]) -> Dict[str, Optional[Dict]]:
+        """Fetch the manifests of several sites at once"""
+        origins = list(origins)
+        metas = await asyncio.gather(*[self.get_meta(origin) for origin in origins])
+        return dict(zip(origins, metas))
+
+    async def put_all(self, origin: str, uploads: List[Upload], journal: Optional[Journal] = None):
+        await asyncio.gather(*[self._run(self.store.put, origin, upload, journal) for upload in uploads])
+
+    async def upload(self, name: str, origin: str, index: str, xml: str, iiif: str, meta: Dict,
+                     extra: Optional[List[Tuple[str, str, str]]] = None, journal: Optional[Journal] = None):
+        """Upload website data to storage, all files in parallel"""
+        await self.put_all(origin, self.store.uploads(name, index, xml, iiif, meta, extra), journal)
+
+    async def sync_files(self, origin: str, files: Dict[str, str], journal: Optional[Journal] = None,
+                         **kwargs) -> List[str]:
+        """Upload, in parallel, only those files whose content has changed
+        since the last sync. See `Store.sync_files`."""
+        changed, stale, state = await self._run(self.store.plan_sync, origin, files, **kwargs)
+        await self.put_all(origin, changed, journal)
+        await self._run(self.store.delete, origin, stale)
+        if state:
+            await self._run(self.store.put, origin, state, journal)
+        return [upload.filename for upload in changed]
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+async def upload_site(store: Store, name: str, origin: str, index: str, xml: str, iiif: str, meta: Dict,
+                      search: Dict[str, str], pages: Dict[str, str],
+                      journal: Optional[Journal] = None) -> List[str]:
+    """Upload the site files and sync its search index and pages, all in
+    parallel, returning the names of the updated pages. Files recorded in
+    the `journal` as already uploaded are skipped."""
+    engine = AsyncStore(store)
+    try:
+        # NB: synced, rather than uploaded, so shards of terms no longer
+        # in the index are deleted
+        _, _, changed = await asyncio.gather(
+            engine.upload(name, origin, index, xml, iiif, meta, journal=journal),
+            engine.sync_files(origin, search, journal, content_type="application/json", state_name=SEARCH_STATE),
+            engine.sync_files(origin, pages, journal))
+        return changed
+    finally:
+        engine.close()
@@ -0,0 +1,81 @@
+"""Self-hosted copies of the third-party files published sites use: the
+viewer bundle and the web fonts.
+
+These are stored once per bucket under content-hashed names, so they can
+be cached by browsers and CloudFront indefinitely, and are served by every
+site from the same `/_assets/` path. Local copies are kept so they are only
+downloaded from their sources once."""
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from store import Upload
+
+ASSETS_DIR = "_assets"
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Where downloaded copies are kept locally
+LOCAL_DIR = ".assets"
+
+
+@dataclass(frozen=True)
+class Source:
+    name: str
+    url: str
+    filename: str
+    content_type: str
+
+
+SOURCES = [
+    Source("mirador", "https://unpkg.com/mirador@3.3.0/dist/mirador.min.js",
+           "mirador-3.3.0.min.js", "application/javascript"),
+    Source("barlow", "https://cdn.jsdelivr.net/npm/@fontsource/barlow@5.0.8/files/barlow-latin-700-normal.woff2",
+           "barlow-latin-700.woff2", "font/woff2"),
+    Source("noto_serif",
+           "https://cdn.jsdelivr.net/npm/@fontsource/noto-serif@5.0.8/files/noto-serif-latin-400-normal.woff2",
+           "noto-serif-latin-400.woff2", "font/woff2"),
+]
+
+
+@dataclass
+class Asset:
+    source: Source
+    body: bytes
+
+    @property
+    def filename(self) -> str:
+        """The name, including a hash of the content"""
+        stem, ext = os.path.splitext(self.source.filename)
+        return f"{stem}.{hashlib.sha256(self.body).hexdigest()[:12]}{ext}"
+
+    @property
+    def path(self) -> str:
+        return f"{ASSETS_DIR}/{self.filename}"
+
+    @property
+    def href(self) -> str:
+        return "/" + self.path
+
+
+def fetch(directory: Optional[str] = None) -> Dict[str, Asset]:
+    """Get the assets by name, downloading any not in the local directory"""
+    directory = directory or LOCAL_DIR
+    found = {}
+    for source in SOURCES:
+        path = os.path.join(directory, source.filename)
+        if not os.path.exists(path):
+            import requests
+            r = requests.get(source.url, timeout=30)
+            r.raise_for_status()
+            os.makedirs(directory, exist_ok=True)
+            with open(path + ".tmp", 'wb') as f:
+                f.write(r.content)
+            os.replace(path + ".tmp", path)
+        with open(path, 'rb') as f:
+            found[source.name] = Asset(source, f.read())
+    return found
+
+
+def uploads(assets: Dict[str, Asset]) -> List[Upload]:
+    return [Upload(asset.path, asset.source.content_type, asset.body, cache_control=CACHE_CONTROL)
+            for asset in assets.values()]
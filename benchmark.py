@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""Benchmark the publish pipeline on synthetic archives.
+
+Each stage of the pipeline is run against a generated listing and a
+fake store, so no network access is needed, and its wall time and peak
+traced memory are written to a JSON results file. Given a previous
+results file as a baseline, the run fails if any stage has slowed
+down by more than the given threshold."""
+import argparse
+import json
+import platform
+import random
+import sys
+from dataclasses import dataclass, asdict
+from typing import List, Tuple, Dict, Optional, Callable, Any
+
+from ead import Ead
+from iiif import IIIFManifest
+from instrument import Recorder
+import metafile
+from microarchive import MicroArchive, KEYS, item_key
+from search import build_index
+from website import make_html, make_pages
+
+WORDS = ["letter", "postcard", "photograph", "diary", "ghetto", "camp", "family", "school", "Warsaw",
+         "Amsterdam", "Prague", "Vienna", "1938", "1942", "1945", "deportation", "survivor", "testimony"]
+
+# Stages quicker than this are too noisy to flag as regressions
+NOISE_FLOOR = 0.05
+
+
+@dataclass
+class Config:
+    items: int = 1000
+    depth: int = 3
+    fanout: int = 10
+    text_size: int = 200
+    seed: int = 1
+
+
+class FakeStore:
+    """Stands in for `store.Store` with a fixed listing, counting
+    rather than performing uploads"""
+    def __init__(self, files: List[Tuple[str, str, str]]):
+        self.files = files
+        self.uploaded_bytes = 0
+        self.uploaded_files = 0
+
+    def load_files(self, prefix: Optional[str] = None) -> List[Tuple[str, str, str]]:
+        return list(self.files) if prefix else []
+
+    def get_meta(self, origin: str, name: str = "<unnamed>") -> Optional[Dict]:
+        return None
+
+    def upload(self, name: str, origin: str, index: str, xml: str, iiif: str, meta: Dict,
+               extra: Optional[List[Tuple[str, str, str]]] = None):
+        self.uploaded_bytes += len(metafile.dumps(meta))
+        self.uploaded_files += 1
+        for data in [index, xml, iiif] + [data for _, _, data in extra or []]:
+            self.uploaded_bytes += len(data.encode('utf-8'))
+            self.uploaded_files += 1
+
+    def sync_files(self, origin: str, files: Dict[str, str], **kwargs) -> List[str]:
+        for data in files.values():
+            self.uploaded_bytes += len(data.encode('utf-8'))
+            self.uploaded_files += 1
+        return list(files.keys())
+
+
+def synthetic_archive(config: Config, prefix: str = "bench/",
+                      server_url: str = "https://iiif.example.com/iiif/3/") -> Tuple[Dict, List[Tuple[str, str, str]]]:
+    """Generate flat archive data and a file listing. Items are spread
+    over a directory tree `depth` levels deep with `fanout` children per
+    directory, and each has a title and a scope note of roughly
+    `text_size` characters."""
+    rand = random.Random(config.seed)
+
+    def text(size: int) -> str:
+        words = []
+        length = 0
+        while length < size:
+            word = rand.choice(WORDS)
+            words.append(word)
+            length += len(word) + 1
+        return " ".join(words)
+
+    data = {
+        KEYS.TITLE: "Synthetic Collection",
+        KEYS.HOLDER: "EHRI",
+        KEYS.BIOG_HIST: text(config.text_size * 10),
+        KEYS.SCOPE: text(config.text_size * 10),
+        KEYS.LANGS: ["en", "de"],
+    }
+    files = []
+    for i in range(config.items):
+        directory = i // config.fanout
+        parts = []
+        for level in range(config.depth):
+            parts.append(f"d{level}-{directory % config.fanout}")
+            directory //= config.fanout
+        ident = "/".join(reversed(parts)) + f"/item{i:07d}"
+        key = prefix + ident + ".jpg"
+        files.append((ident, f"{server_url}{key}/full/max/0/default.jpg",
+                      f"{server_url}{key}/full/!75,100/0/default.jpg"))
+        data[item_key(ident, KEYS.TITLE)] = text(min(config.text_size, 40))
+        data[item_key(ident, KEYS.SCOPE)] = text(config.text_size)
+    return data, files
+
+
+def measure(name: str, func: Callable[[], Any], results: Dict, memory: bool = True) -> Any:
+    recorder = Recorder(trace_memory=memory)
+    with recorder.stage(name) as stage:
+        value = func()
+    results[name] = {k: v for k, v in stage.to_dict().items() if k in ("seconds", "peak_bytes", "max_rss")}
+    return value
+
+
+def run(config: Config, memory: bool = True, workers: int = 1) -> Dict:
+    """Run every publish stage for a synthetic archive"""
+    data, files = synthetic_archive(config)
+    store = FakeStore(files)
+    prefix = "bench/"
+    url = "https://example.cloudfront.net"
+    stages = {}
+
+    listing = measure("listing", lambda: store.load_files(prefix), stages, memory)
+    desc = measure("model", lambda: MicroArchive.from_data(data, listing), stages, memory)
+    tree = measure("hierarchy", desc.hierarchical_items, stages, memory)
+    xml = measure("ead", lambda: Ead().to_xml(desc, url, workers=workers), stages, memory)
+    iiif = IIIFManifest(baseurl=url, name="bench", service_url="https://iiif.example.com/iiif/3/",
+                        image_format=".jpg", prefix=prefix)
+    manifest = measure("iiif", lambda: iiif.to_json(desc), stages, memory)
+    html = measure("html", lambda: make_html("bench", desc, "KEY", tree, search=True), stages, memory)
+    pages = measure("pages", lambda: make_pages("bench", desc, "KEY", iiif.canvas_id, tree, workers=workers),
+                    stages, memory)
+    search_files = measure("search", lambda: build_index(desc), stages, memory)
+
+    def upload():
+        extra = [(filename, "application/json", data) for filename, data in search_files.items()]
+        store.upload("bench", "/webdata", html, xml, manifest, desc.to_data(), extra)
+        store.sync_files("/webdata", pages)
+
+    measure("upload", upload, stages, memory)
+    return {
+        "config": asdict(config),
+        "memory": memory,
+        "workers": workers,
+        "stages": stages,
+        "uploaded_bytes": store.uploaded_bytes,
+        "uploaded_files": store.uploaded_files,
+    }
+
+
+def listing_keys(count: int, prefix: str = "bench/") -> List[str]:
+    """Storage keys for a synthetic dataset, including some that aren't
+    images and some needing URL encoding beyond slashes and spaces"""
+    keys = []
+    for i in range(count):
+        folder = f"{prefix}box{i // 1000:04d}/folder {i // 50 % 20:02d}/"
+        if i % 1000 == 0:
+            keys.append(folder)
+        if i % 100 == 1:
+            keys.append(f"{folder}.thumb/scan_{i:07d}.jpg")
+        name = f"scan_{i:07d}" if i % 500 else f"scan_{i:07d} (ré-scan #{i % 7})"
+        keys.append(f"{folder}{name}.{'tif' if i % 3 else 'jpg'}")
+    return keys
+
+
+def run_listing(count: int) -> Dict:
+    """Compare listing the items of `count` keys one at a time with the
+    vectorized listing table"""
+    import listing
+    prefix = "bench/"
+    server_url = "https://iiif.example.com/iiif/3/"
+    keys = listing_keys(count, prefix)
+    pages = [keys[i:i + 1000] for i in range(0, len(keys), 1000)]
+    stages = {}
+    rows = measure("listing_python", lambda: listing.python_rows(keys, prefix, server_url), stages, memory=False)
+    table = measure("listing_arrow", lambda: listing.from_pages(pages, prefix, server_url), stages, memory=False)
+    assert table.num_rows == len(rows)
+    return {"config": {"items": count, "listing": True}, "memory": False, "workers": None, "stages": stages}
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Return a description of each stage that is slower than its baseline
+    timing by more than the `threshold` factor"""
+    def key(run: Dict):
+        # memory tracing slows everything down, so only compare like with like
+        return tuple(sorted(run["config"].items())) + (run.get("memory"), run.get("workers"))
+
+    previous = {key(r): r for r in baseline["runs"]}
+    regressions = []
+    for r in current["runs"]:
+        base = previous.get(key(r))
+        if not base:
+            continue
+        for stage, timing in r["stages"].items():
+            before = base["stages"].get(stage, {}).get("seconds")
+            if before is None or timing["seconds"] < NOISE_FLOOR:
+                continue
+            if timing["seconds"] > before * threshold:
+                regressions.append(f"{stage} ({r['config']['items']} items): "
+                                   f"{before:.3f}s -> {timing['seconds']:.3f}s")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='Benchmark',
+        description='Benchmark the publish pipeline on synthetic archives')
+    parser.add_argument('--items', type=int, nargs='+', default=[1000, 10000],
+                        help='the archive sizes to run, e.g. 1000 100000 500000')
+    parser.add_argument('--depth', type=int, default=3, help='the directory depth')
+    parser.add_argument('--fanout', type=int, default=10, help='the directory fan-out')
+    parser.add_argument('--text-size', dest="text_size", type=int, default=200,
+                        help='the approximate size of item scope notes')
+    parser.add_argument('--seed', type=int, default=1, help='the random seed')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='the number of EAD and page rendering processes, to compare scaling with core count')
+    parser.add_argument('--no-memory', dest="memory", action="store_false", default=True,
+                        help='skip memory tracing, which slows down the run considerably')
+    parser.add_argument('--listing-keys', dest="listing_keys", type=int, nargs='*', default=[],
+                        help='also compare listing methods for these numbers of keys, e.g. 1000000')
+    parser.add_argument('--output', type=str, default="bench_output.json", help='the results file')
+    parser.add_argument('--baseline', type=str, help='a previous results file to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='the slowdown factor over the baseline counted as a regression')
+    args = parser.parse_args()
+
+    # Warm up, so one-off costs like loading language data aren't
+    # counted against the first run
+    run(Config(items=10), memory=False, workers=1)
+
+    runs = []
+    for count in args.items:
+        config = Config(items=count, depth=args.depth, fanout=args.fanout, text_size=args.text_size, seed=args.seed)
+        print(f"Running {config}...", file=sys.stderr)
+        runs.append(run(config, memory=args.memory, workers=args.workers))
+        for stage, timing in runs[-1]["stages"].items():
+            print(f"  {stage:10} {timing['seconds']:8.3f}s", file=sys.stderr)
+
+    for count in args.listing_keys:
+        print(f"Running listing of {count} keys...", file=sys.stderr)
+        runs.append(run_listing(count))
+        for stage, timing in runs[-1]["stages"].items():
+            print(f"  {stage:15} {timing['seconds']:8.3f}s", file=sys.stderr)
+
+    results = {"python": platform.python_version(), "machine": platform.machine(), "runs": runs}
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
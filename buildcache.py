@@ -0,0 +1,125 @@
+"""A local cache of generated site artifacts, keyed by a fingerprint of
+the inputs they were generated from.
+
+Whole builds are cached, so republishing an unchanged site regenerates
+nothing, and so are the EAD components and static pages of each top-level
+subtree, so only the changed parts of a changed site are regenerated.
+
+Artifacts unused for `max_age` seconds are removed when the cache is
+pruned, as are the least recently used beyond a total of `max_bytes`."""
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import time
+from typing import Any, Optional, Callable, List
+
+from microarchive import Item
+
+# Bump to invalidate all cached artifacts when the output format changes
+CACHE_VERSION = 1
+# The templates the HTML artifacts are rendered from
+TEMPLATES = ["index.html.j2", "page.html.j2"]
+# The default bounds of the cache's total size, in bytes, and of how
+# long, in seconds, an unused artifact is kept
+MAX_BYTES = 1024 * 1024 * 1024
+MAX_AGE = 30 * 24 * 60 * 60
+
+
+def fingerprint(*parts: Any) -> str:
+    """A stable hash of some JSON-serializable values"""
+    data = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def template_version() -> str:
+    """A hash of the templates, so cached HTML is invalidated when they change"""
+    sha = hashlib.sha256(str(CACHE_VERSION).encode('utf-8'))
+    for name in TEMPLATES:
+        with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), name), 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def subtree(item: Item) -> List:
+    """The values of an item and its descendants that artifacts depend on"""
+    return [item.id, item.identity.title, item.content.scope, item.url, item.thumb_url,
+            [subtree(child) for child in item.items]]
+
+
+class BuildCache:
+    """Artifacts stored as JSON files under `directory`, by kind and key"""
+    def __init__(self, directory: str, max_bytes: int = MAX_BYTES, max_age: float = MAX_AGE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, kind: str, key: str) -> str:
+        return os.path.join(self.directory, kind, key[:2], f"{key}.json")
+
+    def get(self, kind: str, key: str) -> Optional[Any]:
+        try:
+            with open(self.path(kind, key), 'r', encoding='utf-8') as f:
+                value = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            # NB: the modification time records when an artifact was last used
+            os.utime(self.path(kind, key))
+        except FileNotFoundError:
+            pass
+        return value
+
+    def put(self, kind: str, key: str, value: Any):
+        path = self.path(kind, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # NB: written to a unique temporary file, since other processes
+        # and threads may be writing the same key
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def prune(self) -> int:
+        """Remove artifacts unused for `max_age` seconds, then the least
+        recently used until the cache is within `max_bytes`, returning how
+        many were removed"""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        now, total, removed = time.time(), sum(size for _, size, _ in files), 0
+        for mtime, size, path in files:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        return removed
+
+    def artifact(self, kind: str, key: str, build: Callable[[], Any]) -> Any:
+        """Get a cached artifact, or build and cache it"""
+        value = self.get(kind, key)
+        if value is None:
+            value = build()
+            self.put(kind, key, value)
+        return value
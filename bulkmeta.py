@@ -0,0 +1,129 @@
+"""Bulk import and export of item titles and scope notes as CSV or NDJSON.
+
+Rows are read and written one at a time, so files of any number of rows
+can be handled in memory proportional to the collection, not the file.
+Imports are all or nothing: every row is read and checked before any
+value is set.
+Each row holds an item `id` and any of the item value columns. On import
+a value column that is present but empty clears that value; one that is
+absent leaves it unchanged."""
+import csv
+import json
+import os
+from dataclasses import dataclass, field
+from typing import TextIO, Iterator, Tuple, Dict, Iterable, List
+
+from microarchive import ItemData, ALL_ITEM_KEYS
+
+CSV = "csv"
+NDJSON = "ndjson"
+EXTENSIONS = {".csv": CSV, ".ndjson": NDJSON, ".jsonl": NDJSON}
+ID = "id"
+FIELDS = [ID] + ALL_ITEM_KEYS
+# How many unknown or missing ids to list in a report
+MAX_REPORTED = 20
+
+
+def guess_format(filename: str) -> str:
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in EXTENSIONS:
+        raise ValueError(f"Unknown item metadata format: {filename} (expected one of {', '.join(EXTENSIONS)})")
+    return EXTENSIONS[ext]
+
+
+@dataclass
+class ImportReport:
+    """The outcome of an import. Unknown ids are those in the file but not
+    the collection, missing ids those in the collection but not the file;
+    only the first `MAX_REPORTED` of each are listed."""
+    rows: int = 0
+    updated: int = 0
+    unknown_count: int = 0
+    unknown: List[str] = field(default_factory=list)
+    missing_count: int = 0
+    missing: List[str] = field(default_factory=list)
+
+    def summary(self) -> str:
+        lines = [f"Read {self.rows} rows, updating {self.updated} items"]
+        if self.unknown_count:
+            lines.append(f"{self.unknown_count} unknown ids: {', '.join(self.unknown)}"
+                         + ("..." if self.unknown_count > len(self.unknown) else ""))
+        if self.missing_count:
+            lines.append(f"{self.missing_count} items not in file: {', '.join(self.missing)}"
+                         + ("..." if self.missing_count > len(self.missing) else ""))
+        return "\n".join(lines)
+
+
+def read_rows(stream: TextIO, fmt: str) -> Iterator[Tuple[str, Dict[str, str]]]:
+    """Read the (id, values) of each row, ignoring unrecognised columns"""
+    if fmt == CSV:
+        rows = csv.DictReader(stream)
+        if rows.fieldnames is None or ID not in rows.fieldnames:
+            raise ValueError(f"CSV item metadata must have an '{ID}' column")
+    elif fmt == NDJSON:
+        rows = (json.loads(line) for line in stream if line.strip())
+    else:
+        raise ValueError(f"Unknown item metadata format: {fmt}")
+    num = 0
+    while True:
+        num += 1
+        try:
+            row = next(rows)
+        except StopIteration:
+            return
+        except ValueError as e:
+            raise ValueError(f"Row {num} is not valid JSON: {e}")
+        if not isinstance(row, dict):
+            raise ValueError(f"Row {num} is not an object")
+        ident = row.get(ID)
+        if not ident or not isinstance(ident, str):
+            raise ValueError(f"Row {num} has no '{ID}'")
+        values = {key: row[key] or "" for key in ALL_ITEM_KEYS if key in row}
+        if not all(isinstance(value, str) for value in values.values()):
+            raise ValueError(f"Row {num} has values that are not text")
+        yield ident, values
+
+
+def import_items(stream: TextIO, fmt: str, data: ItemData, ids: Iterable[str]) -> ImportReport:
+    """Set item values from a file, for items with the given `ids` only.
+    The whole file is read before any values are set, so if it has an
+    invalid row a `ValueError` is raised and nothing is changed."""
+    known = set(ids)
+    report = ImportReport()
+    imported: Dict[str, Dict[str, str]] = {}
+    for ident, values in read_rows(stream, fmt):
+        report.rows += 1
+        if ident not in known:
+            report.unknown_count += 1
+            if len(report.unknown) < MAX_REPORTED:
+                report.unknown.append(ident)
+            continue
+        imported[ident] = imported.get(ident, {}) | values
+    for ident, values in imported.items():
+        changed = [data.set(ident, key, value) for key, value in values.items()]
+        if any(changed):
+            report.updated += 1
+    for ident in sorted(known - set(imported)):
+        report.missing_count += 1
+        if len(report.missing) < MAX_REPORTED:
+            report.missing.append(ident)
+    return report
+
+
+def export_items(out: TextIO, fmt: str, data: ItemData, ids: Iterable[str]) -> int:
+    """Write the values of the items with the given `ids`, including those
+    with no values, so the file can be filled in. Returns the row count."""
+    if fmt == CSV:
+        writer = csv.DictWriter(out, FIELDS)
+        writer.writeheader()
+        write = writer.writerow
+    elif fmt == NDJSON:
+        def write(row: Dict[str, str]):
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+    else:
+        raise ValueError(f"Unknown item metadata format: {fmt}")
+    count = 0
+    for ident in ids:
+        write({ID: ident} | {key: data.get(ident, key) for key in ALL_ITEM_KEYS})
+        count += 1
+    return count
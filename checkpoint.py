@@ -0,0 +1,142 @@
+"""A local journal of completed uploads, so that an interrupted publish can
+be resumed without uploading again what it already had.
+
+The journal is a file of JSON lines, each flushed to disk as it is written,
+recording the content hash of each file uploaded, and the id and completed
+parts of each multipart upload. A rerun skips files whose content hash
+matches one recorded, and continues multipart uploads of unchanged content
+from their next part. The journal is removed once a publish completes.
+
+An open journal holds an exclusive lock on its file, so only one publish
+at a time can upload to a site. NB: files are not locked on Windows."""
+import hashlib
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class JournalLocked(Exception):
+    def __init__(self, path: str):
+        super(JournalLocked, self).__init__(f"Upload journal in use by another publish: {path}")
+        self.path = path
+
+
+@dataclass
+class Multipart:
+    upload_id: str
+    sha1: str
+    parts: Dict[int, str] = field(default_factory=dict)
+
+
+class Journal:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done: Dict[str, str] = {}
+        self.multipart: Dict[str, Multipart] = {}
+        self.file = self.acquire()
+        self.file.seek(0)
+        for line in self.file:
+            try:
+                self.apply(json.loads(line))
+            except ValueError:
+                # NB: the last line may be incomplete after a crash
+                break
+
+    def acquire(self):
+        """Open the journal file, taking an exclusive lock on it. Raises
+        `JournalLocked` if another journal holds the lock."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        while True:
+            f = open(self.path, 'a+', encoding='utf-8')
+            if fcntl is None:
+                return f
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                raise JournalLocked(self.path)
+            # NB: the holder of the lock may have removed the file before
+            # releasing it, in which case a new one is opened
+            try:
+                if os.stat(self.path).st_ino == os.fstat(f.fileno()).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close()
+
+    @classmethod
+    def open(cls, directory: str, bucket: str, origin: str) -> 'Journal':
+        """The journal of uploads to a site origin"""
+        name = hashlib.sha1(f"{bucket}/{origin.strip('/')}".encode('utf-8')).hexdigest()[:16]
+        return cls(os.path.join(directory, f"{name}.jsonl"))
+
+    def apply(self, entry: Dict):
+        key = entry["key"]
+        if entry["op"] == "put":
+            self.done[key] = entry["sha1"]
+            self.multipart.pop(key, None)
+        elif entry["op"] == "start":
+            self.multipart[key] = Multipart(entry["upload_id"], entry["sha1"])
+        elif entry["op"] == "part":
+            upload = self.multipart.get(key)
+            if upload and upload.upload_id == entry["upload_id"]:
+                upload.parts[entry["number"]] = entry["etag"]
+        elif entry["op"] == "abort":
+            self.multipart.pop(key, None)
+
+    def record(self, **entry):
+        with self.lock:
+            if self.file is None:
+                raise ValueError(f"Upload journal is closed: {self.path}")
+            self.apply(entry)
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def is_done(self, key: str, sha1: str) -> bool:
+        return self.done.get(key) == sha1
+
+    def resumable(self, key: str, sha1: str) -> Optional[Multipart]:
+        """The multipart upload in progress for this content, if any"""
+        upload = self.multipart.get(key)
+        return upload if upload and upload.sha1 == sha1 else None
+
+    def put(self, key: str, sha1: str):
+        self.record(op="put", key=key, sha1=sha1)
+
+    def start(self, key: str, sha1: str, upload_id: str):
+        self.record(op="start", key=key, sha1=sha1, upload_id=upload_id)
+
+    def part(self, key: str, upload_id: str, number: int, etag: str):
+        self.record(op="part", key=key, upload_id=upload_id, number=number, etag=etag)
+
+    def abort(self, key: str):
+        self.record(op="abort", key=key)
+
+    def close(self):
+        """Close the journal file, releasing its lock"""
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def clear(self):
+        """Remove the journal, once everything it covers is uploaded, and
+        close it"""
+        with self.lock:
+            if self.file is not None:
+                # NB: removed while still locked, so no other publish
+                # can open it in between
+                os.remove(self.path)
+                self.file.close()
+                self.file = None
+            self.done.clear()
+            self.multipart.clear()
@@ -1,13 +1,46 @@
+import multiprocessing
 import re
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date
 from typing import List, Optional
 from xml.etree import ElementTree as ET
 
-import langcodes
-
+import languages
+from buildcache import BuildCache, CACHE_VERSION, fingerprint, subtree
 from microarchive import MicroArchive, Item
 
 
+# The nesting level of top-level components: ead/archdesc/dsc/c01
+COMPONENT_LEVEL = 3
+COMPONENTS_PLACEHOLDER = "components-placeholder"
+
+
+def make_component(child: Item, parent: ET.Element, num: int) -> ET.Element:
+    """Add a component (and its children) for an item to the parent element"""
+    c = ET.SubElement(parent, "c{:02d}".format(num), {'level': 'otherlevel'})
+    did = ET.SubElement(c, 'did')
+    unitid = ET.SubElement(did, 'unitid')
+    unitid.text = child.id
+    if child.identity.title:
+        unittitle = ET.SubElement(did, 'unittitle')
+        unittitle.text = child.identity.title
+    if child.content.scope:
+        scopecontent = ET.SubElement(c, "scopecontent")
+        scopecontent_p = ET.SubElement(scopecontent, "p")
+        scopecontent_p.text = child.content.scope
+    for cc in child.items:
+        make_component(cc, c, num + 1)
+    return c
+
+
+def component_xml(item: Item) -> str:
+    """Serialize a top-level component, indented as it would be within
+    a full EAD document"""
+    c = make_component(item, ET.Element('dsc'), 1)
+    ET.indent(c, space="  ", level=COMPONENT_LEVEL)
+    return ET.tostring(c, encoding="unicode")
+
+
 class Ead():
     def __init__(self):
         pass
@@ -18,7 +51,31 @@ class Ead():
         blanks = r'\r?\n\s*\n'
         return re.split(blanks, text.strip())
 
-    def to_xml(self, data: MicroArchive, url: Optional[str] = None) -> str:
+    @staticmethod
+    def components(items: List[Item], workers: int, cache: Optional[BuildCache] = None) -> List[str]:
+        """Serialize top-level components, reusing any cached ones"""
+        keys = [fingerprint(CACHE_VERSION, subtree(item)) for item in items] if cache is not None else []
+        fragments = [cache.get("ead", key) for key in keys] if cache is not None else [None] * len(items)
+        missing = [i for i, fragment in enumerate(fragments) if fragment is None]
+        if workers > 1 and len(missing) > 1:
+            # NB: worker processes are spawned, since forking a process
+            # with other threads running, such as the app's, is unsafe
+            with ProcessPoolExecutor(min(workers, len(missing)), multiprocessing.get_context("spawn")) as pool:
+                built = list(pool.map(component_xml, [items[i] for i in missing]))
+        else:
+            built = [component_xml(items[i]) for i in missing]
+        for i, fragment in zip(missing, built):
+            fragments[i] = fragment
+            if cache is not None:
+                cache.put("ead", keys[i], fragment)
+        return fragments
+
+    def to_xml(self, data: MicroArchive, url: Optional[str] = None, workers: int = 1,
+               cache: Optional[BuildCache] = None) -> str:
+        """Render the archive as EAD XML. If `workers` is more than one the
+        top-level components are serialized in parallel on that many
+        processes. If a `cache` is given, unchanged top-level components
+        are reused."""
         now = date.today()
         root = ET.Element("ead", {
             'xmlns': 'urn:isbn:1-931666-22-9',
@@ -69,9 +126,9 @@ class Ead():
         if data.description.lang:
             langmaterial = ET.SubElement(did, 'langmaterial')
             for lang in data.description.lang:
-                langdata = langcodes.get(lang)
-                language = ET.SubElement(langmaterial, 'language', {'langcode': langdata.to_alpha3()})
-                language.text = langdata.display_name()
+                langdata = languages.lookup(lang)
+                language = ET.SubElement(langmaterial, 'language', {'langcode': langdata.alpha3})
+                language.text = langdata.name
         if data.description.biog:
             bioghist = ET.SubElement(archdesc, 'bioghist')
             for ptext in self.paragraphs(data.description.biog):
@@ -95,23 +152,19 @@ class Ead():
 
         if data.items:
             dsc = ET.SubElement(archdesc, 'dsc')
-            for item in data.hierarchical_items():
-                def make_child(child: Item, parent: ET.Element, num: int):
-                    c = ET.SubElement(parent, "c{:02d}".format(num), {'level': 'otherlevel'})
-                    did = ET.SubElement(c, 'did')
-                    unitid = ET.SubElement(did, 'unitid')
-                    unitid.text = child.id
-                    if child.identity.title:
-                        unittitle = ET.SubElement(did, 'unittitle')
-                        unittitle.text = child.identity.title
-                    if child.content.scope:
-                        scopecontent = ET.SubElement(c, "scopecontent")
-                        scopecontent_p = ET.SubElement(scopecontent, "p")
-                        scopecontent_p.text = child.content.scope
-                    for cc in child.items:
-                        make_child(cc, c, num + 1)
+            items = data.hierarchical_items()
+            if cache is not None or (workers > 1 and len(items) > 1):
+                # Indent and serialize everything but the top-level components,
+                # which are taken from the cache or serialized, in parallel if
+                # there are several workers, and spliced into the output
+                ET.SubElement(dsc, COMPONENTS_PLACEHOLDER)
+                ET.indent(root, space="  ", level=0)
+                fragments = self.components(items, workers, cache)
+                return ET.tostring(root, encoding="unicode").replace(
+                    f"<{COMPONENTS_PLACEHOLDER} />", ("\n" + "  " * COMPONENT_LEVEL).join(fragments))
 
-                make_child(item, dsc, 1)
+            for item in items:
+                make_component(item, dsc, 1)
 
         ET.indent(root, space="  ", level=0)
         return ET.tostring(root, encoding="unicode")
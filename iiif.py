@@ -1,34 +1,118 @@
 """Render a MicroArchive as a IIIF manifest"""
-from dataclasses import dataclass
-from typing import Union
+import bisect
+import hashlib
+import json
+from dataclasses import dataclass, field
+from typing import Union, Optional, List, Dict, Iterable
 from urllib.parse import quote_plus
 
-from iiif_prezi3 import Manifest, Canvas, CanvasRef, Annotation, AnnotationPage, ResourceItem, Range
-
 from microarchive import MicroArchive, Item
 
+# The compliance level assumed for the image server
+SERVICE_PROFILE = "level1"
+# The scale factors of the tiles hint, if a tile size is given
+SCALE_FACTORS = [1, 2, 4, 8, 16]
+# The number of points each server has on the hash ring. More points
+# spread images more evenly between servers.
+RING_POINTS = 160
+
+
+def ring_hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], "big")
+
+
+class ServerRing:
+    """A consistent hash ring of image server URLs, mapping each image to
+    one server, so that adding or removing a server moves only the images
+    on its share of the ring. Images are hashed on their storage key less
+    its extension, so listings and manifests agree even when the image
+    format differs from that of the stored file."""
+
+    def __init__(self, servers: Union[str, List[str]], points: int = RING_POINTS):
+        self.servers = [servers] if isinstance(servers, str) else list(servers)
+        if not self.servers:
+            raise ValueError("At least one image server URL is required")
+        ring = sorted((ring_hash(f"{server}#{i}"), server) for server in self.servers for i in range(points))
+        self.hashes = [h for h, _ in ring]
+        self.points = [server for _, server in ring]
+
+    def server(self, key: str) -> str:
+        """The URL of the server for the given key"""
+        if len(self.servers) == 1:
+            return self.servers[0]
+        i = bisect.bisect(self.hashes, ring_hash(key))
+        return self.points[i % len(self.points)]
+
+    def indices(self, keys: Iterable[str]) -> List[int]:
+        """The position in `servers` of the server for each key"""
+        positions = {server: i for i, server in enumerate(self.servers)}
+        hashes, points = self.hashes, self.points
+        return [positions[points[bisect.bisect(hashes, ring_hash(key)) % len(points)]] for key in keys]
+
+
+def image_service(server_url: str, key: str) -> str:
+    """The IIIF Image API service id of the image with the given storage key"""
+    return server_url + quote_plus(key)
+
+
+def image_url(service: str, size: str = "max", region: str = "full", rotation: int = 0,
+              quality: str = "default", fmt: str = "jpg") -> str:
+    """A IIIF Image API request for an image from the given service"""
+    return f"{service}/{region}/{size}/{rotation}/{quality}.{fmt}"
+
 
 @dataclass
 class IIIFManifest:
     baseurl: str
     name: str
-    service_url: str
+    # One image server URL, or several to spread images between
+    service_url: Union[str, List[str]]
     image_format: str
     prefix: str
     width: int = 768
     height: int = 1024
+    # Optional hints for viewers, added to each image service, saving them
+    # a request for the image information. See the IIIF Image API.
+    tile_size: Optional[int] = None
+    sizes: Optional[List[Dict[str, int]]] = None
+    ring: ServerRing = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.ring = ServerRing(self.service_url)
+
+    def canvas_id(self, item_id: str) -> str:
+        """The canvas id for the item with the given id. NB: canvases are
+        identified within the manifest's site rather than by image server,
+        so ids are stable whichever servers the images are spread between."""
+        return f"{self.baseurl}/{self.name}/canvas/{quote_plus(self.prefix + item_id)}"
+
+    def service_id(self, item_id: str) -> str:
+        """The image service id for the item with the given id"""
+        server = self.ring.server(self.prefix + item_id)
+        return image_service(server, self.prefix + item_id + self.image_format)
+
+    def hints(self) -> Dict:
+        hints = {}
+        if self.sizes:
+            hints["sizes"] = self.sizes
+        if self.tile_size:
+            hints["tiles"] = [{"width": self.tile_size, "scaleFactors": SCALE_FACTORS}]
+        return hints
 
     def to_json(self, data: MicroArchive) -> str:
+        from iiif_prezi3 import Manifest, Canvas, CanvasRef, Annotation, AnnotationPage, ResourceItem, Range, \
+            ServiceItem
 
         manifest_items = []
         for item in data.items:
-            canvas_ref = self.service_url + quote_plus(self.prefix + item.id)
+            canvas_ref = self.canvas_id(item.id)
+            service = self.service_id(item.id)
             canvas = Canvas(
                 id=canvas_ref,
                 label={"en": [item.identity.title or item.id]},
-                thumbnail=[dict(id=f"{canvas_ref}{self.image_format}/full/!100,150/0/default.jpg", type="Image", format="image/jpeg")],
-                height=self.width,
-                width=self.height,
+                thumbnail=[dict(id=image_url(service, "!100,150"), type="Image", format="image/jpeg")],
+                height=self.height,
+                width=self.width,
                 items=[
                     AnnotationPage(
                         id=f"{canvas_ref}/page",
@@ -37,10 +121,14 @@ class IIIFManifest:
                                 id=f"{canvas_ref}/ann1",
                                 motivation="painting",
                                 target=canvas_ref,
+                                # NB: with an image service viewers request only
+                                # the tiles they need rather than the full image
                                 body=ResourceItem(
-                                    id=f"{canvas_ref}{self.image_format}/full/max/0/default.jpg",
+                                    id=image_url(service),
                                     type="Image",
-                                    format="image/jpeg"
+                                    format="image/jpeg",
+                                    service=[ServiceItem(id=service, type="ImageService3",
+                                                         profile=SERVICE_PROFILE)]
                                 )
                             )
                         ]
@@ -51,13 +139,13 @@ class IIIFManifest:
 
         manifest_structures = []
         for item in data.hierarchical_items():
-            def make_range(item: Item) -> Union[Range, CanvasRef]:
+            def make_range(item: Item) -> Union['Range', 'CanvasRef']:
                 if item.items:
                     return Range(id=f"{self.baseurl}/{self.name}/range/{quote_plus(item.id)}",
                                   label={"en": [item.identity.title]},
                                   items=[make_range(i) for i in item.items])
                 else:
-                    return CanvasRef(id=self.service_url + quote_plus(self.prefix + item.id),
+                    return CanvasRef(id=self.canvas_id(item.id),
                                      type="Canvas", label={"en": [item.identity.title or item.id]})
             if item.items:
                 manifest_structures.append(make_range(item))
@@ -78,4 +166,14 @@ class IIIFManifest:
             items=manifest_items,
             structures=manifest_structures)
 
-        return manifest.json(indent=2)
+        hints = self.hints()
+        if not hints:
+            return manifest.json(indent=2)
+        # The service model drops properties it doesn't define, so add the hints to the output
+        output = json.loads(manifest.json())
+        for canvas in output["items"]:
+            for page in canvas["items"]:
+                for annotation in page["items"]:
+                    for service in annotation["body"]["service"]:
+                        service.update(hints)
+        return json.dumps(output, indent=2)
@@ -0,0 +1,126 @@
+"""Lightweight per-stage timing and resource instrumentation"""
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import Optional, List, Dict, TextIO, Iterator
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def max_rss() -> Optional[int]:
+    """The peak resident set size of this process, in bytes"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # NB: reported in kilobytes on Linux, but bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+@dataclass
+class Stage:
+    name: str
+    seconds: float = 0.0
+    peak_bytes: Optional[int] = None
+    max_rss: Optional[int] = None
+    api_calls: int = 0
+    upload_bytes: int = 0
+
+    def to_dict(self) -> Dict:
+        return {k: v for k, v in asdict(self).items() if v is not None}
+
+
+class Recorder:
+    """Records the wall time, memory and AWS API usage of named stages.
+
+    Stages are run sequentially in a `with recorder.stage(name)` block. If
+    `trace_memory` is set the peak traced Python allocation of each stage is
+    recorded too, though this slows things down considerably. If `out` is
+    given each stage is written to it as a JSON line when it finishes, and
+    closed with the recorder, unless it is standard output or error."""
+    def __init__(self, trace_memory: bool = False, out: Optional[TextIO] = None, **labels):
+        self.trace_memory = trace_memory
+        self.out = out
+        self.labels = labels
+        self.stages: List[Stage] = []
+        self.current: Optional[Stage] = None
+        self.lock = threading.Lock()
+
+    def __enter__(self) -> 'Recorder':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.out and self.out not in (sys.stdout, sys.stderr):
+            self.out.close()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Stage]:
+        stage = Stage(name)
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        self.current = stage
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.seconds = round(time.perf_counter() - start, 4)
+            if self.trace_memory:
+                stage.peak_bytes = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+            stage.max_rss = max_rss()
+            self.current = None
+            self.stages.append(stage)
+            if self.out:
+                print(json.dumps(self.labels | stage.to_dict()), file=self.out, flush=True)
+
+    def count(self, calls: int = 0, nbytes: int = 0):
+        """Add API calls and uploaded bytes to the current stage"""
+        with self.lock:
+            if self.current:
+                self.current.api_calls += calls
+                self.current.upload_bytes += nbytes
+
+    @contextmanager
+    def watch(self, *clients):
+        """Count the API calls made, and bytes sent, by the given boto3
+        clients. NB: clients shared between threads will also count calls
+        made by other threads while the block is active."""
+        def handler(params: Dict, **kwargs):
+            body = params.get("Body")
+            if isinstance(body, str):
+                # NB: sent as UTF-8, so counted in bytes not characters
+                body = body.encode("utf-8")
+            self.count(calls=1, nbytes=len(body) if isinstance(body, bytes) else 0)
+
+        # NB: the earliest event, before botocore wraps the body in a file object
+        for client in clients:
+            client.meta.events.register("provide-client-params", handler)
+        try:
+            yield self
+        finally:
+            for client in clients:
+                client.meta.events.unregister("provide-client-params", handler)
+
+    def total(self) -> Stage:
+        return Stage("total",
+                     seconds=round(sum(s.seconds for s in self.stages), 4),
+                     max_rss=max_rss(),
+                     api_calls=sum(s.api_calls for s in self.stages),
+                     upload_bytes=sum(s.upload_bytes for s in self.stages))
+
+    def rows(self) -> List[Dict]:
+        """The recorded stages, plus a total"""
+        return [s.to_dict() for s in self.stages + [self.total()]]
@@ -0,0 +1,125 @@
+"""Read dataset listings from S3 Inventory reports, rather than listing
+large buckets key by key.
+
+An inventory report is a `manifest.json` naming the report's data files,
+which are gzipped CSV, ORC or Parquet. These are read a batch of rows at
+a time with pyarrow, keeping only the current versions of keys under a
+dataset prefix. NB: inventory keys in CSV reports are URL-encoded."""
+import json
+import re
+from dataclasses import dataclass
+from typing import List, Dict, Iterator, BinaryIO, Optional
+from urllib.parse import unquote_plus
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+CSV = "CSV"
+ORC = "ORC"
+PARQUET = "Parquet"
+MANIFEST = "manifest.json"
+# The number of rows read at once from CSV and Parquet files
+BATCH_ROWS = 100_000
+
+
+def column_name(name: str) -> str:
+    """Normalize a CSV schema field name, e.g. IsLatest, to the name of the
+    same field in ORC and Parquet reports, e.g. is_latest"""
+    return re.sub(r'(?<=[a-z])(?=[A-Z])', '_', name.strip()).lower()
+
+
+@dataclass
+class Manifest:
+    source_bucket: str
+    destination_bucket: str
+    file_format: str
+    columns: List[str]
+    files: List[str]
+
+    @classmethod
+    def parse(cls, data: Dict) -> 'Manifest':
+        fmt = data["fileFormat"]
+        schema = data["fileSchema"]
+        if fmt == CSV:
+            columns = [column_name(name) for name in schema.split(",")]
+        elif fmt == ORC:
+            # e.g. struct<bucket:string,key:string,size:bigint>
+            columns = re.findall(r'[<,]\s*(\w+)\s*:', schema)
+        elif fmt == PARQUET:
+            # e.g. message s3.inventory { required binary bucket (STRING); ... }
+            columns = re.findall(r'\b(?:required|optional)\s+\w+\s+(\w+)', schema)
+        else:
+            raise ValueError(f"Unknown inventory format: {fmt}")
+        return cls(
+            source_bucket=data["sourceBucket"],
+            # NB: an ARN, e.g. arn:aws:s3:::bucket-name
+            destination_bucket=data["destinationBucket"].split(":")[-1],
+            file_format=fmt,
+            columns=columns,
+            files=[f["key"] for f in data["files"]]
+        )
+
+    @classmethod
+    def load(cls, stream: BinaryIO) -> 'Manifest':
+        return cls.parse(json.load(stream))
+
+
+def decode_keys(keys: pa.Array) -> pa.Array:
+    """URL-decode CSV inventory keys, replacing only slashes and spaces
+    where that is enough, and decoding any others with `unquote_plus`"""
+    decoded = pc.replace_substring(pc.replace_substring(keys, "+", " "), "%2F", "/")
+    other = pc.match_substring(decoded, "%")
+    if pc.any(other).as_py():
+        encoded = keys.filter(other).to_pylist()
+        decoded = pc.replace_with_mask(decoded, other, pa.array([unquote_plus(key) for key in encoded], pa.string()))
+    return decoded
+
+
+def current_keys(batch: pa.RecordBatch, prefix: str, encoded: bool = False) -> List[str]:
+    """The keys of the current, non-deleted objects under `prefix` in a batch"""
+    names = batch.schema.names
+    keys = batch.column(names.index("key"))
+    if encoded:
+        keys = decode_keys(keys)
+    keep = pc.starts_with(keys, prefix)
+    if "is_latest" in names:
+        keep = pc.and_(keep, pc.equal(batch.column(names.index("is_latest")), True))
+    if "is_delete_marker" in names:
+        keep = pc.and_(keep, pc.invert(pc.equal(batch.column(names.index("is_delete_marker")), True)))
+    return keys.filter(pc.fill_null(keep, False)).to_pylist()
+
+
+def read_keys(source: BinaryIO, manifest: Manifest, prefix: str) -> Iterator[List[str]]:
+    """Read the keys under `prefix` from an inventory data file, a batch at a
+    time. CSV files are read as a stream; ORC and Parquet files need to be
+    seekable, since their metadata is at the end."""
+    wanted = [c for c in ["key", "is_latest", "is_delete_marker"] if c in manifest.columns]
+    if manifest.file_format == CSV:
+        from pyarrow import csv
+        reader = csv.open_csv(
+            pa.CompressedInputStream(pa.PythonFile(source, mode='r'), "gzip"),
+            read_options=csv.ReadOptions(column_names=manifest.columns, block_size=BATCH_ROWS * 100),
+            convert_options=csv.ConvertOptions(
+                include_columns=wanted,
+                column_types={"key": pa.string(), "is_latest": pa.bool_(), "is_delete_marker": pa.bool_()},
+                true_values=["true"], false_values=["false"]))
+        for batch in reader:
+            yield current_keys(batch, prefix, encoded=True)
+    elif manifest.file_format == ORC:
+        from pyarrow import orc
+        f = orc.ORCFile(source)
+        for i in range(f.nstripes):
+            yield current_keys(f.read_stripe(i, columns=wanted), prefix)
+    elif manifest.file_format == PARQUET:
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=BATCH_ROWS, columns=wanted):
+            yield current_keys(batch, prefix)
+    else:
+        raise ValueError(f"Unknown inventory format: {manifest.file_format}")
+
+
+def latest(manifest_keys: List[str]) -> Optional[str]:
+    """The key of the most recent manifest, given those under a report's
+    configuration prefix, which are in dated directories"""
+    keys = [key for key in manifest_keys if key.endswith("/" + MANIFEST) and "/hive/" not in key]
+    return max(keys) if keys else None
@@ -0,0 +1,241 @@
+"""Run long jobs, such as publishing, in the background.
+
+Each job's state is kept in a JSON file in the runner's directory, so it
+survives the process restarting. A job's input data, which may be large,
+is written once to a separate file, only read by the job itself, and
+removed once the job is done. Finished jobs are forgotten after a
+retention period. Jobs report their progress stage by stage, which can
+be polled, and are cancelled cooperatively: a job stops at its next
+stage, or its next call to `JobContext.check`. A job that was cancelled,
+failed, or interrupted by the process stopping can be resumed, in which
+case its handler can skip the stages it already completed."""
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Callable, Iterator
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+INTERRUPTED = "interrupted"
+FINISHED = {DONE, FAILED, CANCELLED, INTERRUPTED}
+# How long finished jobs are kept, in seconds
+RETENTION = 7 * 24 * 60 * 60
+
+
+class JobCancelled(Exception):
+    def __init__(self, job_id: str):
+        super(JobCancelled, self).__init__(f"Job cancelled: {job_id}")
+        self.job_id = job_id
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    params: Dict
+    status: str = QUEUED
+    stage: Optional[str] = None
+    message: str = ""
+    completed: List[str] = field(default_factory=list)
+    state: Dict = field(default_factory=dict)
+    result: Optional[Dict] = None
+    error: Optional[str] = None
+    cancel: bool = False
+    created: float = field(default_factory=time.time)
+    updated: float = field(default_factory=time.time)
+
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Job':
+        return cls(**data)
+
+
+class JobContext:
+    """A running job, as seen by its handler"""
+    def __init__(self, runner: 'JobRunner', job: Job):
+        self.runner = runner
+        self.job = job
+        self._data: Optional[Dict] = None
+
+    @property
+    def params(self) -> Dict:
+        return self.job.params
+
+    @property
+    def data(self) -> Optional[Dict]:
+        """The data the job was submitted with, if any"""
+        if self._data is None:
+            self._data = self.runner.load_data(self.job.id)
+        return self._data
+
+    @property
+    def state(self) -> Dict:
+        """Values saved with the job, which are kept if it is resumed"""
+        return self.job.state
+
+    def check(self):
+        """Raise `JobCancelled` if the job has been cancelled"""
+        if self.job.cancel:
+            raise JobCancelled(self.job.id)
+
+    def done(self, stage: str) -> bool:
+        """Whether a stage was completed, possibly by an earlier run"""
+        return stage in self.job.completed
+
+    def progress(self, message: str):
+        self.check()
+        self.job.message = message
+        self.runner.save(self.job)
+
+    @contextmanager
+    def stage(self, name: str, message: str = "") -> Iterator['JobContext']:
+        """Run a stage of the job, saving its state afterwards"""
+        self.check()
+        self.job.stage = name
+        self.job.message = message
+        self.runner.save(self.job)
+        yield self
+        if name not in self.job.completed:
+            self.job.completed.append(name)
+        self.runner.save(self.job)
+
+
+class JobRunner:
+    """Runs jobs on a thread pool, keeping their state in `directory`.
+
+    `handlers` maps each kind of job to the function that runs it, which
+    is passed a `JobContext` and returns the job result. NB: only one runner
+    should use a directory, since any jobs it finds queued or running when
+    it starts are assumed to have been interrupted."""
+    def __init__(self, directory: str, handlers: Dict[str, Callable[[JobContext], Optional[Dict]]],
+                 workers: int = 2, retention: float = RETENTION):
+        self.directory = directory
+        self.handlers = handlers
+        self.lock = threading.Lock()
+        self.jobs: Dict[str, Job] = {}
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="job")
+        os.makedirs(directory, exist_ok=True)
+        for filename in os.listdir(directory):
+            if filename.endswith(".json"):
+                with open(os.path.join(directory, filename), 'r') as f:
+                    job = Job.from_dict(json.load(f))
+                if job.finished() and time.time() - job.updated > retention:
+                    self.remove(job.id)
+                    continue
+                self.jobs[job.id] = job
+                if not job.finished():
+                    job.status = INTERRUPTED
+                    self.save(job)
+
+    def save(self, job: Job):
+        """Persist a job's state, replacing the file atomically"""
+        with self.lock:
+            job.updated = time.time()
+            path = os.path.join(self.directory, f"{job.id}.json")
+            with open(path + ".tmp", 'w') as f:
+                json.dump(job.to_dict(), f, default=str)
+            os.replace(path + ".tmp", path)
+
+    def remove(self, job_id: str):
+        """Remove a job's files"""
+        for path in [os.path.join(self.directory, f"{job_id}.json"), self.data_path(job_id)]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def data_path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.data")
+
+    def load_data(self, job_id: str) -> Optional[Dict]:
+        """The data a job was submitted with, if any"""
+        if not os.path.exists(self.data_path(job_id)):
+            return None
+        with open(self.data_path(job_id), 'r') as f:
+            return json.load(f)
+
+    def submit(self, kind: str, params: Dict, data: Optional[Dict] = None) -> Job:
+        """Run a job. Its `params` are kept with its state, so should be
+        small; any larger input, such as the data to publish, is passed as
+        `data`, which the job reads with `JobContext.data`."""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job = Job(uuid.uuid4().hex, kind, params)
+        if data is not None:
+            path = self.data_path(job.id)
+            with open(path + ".tmp", 'w') as f:
+                json.dump(data, f, default=str)
+            os.replace(path + ".tmp", path)
+        with self.lock:
+            self.jobs[job.id] = job
+        self.save(job)
+        self.executor.submit(self._run, job)
+        return self.get(job.id)
+
+    def _run(self, job: Job):
+        if job.cancel:
+            job.status = CANCELLED
+            self.save(job)
+            return
+        job.status = RUNNING
+        self.save(job)
+        try:
+            job.result = self.handlers[job.kind](JobContext(self, job))
+            job.status, job.stage, job.message = DONE, None, ""
+            # NB: a done job can't be resumed, so its data is no longer needed
+            if os.path.exists(self.data_path(job.id)):
+                os.remove(self.data_path(job.id))
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            job.status = FAILED
+            job.error = "".join(traceback.format_exception_only(type(e), e)).strip()
+            traceback.print_exc()
+        self.save(job)
+
+    @staticmethod
+    def snapshot(job: Job) -> Job:
+        return Job.from_dict(json.loads(json.dumps(job.to_dict(), default=str)))
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """A snapshot of a job's current state"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return self.snapshot(job) if job else None
+
+    def list(self) -> List[Job]:
+        with self.lock:
+            jobs = [self.snapshot(job) for job in self.jobs.values()]
+        return sorted(jobs, key=lambda job: job.created)
+
+    def cancel(self, job_id: str):
+        """Ask a job to stop. It will do so at its next stage or check."""
+        job = self.jobs[job_id]
+        if not job.finished():
+            job.cancel = True
+            self.save(job)
+
+    def resume(self, job_id: str) -> Job:
+        """Re-run a job that did not complete, keeping the stages it finished"""
+        job = self.jobs[job_id]
+        if job.status not in FINISHED - {DONE}:
+            raise ValueError(f"Job cannot be resumed: {job_id} ({job.status})")
+        job.status, job.cancel, job.error = QUEUED, False, None
+        self.save(job)
+        self.executor.submit(self._run, job)
+        return self.get(job_id)
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
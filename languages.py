@@ -0,0 +1,65 @@
+"""The languages a collection can be described in, with their display
+names and ISO 639-2 codes.
+
+Looking these up with langcodes is slow, so the table is loaded once per
+process from a generated data file. Run this module to regenerate the
+file after upgrading langcodes."""
+import functools
+import json
+import os
+from dataclasses import dataclass
+from typing import Dict, List
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "languages.json")
+
+
+@dataclass(frozen=True)
+class Language:
+    code: str
+    name: str
+    alpha3: str
+
+
+def build() -> Dict[str, Language]:
+    """Build the table from langcodes' data, sorted by code"""
+    import langcodes
+    table = {}
+    for code in sorted(langcodes.LANGUAGE_ALPHA3):
+        data = langcodes.get(code)
+        table[code] = Language(code, data.display_name(), data.to_alpha3())
+    return table
+
+
+@functools.lru_cache(maxsize=None)
+def table() -> Dict[str, Language]:
+    """The language table, from the data file if there is one"""
+    try:
+        with open(DATA_FILE, 'r', encoding='utf-8') as f:
+            return {code: Language(code, name, alpha3) for code, name, alpha3 in json.load(f)}
+    except FileNotFoundError:
+        return build()
+
+
+def codes() -> List[str]:
+    return list(table())
+
+
+def lookup(code: str) -> Language:
+    """Get a language by code, falling back to langcodes for any not in the table"""
+    lang = table().get(code)
+    if lang is None:
+        import langcodes
+        data = langcodes.get(code)
+        lang = Language(code, data.display_name(), data.to_alpha3())
+    return lang
+
+
+def name(code: str) -> str:
+    return lookup(code).name
+
+
+if __name__ == "__main__":
+    with open(DATA_FILE, 'w', encoding='utf-8') as f:
+        rows = [json.dumps([lang.code, lang.name, lang.alpha3], ensure_ascii=False) for lang in build().values()]
+        f.write("[\n" + ",\n".join(rows) + "\n]\n")
+    print(f"Wrote {DATA_FILE}")
@@ -1,30 +1,51 @@
-import datetime
-from typing import Any, Optional
+from typing import Any, Optional, List, Dict
 
 import streamlit as st
 
-from microarchive import MicroArchive, Identity, Contact, Description, Item, ALL_KEYS, KEYS, item_key, ALL_ITEM_KEYS, \
-    Control
+from buildcache import BuildCache
+import listing
+from jobs import JobRunner
+from lrucache import LRUCache
+from microarchive import MicroArchive, Identity, Contact, Description, Item, KEYS, Control, ItemData
+import session
+from session import PREFIX, FORMAT, STORED_SITE, ITEM_DATA, ITEM_CACHE, META_CACHE, SITE_CACHE
 from store import StoreSettings, Store, IIIFSettings
 from website import Website, SiteInfo
 
 EXPIRATION = 3600
 SITE_ID = "siteid"
-PREFIX = "prefix"
-FORMAT = "format"
 MODE = "mode"
 MODE_CREATE = "create"
 MODE_EDIT = "edit"
+PUBLISH_JOB = "publish_job"
+# Where background job state is kept, and how many jobs run at once
+JOBS_DIR = st.secrets.get("jobs_dir", ".jobs")
+JOB_WORKERS = 4
+# Where generated site artifacts are cached
+BUILD_CACHE_DIR = st.secrets.get("build_cache_dir", ".build-cache")
+# Where journals of in-progress uploads are kept, so they can be resumed
+CHECKPOINT_DIR = st.secrets.get("checkpoint_dir", ".checkpoints")
+# How many spare, ready-deployed distributions to keep for new sites
+DISTRIBUTION_POOL = st.secrets.get("distribution_pool", 0)
+# The memory budget of the cache of listings and stored site data
+CACHE_BYTES = st.secrets.get("cache_mb", 256) * 1024 * 1024
+LISTING_CACHE = "listing"
+# The local port site previews are served on, if previews are enabled. NB:
+# there is one preview, shared by all sessions, served on the app's host, so
+# previews are only useful when running the app locally.
+PREVIEW_PORT = st.secrets.get("preview_port")
 
 S3_SETTINGS = StoreSettings(
     bucket=st.secrets.s3_credentials.bucket,
     region=st.secrets.s3_credentials.region,
     access_key=st.secrets.s3_credentials.access_key,
-    secret_key=st.secrets.s3_credentials.secret_key
+    secret_key=st.secrets.s3_credentials.secret_key,
+    inventory=st.secrets.s3_credentials.get("inventory"),
 )
 
 IIIF_SETTINGS = IIIFSettings(
     server_url=st.secrets.iiif.server_url,
+    tile_size=st.secrets.iiif.get("tile_size"),
 )
 
 
@@ -35,37 +56,52 @@ def storage():
 
 @st.cache_resource
 def web_builder():
-    return Website(S3_SETTINGS)
-
-
-def load_stored_data(site_id: str) -> SiteInfo:
-    site_info = web_builder().get_site(site_id)
-    meta = storage().get_meta(site_info.origin_id)
-    if meta:
-        for key in ALL_KEYS:
-            if key in meta and meta[key]:
-                if key == KEYS.DATE_DESC:
-                    st.session_state[key] = datetime.date.fromisoformat(meta[key])
-                else:
-                    st.session_state[key] = meta[key]
-        if PREFIX in meta:
-            st.session_state[PREFIX] = meta[PREFIX]
-            st.session_state[FORMAT] = st.secrets.datasets[meta[PREFIX]].format
-        for ident, _, _ in load_files(st.session_state.get(PREFIX)):
-            for key in ALL_ITEM_KEYS:
-                ikey = item_key(ident, key)
-                if ikey in meta and meta[ikey]:
-                    st.session_state[ikey] = meta[ikey]
-    return site_info
+    # NB: the distribution pool is filled once a site is first claimed
+    # from it, rather than whenever the app starts
+    return Website(S3_SETTINGS, pool_size=DISTRIBUTION_POOL)
+
+
+@st.cache_resource
+def job_runner():
+    from publish import publish_job
+    return JobRunner(JOBS_DIR, {
+        "publish": lambda job: publish_job(job, storage(), web_builder(), BuildCache(BUILD_CACHE_DIR),
+                                           CHECKPOINT_DIR)
+    }, workers=JOB_WORKERS)
+
+
+@st.cache_resource
+def shared_cache() -> LRUCache:
+    """The cache of dataset listings and stored site data, shared by all
+    sessions. Cached values are read-only."""
+    return LRUCache(CACHE_BYTES, ttl=EXPIRATION)
+
+
+@st.cache_resource
+def preview_server():
+    from preview import PreviewServer
+    return PreviewServer(port=PREVIEW_PORT).start()
+
+
+def load_stored_data(site_id: str, refresh: bool = False) -> SiteInfo:
+    """Load a site's stored metadata into the session state, see `session`"""
+    formats = {prefix: dataset.format for prefix, dataset in st.secrets.datasets.items()}
+    return session.load_stored_data(st.session_state, site_id, storage(), web_builder(), formats,
+                                    refresh=refresh, cache=shared_cache())
 
 
 def value_or_default(key, default: Any = ""):
     return st.session_state[key] if key in st.session_state else default
 
 
-@st.cache_data(ttl=EXPIRATION)
+def item_data() -> ItemData:
+    """The session's item-level metadata"""
+    return session.item_data(st.session_state)
+
+
 def load_files(prefix: Optional[str]):
-    return storage().load_files(prefix)
+    """The dataset listing table, see `listing`"""
+    return shared_cache().load(LISTING_CACHE, prefix or "", lambda: storage().load_table(prefix))
 
 
 def init_page(title: str = "Describe a Collection"):
@@ -86,6 +122,25 @@ def init_page(title: str = "Describe a Collection"):
     st.write("# Micro Archive Publication Tool")
 
 
+def make_items() -> List[Item]:
+    """Make the archive items, reusing those from the last call
+    whose data and URLs are unchanged"""
+    data = item_data()
+    dirty = data.take_dirty()
+    cache: Dict[str, Item] = st.session_state.get(ITEM_CACHE, {})
+    items = []
+    for ident, url, thumb_url in listing.rows(load_files(st.session_state.get(PREFIX))):
+        item = cache.get(ident)
+        if item is None or ident in dirty or item.url != url or item.thumb_url != thumb_url:
+            item = Item(
+                ident,
+                Identity(data.get(ident, KEYS.TITLE)),
+                Description(scope=data.get(ident, KEYS.SCOPE)), url, thumb_url, [])
+        items.append(item)
+    st.session_state[ITEM_CACHE] = {item.id: item for item in items}
+    return items
+
+
 def make_archive():
     return MicroArchive(
         identity=Identity(
@@ -102,9 +157,5 @@ def make_archive():
             notes=value_or_default(KEYS.NOTES, ""),
             datedesc=value_or_default(KEYS.DATE_DESC, None)
         ),
-        items=[Item(
-            ident,
-            Identity(value_or_default(item_key(ident, KEYS.TITLE))),
-            Description(scope=value_or_default(item_key(ident, KEYS.SCOPE))), url, thumb_url, [])
-            for ident, url, thumb_url in load_files(st.session_state.get(PREFIX))]
+        items=make_items()
     )
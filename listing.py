@@ -0,0 +1,93 @@
+"""A columnar listing of a dataset's images, built with pyarrow.
+
+Listing a prefix yields keys in pages of a thousand, which are filtered,
+turned into item ids and encoded as IIIF URLs a batch of many pages at a
+time with vectorized compute kernels, rather than key by key."""
+import os
+from typing import Iterable, Iterator, List, Tuple, Union
+from urllib.parse import quote_plus
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from iiif import image_url, ServerRing
+from store import THUMB_DIR, EXT_PATTERN
+
+ID = "id"
+URL = "url"
+THUMB_URL = "thumb_url"
+SCHEMA = pa.schema([(ID, pa.string()), (URL, pa.string()), (THUMB_URL, pa.string())])
+# The number of keys converted at once
+BATCH_SIZE = 100_000
+# Keys made only of these characters are URL-encoded with simple replacements;
+# any others are encoded with `quote_plus`
+SIMPLE_KEY = r"^[A-Za-z0-9_.~/ -]*$"
+THUMB_SIZE = "!75,100"
+
+
+def from_keys(keys: Iterable[str], prefix: str, server_url: Union[str, List[str]]) -> pa.Table:
+    """Make a listing table from storage keys under `prefix`, with images
+    spread between image servers if several are given. See `ServerRing`."""
+    keys = pa.array(keys, pa.string())
+    keep = pc.and_(
+        pc.and_(pc.invert(pc.ends_with(keys, "/")), pc.invert(pc.match_substring(keys, THUMB_DIR))),
+        pc.match_substring_regex(keys, EXT_PATTERN.pattern, ignore_case=True))
+    keys = keys.filter(keep)
+
+    # NB: all keys start with the prefix, so it is only encoded once
+    rest = pc.utf8_slice_codeunits(keys, len(prefix))
+    # Strip the extension, as `os.path.splitext` would
+    ids = pc.replace_substring_regex(rest, r"([^/])\.[^./]*$", r"\1")
+
+    # Encode as `quote_plus` does, with nothing safe
+    encoded = pc.replace_substring(pc.replace_substring(rest, "/", "%2F"), " ", "+")
+    simple = pc.match_substring_regex(rest, SIMPLE_KEY)
+    if not pc.all(simple).as_py():
+        complex_keys = rest.filter(pc.invert(simple)).to_pylist()
+        encoded = pc.replace_with_mask(encoded, pc.invert(simple),
+                                       pa.array([quote_plus(key) for key in complex_keys], pa.string()))
+    ring = ServerRing(server_url)
+    if len(ring.servers) == 1:
+        servers = ring.servers[0]
+    else:
+        # NB: the only per-key Python step, and only with several servers
+        indices = ring.indices(pc.binary_join_element_wise(prefix, ids, "").to_pylist())
+        servers = pa.array(ring.servers, pa.string()).take(pa.array(indices, pa.int32()))
+    service_prefix = quote_plus(prefix)
+
+    def urls(size: str) -> pa.Array:
+        return pc.binary_join_element_wise(servers, service_prefix, encoded, image_url("", size), "")
+
+    return pa.Table.from_arrays([ids, urls("max"), urls(THUMB_SIZE)], schema=SCHEMA)
+
+
+def from_pages(pages: Iterable[List[str]], prefix: str, server_url: Union[str, List[str]]) -> pa.Table:
+    """Make a listing table from pages of keys, a batch of pages at a time"""
+    tables, batch = [], []
+    for page in pages:
+        batch.extend(page)
+        if len(batch) >= BATCH_SIZE:
+            tables.append(from_keys(batch, prefix, server_url))
+            batch = []
+    if batch or not tables:
+        tables.append(from_keys(batch, prefix, server_url))
+    return pa.concat_tables(tables)
+
+
+def rows(table: pa.Table) -> Iterator[Tuple[str, str, str]]:
+    """The (id, url, thumb url) of each item"""
+    return zip(table[ID].to_pylist(), table[URL].to_pylist(), table[THUMB_URL].to_pylist())
+
+
+def python_rows(keys: Iterable[str], prefix: str, server_url: Union[str, List[str]]) -> List[Tuple[str, str, str]]:
+    """The item rows for some keys, computed one key at a time. This is the
+    reference for the vectorized version, and used to benchmark it."""
+    ring = ServerRing(server_url)
+    items = []
+    for key in keys:
+        if key.endswith("/") or THUMB_DIR in key or not EXT_PATTERN.match(key):
+            continue
+        item_id = os.path.splitext(key)[0][len(prefix):]
+        service = ring.server(prefix + item_id) + quote_plus(key)
+        items.append((item_id, image_url(service), image_url(service, THUMB_SIZE)))
+    return items
@@ -0,0 +1,166 @@
+"""A bounded in-process cache, shared between threads, for dataset listings
+and stored site data.
+
+Values are kept as they are and returned without copying, so they must
+not be modified: dicts are stored as read-only views, though their values
+are not, lists as tuples, and listing tables are immutable anyway. Entries
+expire after a time to live, and the least recently used are evicted to
+keep the total estimated size of the values within a byte budget. Keys
+are (namespace, key) pairs, and entries can be invalidated by key prefix,
+e.g. all listings of a dataset."""
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict, field, is_dataclass
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+# The default byte budget
+MAX_BYTES = 256 * 1024 * 1024
+# Marks a value not yet loaded
+MISSING = object()
+
+
+def size_of(value: Any) -> int:
+    """An estimate of the memory used by a value, in bytes"""
+    if hasattr(value, "nbytes"):
+        return value.nbytes
+    if isinstance(value, (dict, MappingProxyType)):
+        return sys.getsizeof(value) + sum(size_of(k) + size_of(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(size_of(v) for v in value)
+    if is_dataclass(value):
+        return size_of(asdict(value))
+    return sys.getsizeof(value)
+
+
+def freeze(value: Any) -> Any:
+    """A read-only view of a value, where it would otherwise be mutable"""
+    if isinstance(value, dict):
+        return MappingProxyType(value)
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, tuple):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+@dataclass
+class Entry:
+    value: Any
+    size: int
+    expires: float
+
+
+@dataclass
+class Loading:
+    """A value being loaded, and the number of threads waiting for it"""
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    waiters: int = 0
+    value: Any = MISSING
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    size: int = 0
+
+
+class LRUCache:
+    def __init__(self, max_bytes: int = MAX_BYTES, ttl: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.entries: 'OrderedDict[Tuple[str, Hashable], Entry]' = OrderedDict()
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()
+        # The keys being loaded, so each is only loaded once
+        self.loading: Dict[Tuple[str, Hashable], Loading] = {}
+
+    def get(self, namespace: str, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            entry = self.entries.get((namespace, key))
+            if entry is not None and entry.expires < self.clock():
+                self._remove((namespace, key))
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.entries.move_to_end((namespace, key))
+            return entry.value
+
+    def put(self, namespace: str, key: Hashable, value: Any) -> Any:
+        """Cache a value, returning its read-only view. Values larger than
+        the whole budget are returned but not cached."""
+        value = freeze(value)
+        size = size_of(value)
+        with self.lock:
+            self._remove((namespace, key))
+            if size > self.max_bytes:
+                return value
+            expires = self.clock() + self.ttl if self.ttl is not None else float("inf")
+            self.entries[(namespace, key)] = Entry(value, size, expires)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+        return value
+
+    def load(self, namespace: str, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Get a value, calling `loader` to make it if it isn't cached. The
+        loader is called at most once at a time for each key, and threads
+        waiting for it are given its value, even if too large to cache."""
+        value = self.get(namespace, key, MISSING)
+        if value is not MISSING:
+            return value
+        with self.lock:
+            loading = self.loading.setdefault((namespace, key), Loading())
+            loading.waiters += 1
+        try:
+            with loading.lock:
+                # NB: another thread may have loaded it while this one waited
+                if loading.value is not MISSING:
+                    return loading.value
+                with self.lock:
+                    entry = self.entries.get((namespace, key))
+                if entry is not None and entry.expires >= self.clock():
+                    return entry.value
+                loading.value = self.put(namespace, key, loader())
+                return loading.value
+        finally:
+            # NB: only forgotten once no thread is waiting, else a later
+            # one would load it again while they do
+            with self.lock:
+                loading.waiters -= 1
+                if not loading.waiters:
+                    del self.loading[(namespace, key)]
+
+    def invalidate(self, namespace: str, prefix: str = "") -> int:
+        """Remove the entries in a namespace whose keys start with `prefix`,
+        returning how many were removed"""
+        with self.lock:
+            keys = [k for k in self.entries if k[0] == namespace and str(k[1]).startswith(prefix)]
+            for k in keys:
+                self._remove(k)
+            return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> CacheStats:
+        with self.lock:
+            return CacheStats(self.hits, self.misses, self.evictions, len(self.entries), self.size)
+
+    def _remove(self, key: Tuple[str, Hashable]):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
@@ -5,17 +5,17 @@ import json
 import os
 import sys
 from datetime import date
+from typing import Dict, Iterator, List, Optional, Tuple
 
-from slugify import slugify
-
+import publish
+from buildcache import BuildCache
 from ead import Ead
-from iiif import IIIFManifest
-from microarchive import MicroArchive, KEYS
+from instrument import Recorder
+from microarchive import MicroArchive, KEYS, ItemData, split_item_key
+from publish import PREFIX, FORMAT
 from store import StoreSettings, IIIFSettings, Store
-from website import Website, SiteInfo, make_html
+from website import Website, SiteInfo
 
-PREFIX = "prefix"
-FORMAT = "format"
 DEFAULT_DATA = {
     KEYS.TITLE: "Default Title",
     KEYS.HOLDER: "Default Holder",
@@ -23,8 +23,7 @@ DEFAULT_DATA = {
 }
 
 
-if __name__ == "__main__":
-
+def make_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         prog='SiteMaker',
         description='Create a basic website',
@@ -40,32 +39,87 @@ if __name__ == "__main__":
                         help='the storage access key')
     parser.add_argument('--secret-key', dest="secret_key", type=str, nargs='?', default=os.environ.get("S3_SECRET_KEY"),
                         help='the storage secret key')
-    parser.add_argument('--iiif-url', dest="iiif_url", type=str, nargs='?', default=os.environ.get("IIIF_SERVER_URL"),
-                        help='the IIIF server URL')
+    parser.add_argument('--inventory', type=str, default=os.environ.get("S3_INVENTORY"), metavar="BUCKET/PREFIX",
+                        help='list images from the latest S3 Inventory report at this location, not the bucket')
+    parser.add_argument('--iiif-url', dest="iiif_url", type=str, nargs='+',
+                        default=os.environ.get("IIIF_SERVER_URL", "").split() or None,
+                        help='the IIIF server URL, or several to spread images between')
+    parser.add_argument('--iiif-tile-size', dest="iiif_tile_size", type=int, default=None,
+                        help='the IIIF server tile size, hinted to viewers')
     parser.add_argument('--iiif-ext', dest="iiif_ext", type=str, nargs='?', default=".jpg",
                         help='the IIIF image extension')
     parser.add_argument('--key', type=str, nargs='?', default=None,
                         help='the site key, for updating an existing site')
+    parser.add_argument('--pool-size', dest="pool_size", type=int,
+                        default=int(os.environ.get("DISTRIBUTION_POOL_SIZE", 0)),
+                        help='the number of spare distributions to keep ready for new sites')
+    parser.add_argument('--build-cache', dest="build_cache", type=str, default=os.environ.get("BUILD_CACHE_DIR"),
+                        metavar="DIR", help='reuse unchanged generated files cached in this directory')
+    parser.add_argument('--checkpoint-dir', dest="checkpoint_dir", type=str,
+                        default=os.environ.get("CHECKPOINT_DIR", ".checkpoints"), metavar="DIR",
+                        help='journal uploads here, so an interrupted upload resumes where it stopped')
+    parser.add_argument('--watch', type=str, nargs='+', default=None, metavar="KEY",
+                        help='keep running, republishing the sites with these keys when their data changes')
+    parser.add_argument('--watch-dir', dest="watch_dir", type=str, default=".watch", metavar="DIR",
+                        help='where watch state and publish jobs are kept')
+    parser.add_argument('--watch-interval', dest="watch_interval", type=float, default=60,
+                        help='how often to check watched sites, in seconds')
+    parser.add_argument('--debounce', type=float, default=120,
+                        help='how long, in seconds, a site must be unchanged before it is republished')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='the number of sites republished at once when watching')
     parser.add_argument('--wait', action="store_true", default=False,
                         help='wait for the site to become available')
     parser.add_argument('--get-info', action="store_true", default=False,
                         help='get info about the given key and exit')
     parser.add_argument('--ead', action="store_true", default=False,
                         help='print the EAD file and exit')
+    parser.add_argument('--preview', type=int, nargs='?', const=8500, default=None, metavar="PORT",
+                        help='serve a local preview of the site instead of publishing it, '
+                             'rebuilding it when the data file changes')
+    parser.add_argument('--sample', type=int, default=None, metavar="N",
+                        help='preview only a sample of N items')
     parser.add_argument('--title', type=str, required=False, dest="title",
                         help='set the site title')
     parser.add_argument('--data-from-file', type=str, dest="data_file",
                         help='set data from supplied JSON file')
-    args = parser.parse_args()
+    parser.add_argument('--import-items', type=str, dest="import_items", metavar="FILE",
+                        help='set item titles and scope notes from a CSV or NDJSON file')
+    parser.add_argument('--export-items', type=str, dest="export_items", metavar="FILE",
+                        help='write item titles and scope notes to a CSV or NDJSON file (- for CSV to stdout) and exit')
+    parser.add_argument('--metrics', type=str, default=None,
+                        help='write per-stage timing JSON lines to this file (default: stderr)')
+    parser.add_argument('--trace-memory', action="store_true", default=False, dest="trace_memory",
+                        help='record the peak traced memory of each stage (slow)')
+    parser.add_argument('--profile', type=str, default=None, metavar="DIR",
+                        help='profile the run, writing pstats and collapsed stacks to this directory')
+    parser.add_argument('--profile-mode', type=str, default="cprofile", choices=["cprofile", "sample"],
+                        dest="profile_mode",
+                        help='cprofile for full pstats plus sampled stacks, or sample for sampled stacks only')
+    parser.add_argument('--sample-interval', type=float, default=0.005, dest="sample_interval",
+                        help='the stack sampling interval in seconds')
+    return parser
+
 
+def rows(files: Optional['pyarrow.Table']) -> Iterator[Tuple[str, str, str]]:
+    """The (id, url, thumb url) of each item in a listing, if any"""
+    if files is None:
+        return iter([])
+    import listing
+    return listing.rows(files)
+
+
+def main(args: argparse.Namespace, recorder: Recorder):
     store_settings = StoreSettings(
         bucket=args.bucket,
         region=args.region,
         access_key=args.access_key,
-        secret_key=args.secret_key
+        secret_key=args.secret_key,
+        inventory=args.inventory,
     )
     iiif_settings = IIIFSettings(
         server_url=args.iiif_url,
+        tile_size=args.iiif_tile_size,
     )
 
     # Default values
@@ -78,11 +132,15 @@ if __name__ == "__main__":
                 raw_data[k] = v
 
     store = Store(store_settings, iiif_settings)
-    site_maker = Website(store_settings)
+    site_maker = Website(store_settings, pool_size=args.pool_size)
+    if args.watch:
+        watch_sites(args, store, site_maker, recorder)
+        sys.exit()
     if args.key:
         print("Loading data...", file=sys.stderr)
-        existing_data = site_maker.get_site(args.key)
-        meta = store.get_meta(existing_data.origin_id)
+        with recorder.watch(store.client, site_maker.client), recorder.stage("meta"):
+            existing_data = site_maker.get_site(args.key)
+            meta = store.get_meta(existing_data.origin_id)
         if args.get_info:
             json.dump(meta, fp=sys.stdout, indent=2, default=str)
             sys.exit(1)
@@ -105,49 +163,75 @@ if __name__ == "__main__":
         raw_data[KEYS.TITLE] = args.title
 
     try:
+        from slugify import slugify
         slug = slugify(raw_data[KEYS.TITLE])
     except KeyError:
         print("Argument --title [TITLE] required")
         sys.exit(1)
 
-    # Load the files...
-    files = store.load_files(args.prefix)
+    # Load the files, if there is a dataset: the listing is a pyarrow
+    # table, which is slow to import, so is only loaded when needed
+    files = None
+    if args.prefix:
+        with recorder.watch(store.client), recorder.stage("listing"):
+            files = store.load_table(args.prefix)
+    recorder.labels.update(prefix=args.prefix, items=files.num_rows if files is not None else 0)
+
+    if args.import_items or args.export_items:
+        import bulkmeta
+        items = ItemData.from_flat(raw_data)
+        ids = [item_id for item_id, _, _ in rows(files)]
+        if args.import_items:
+            with open(args.import_items, 'r', encoding='utf-8-sig', newline='') as f:
+                report = bulkmeta.import_items(f, bulkmeta.guess_format(args.import_items), items, ids)
+            print(report.summary(), file=sys.stderr)
+            raw_data = {k: v for k, v in raw_data.items() if not split_item_key(k)} | items.to_flat()
+        if args.export_items:
+            if args.export_items == "-":
+                bulkmeta.export_items(sys.stdout, bulkmeta.CSV, items, ids)
+            else:
+                with open(args.export_items, 'w', encoding='utf-8', newline='') as f:
+                    count = bulkmeta.export_items(f, bulkmeta.guess_format(args.export_items), items, ids)
+                print(f"Wrote {count} items to {args.export_items}", file=sys.stderr)
+            sys.exit()
 
     print("Creating document model...", file=sys.stderr)
-    desc = MicroArchive.from_data(raw_data, files)
+    with recorder.stage("model"):
+        desc = MicroArchive.from_data(raw_data, rows(files))
 
     # If we just want to check the XML, print it and bail
     if args.ead:
         print(Ead().to_xml(desc))
         sys.exit()
 
+    if args.preview is not None:
+        serve_preview(args, raw_data, list(rows(files)), slug, store, recorder)
+        sys.exit()
+
     print("Creating site...", file=sys.stderr)
-    site_data = site_maker.get_or_create_site(slug, args.key)
+    with recorder.watch(site_maker.client), recorder.stage("site"):
+        site_data = site_maker.get_or_create_site(slug, args.key)
     print(json.dumps(site_data, indent=2, default=str), file=sys.stderr)
 
     # Now upload some data...
     url = f"https://{site_data.domain}"
     print(f"Site will be available at: {url}...", file=sys.stderr)
 
-    print("Generating EAD...", file=sys.stderr)
-    xml = Ead().to_xml(desc, url)
-
-    print("Generating IIIF manifest...", file=sys.stderr)
-    manifest = IIIFManifest(
-        baseurl=url,
-        name=slug,
-        service_url=iiif_settings.server_url,
-        image_format=args.iiif_ext,
-        prefix=args.prefix).to_json(desc)
-
-    print("Generating site...", file=sys.stderr)
-    html = make_html(slug, desc, site_data.id)
+    assets = publish.prepare_assets(store, site_maker, site_data.id, recorder,
+                                    log=lambda msg: print(msg, file=sys.stderr))
+    site_files = publish.generate(desc, slug, url, site_data.id, store, args.iiif_ext, args.prefix, recorder,
+                                  log=lambda msg: print(msg, file=sys.stderr),
+                                  cache=BuildCache(args.build_cache) if args.build_cache else None,
+                                  assets=assets)
 
     print(f"Uploading data to origin path: {site_data.origin_id}...", file=sys.stderr)
     state = desc.to_data() | {PREFIX: args.prefix, FORMAT: args.iiif_ext}
-    store.upload(slug, site_data.origin_id, html, xml, manifest, state)
+    changed = publish.upload(store, slug, site_data.origin_id, site_files, state, recorder, args.checkpoint_dir,
+                             log=lambda msg: print(msg, file=sys.stderr))
+    print(f"Updated {len(changed)} of {len(site_files.pages)} pages", file=sys.stderr)
 
     print(f"Key: {site_data.id}", file=sys.stderr)
+    print(json.dumps(recorder.labels | recorder.total().to_dict()), file=recorder.out, flush=True)
 
     if args.wait:
         import polling2
@@ -165,4 +249,83 @@ if __name__ == "__main__":
             step=5,
             timeout=10*60
         )
+    if site_maker.pool and site_maker.pool.filling:
+        # NB: the pool is refilled on a daemon thread, which would
+        # otherwise be stopped when this exits
+        site_maker.pool.filling.join()
     print("Done", file=sys.stderr)
+
+
+def serve_preview(args: argparse.Namespace, raw_data: Dict, rows: List[Tuple[str, str, str]], slug: str,
+                  store: Store, recorder: Recorder):
+    """Serve a local preview until interrupted, rebuilding it whenever the
+    data file changes. Rebuilds reuse the unchanged parts of the last build."""
+    import tempfile
+    import time
+    import preview
+    server = preview.PreviewServer(port=args.preview).start()
+    with tempfile.TemporaryDirectory(prefix="preview-") as tmp:
+        cache = BuildCache(args.build_cache or tmp)
+
+        def rebuild(data: Dict):
+            with recorder.stage("preview") as stage:
+                server.update(preview.build(MicroArchive.from_data(data, rows), slug, server.url, store,
+                                            args.iiif_ext, args.prefix, recorder, cache=cache, size=args.sample,
+                                            log=lambda msg: print(msg, file=sys.stderr)))
+            print(f"Preview at {server.url}/ (built in {stage.seconds:.2f}s)", file=sys.stderr)
+
+        rebuild(raw_data)
+        mtime = os.path.getmtime(args.data_file) if args.data_file else None
+        try:
+            while True:
+                time.sleep(1)
+                if mtime is None or os.path.getmtime(args.data_file) == mtime:
+                    continue
+                mtime = os.path.getmtime(args.data_file)
+                try:
+                    with open(args.data_file, 'r') as f:
+                        rebuild(raw_data | json.load(f))
+                except ValueError as e:
+                    print(f"Unable to read {args.data_file}: {e}", file=sys.stderr)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
+
+
+def watch_sites(args: argparse.Namespace, store: Store, site_maker: Website, recorder: Recorder):
+    """Republish the watched sites when their data changes, until interrupted,
+    writing each cycle's metrics as a JSON line"""
+    from jobs import JobRunner
+    from watch import Watcher
+    cache = BuildCache(args.build_cache or os.path.join(args.watch_dir, "build-cache"))
+    runner = JobRunner(os.path.join(args.watch_dir, "jobs"), {
+        "publish": lambda job: publish.publish_job(job, store, site_maker, cache, args.checkpoint_dir)
+    }, workers=args.workers)
+    watcher = Watcher(store, site_maker, runner, args.watch, args.watch_dir, interval=args.watch_interval,
+                      debounce=args.debounce, out=recorder.out)
+    print(f"Watching {len(args.watch)} sites...", file=sys.stderr)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runner.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    args = make_parser().parse_args()
+    with Recorder(trace_memory=args.trace_memory,
+                  out=open(args.metrics, 'w') if args.metrics else sys.stderr) as recorder:
+        if args.profile:
+            from profiling import profile
+            from slugify import slugify
+
+            def label() -> str:
+                prefix = slugify(recorder.labels.get(PREFIX) or "no-prefix")
+                return f"{prefix}-{recorder.labels.get('items', 0)}items"
+
+            profile(lambda: main(args, recorder), args.profile, mode=args.profile_mode,
+                    interval=args.sample_interval, label=label)
+        else:
+            main(args, recorder)
@@ -0,0 +1,90 @@
+"""Read and write the private micro-archive manifest (`.meta.json`).
+
+Version 1 is a single, indented JSON object holding flat data dictionary
+keys, so every item value repeats the `items.<id>.` key prefix. Version 2
+is JSON lines: a header object holding the format version and the
+collection-level values, then one object per item holding its id and
+populated values. This is written without indentation and, by default,
+gzipped, and can be read item by item without loading it all.
+
+The readers accept either version, compressed or not."""
+import gzip
+import io
+import json
+from typing import Dict, Tuple, Iterator, BinaryIO
+
+from microarchive import split_item_key, ItemData
+
+META_VERSION = 2
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def dumps(meta: Dict, compress: bool = True) -> bytes:
+    """Serialize a flat data dictionary in the version 2 format"""
+    def line(obj: Dict) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=str) + "\n"
+
+    header = {key: value for key, value in meta.items() if not split_item_key(key)}
+    lines = [line({"version": META_VERSION, "data": header})]
+    for ident, fields in ItemData.from_flat(meta).values.items():
+        lines.append(line({"id": ident} | fields))
+    data = "".join(lines).encode('utf-8')
+    # NB: with no timestamp in the gzip header, the same metadata is always
+    # the same bytes, so its ETag only changes when it does
+    return gzip.compress(data, mtime=0) if compress else data
+
+
+class _Prefixed(io.RawIOBase):
+    """A stream with some already-read bytes put back at the front"""
+    def __init__(self, prefix: bytes, stream: BinaryIO):
+        self.prefix = prefix
+        self.stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buf) -> int:
+        if self.prefix:
+            data, self.prefix = self.prefix[:len(buf)], self.prefix[len(buf):]
+        else:
+            data = self.stream.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+
+def read(stream: BinaryIO) -> Tuple[Dict, Iterator[Tuple[str, Dict[str, str]]]]:
+    """Read a manifest, returning the collection-level values and an
+    iterator over the (id, values) of each item. For version 2 manifests
+    the items are read from the stream lazily, as they are iterated."""
+    magic = stream.read(len(GZIP_MAGIC))
+    raw = io.BufferedReader(_Prefixed(magic, stream))
+    text = io.TextIOWrapper(gzip.GzipFile(fileobj=raw) if magic == GZIP_MAGIC else raw, encoding='utf-8')
+
+    first = text.readline()
+    try:
+        header = json.loads(first)
+    except json.JSONDecodeError:
+        header = None
+    if isinstance(header, dict) and header.get("version") == META_VERSION:
+        def items() -> Iterator[Tuple[str, Dict[str, str]]]:
+            for line in text:
+                if line.strip():
+                    fields = json.loads(line)
+                    yield fields.pop("id"), fields
+
+        return header["data"], items()
+
+    # Version 1: a single flat object
+    flat = json.loads(first + text.read())
+    data = {key: value for key, value in flat.items() if not split_item_key(key)}
+    return data, iter(ItemData.from_flat(flat).values.items())
+
+
+def load(stream: BinaryIO) -> Dict:
+    """Read a manifest of either version as a flat data dictionary"""
+    data, items = read(stream)
+    return data | ItemData(dict(items)).to_flat()
+
+
+def loads(data: bytes) -> Dict:
+    return load(io.BytesIO(data))
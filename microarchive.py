@@ -2,14 +2,11 @@
 import os.path
 import types
 from collections import OrderedDict
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 from datetime import date
-from typing import List, Union, Callable, Dict, Tuple
+from typing import List, Union, Callable, Dict, Tuple, Set
 from typing import Optional
 
-import langcodes
-from slugify import slugify
-
 KEYS = types.SimpleNamespace()
 KEYS.TITLE = "title"
 KEYS.HOLDER = "holder"
@@ -32,6 +29,72 @@ def item_key(ident: str, key: str):
     return f"{KEYS.ITEMS}.{ident}.{key}"
 
 
+def split_item_key(key: str) -> Optional[Tuple[str, str]]:
+    """Split a flat item key into the item id and value key, or return
+    None if it is not an item key"""
+    if not key.startswith(KEYS.ITEMS + "."):
+        return None
+    ident, _, name = key[len(KEYS.ITEMS) + 1:].rpartition(".")
+    return (ident, name) if ident else None
+
+
+class ItemData:
+    """Item-level metadata values keyed by item id, tracking which
+    items have changed since the changes were last taken"""
+    def __init__(self, values: Optional[Dict[str, Dict[str, str]]] = None):
+        self.values: Dict[str, Dict[str, str]] = values if values is not None else {}
+        self.dirty: Set[str] = set(self.values)
+
+    @classmethod
+    def from_flat(cls, data: Dict) -> 'ItemData':
+        """Make item data from the item keys of a flat data dictionary"""
+        items = cls()
+        items.load(data)
+        return items
+
+    def load(self, data: Dict):
+        """Replace all values with the item keys of a flat data dictionary"""
+        values: Dict[str, Dict[str, str]] = {}
+        for key, value in data.items():
+            parts = split_item_key(key)
+            if parts and value:
+                values.setdefault(parts[0], {})[parts[1]] = value
+        self.dirty.update(self.values)
+        self.dirty.update(values)
+        self.values = values
+
+    def to_flat(self) -> Dict[str, str]:
+        """Dump the populated values as flat data dictionary item keys"""
+        return {item_key(ident, key): value
+                for ident, fields in self.values.items()
+                for key, value in fields.items()}
+
+    def get(self, ident: str, key: str, default: str = "") -> str:
+        return self.values.get(ident, {}).get(key, default)
+
+    def set(self, ident: str, key: str, value: str) -> bool:
+        """Set an item value, returning whether it changed"""
+        fields = self.values.get(ident, {})
+        if fields.get(key, "") == (value or ""):
+            return False
+        if value:
+            self.values.setdefault(ident, fields)[key] = value
+        else:
+            fields.pop(key, None)
+            if not fields:
+                self.values.pop(ident, None)
+        self.dirty.add(ident)
+        return True
+
+    def take_dirty(self) -> Set[str]:
+        """Return the ids of items changed since the last call"""
+        dirty, self.dirty = self.dirty, set()
+        return dirty
+
+    def __len__(self):
+        return len(self.values)
+
+
 @dataclass
 class Identity:
     # Section 1: identification
@@ -51,7 +114,8 @@ class Description:
     lang: List[str] = field(default_factory=list)
 
     def languages(self):
-        return [langcodes.get(code).display_name() for code in self.lang]
+        import languages
+        return [languages.name(code) for code in self.lang]
 
     def done(self) -> bool:
         return self.biog.strip() != "" or \
@@ -123,13 +187,14 @@ class MicroArchive:
 
     def hierarchical_items(self) -> List[Item]:
         """Return items in a hierarchical structure, creating
-            and intermediate level items in between."""
+            and intermediate level items in between. The structure
+            is made of copies, so the archive's items are unchanged."""
         # NB: this algorithm is order-sensitive, which is not so great
 
         # Create intermediate items for all id path sections
         lookup = OrderedDict()
         for item in sorted(self.items, key=lambda it: it.id):
-            lookup[item.id] = item
+            lookup[item.id] = replace(item, items=[])
             path = os.path.dirname(item.id)
             if not path:
                 continue
@@ -145,18 +210,18 @@ class MicroArchive:
         # through and add each item to it's parent's children until
         # we reach an item with no parents of its own.
         def nest(flat: OrderedDict[str, Item], nested: OrderedDict[str, Item]) -> OrderedDict[str, Item]:
-            if not flat:
-                return nested
-
-            path, this = flat.popitem(False)
-            *parts, last = path.split('/')
-            if not parts:
-                nested[path] = this
-            else:
-                p_path = '/'.join(parts)
-                p = flat.get(p_path)
-                p.items.insert(0, this)
-            return nest(flat, nested)
+            # NB: iterative, since recursing once per item overflows the
+            # stack for archives of more than ~1000 items
+            while flat:
+                path, this = flat.popitem(False)
+                *parts, last = path.split('/')
+                if not parts:
+                    nested[path] = this
+                else:
+                    p_path = '/'.join(parts)
+                    p = flat.get(p_path)
+                    p.items.insert(0, this)
+            return nested
 
         ordered = OrderedDict([(it.id, it) for it in reversed(sorted(lookup.values(), key=lambda it: it.id))])
         return sorted(nest(ordered, OrderedDict()).values(), key=lambda it: it.id)
@@ -185,6 +250,7 @@ class MicroArchive:
                self.contact.done()
 
     def slug(self) -> str:
+        from slugify import slugify
         return slugify(self.identity.title)
 
     def __repr__(self):
@@ -203,6 +269,10 @@ class MicroArchive:
     @classmethod
     def from_data(cls, data: Dict, items: List[Tuple[str, str, str]]) -> 'MicroArchive':
         """Make a micro-archive from a flat dictionary and a list of items"""
+        item_data = ItemData.from_flat(data)
+        datedesc = data.get(KEYS.DATE_DESC) or date.today()
+        if isinstance(datedesc, str):
+            datedesc = date.fromisoformat(datedesc)
         return cls(
             identity=Identity(
                 title=data.get(KEYS.TITLE, ""),
@@ -213,15 +283,15 @@ class MicroArchive:
                 postcode=data.get(KEYS.POSTCODE, "")),
             control=Control(
                 notes=data.get(KEYS.NOTES, ""),
-                datedesc=data.get(KEYS.DATE_DESC, date.today())
+                datedesc=datedesc
             ),
             description=Description(biog=data.get(KEYS.BIOG_HIST, ""),
                                     scope=data.get(KEYS.SCOPE, ""),
                                     lang=data.get(KEYS.LANGS, [])),
             items=[Item(
                 ident,
-                Identity(data.get(item_key(ident, KEYS.TITLE), "")),
-                Description(scope=data.get(item_key(ident, KEYS.SCOPE), "")), web_url, thumb_url, [])
+                Identity(item_data.get(ident, KEYS.TITLE)),
+                Description(scope=item_data.get(ident, KEYS.SCOPE)), web_url, thumb_url, [])
                 for ident, web_url, thumb_url in items]
         )
 
@@ -1,7 +1,7 @@
-import langcodes.data_dicts
 import streamlit as st
 from streamlit_extras.switch_page_button import switch_page
 
+import languages
 from lib import init_page, value_or_default
 from microarchive import KEYS
 
@@ -22,8 +22,8 @@ st.session_state[KEYS.SCOPE] = st.text_area("Provide a general textual descripti
                                             value=value_or_default(KEYS.SCOPE))
 
 st.session_state[KEYS.LANGS] = st.multiselect("Enter the languages used in the collection's items:",
-                                              options=sorted([lang for lang in langcodes.LANGUAGE_ALPHA3.keys()]),
-                                              format_func=lambda code: langcodes.get(code).display_name(),
+                                              options=languages.codes(),
+                                              format_func=languages.name,
                                               default=value_or_default(KEYS.LANGS, []),
                                               help="This is equivalent to ISAD(G) 3.4.3: Languages of Material")
 
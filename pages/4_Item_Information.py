@@ -1,8 +1,15 @@
+import io
+
 import streamlit as st
 from streamlit_extras.switch_page_button import switch_page
 
-from lib import init_page, value_or_default, PREFIX, load_files
-from microarchive import item_key, KEYS
+import bulkmeta
+import listing
+from lib import init_page, PREFIX, load_files, item_data
+from microarchive import KEYS
+
+IMPORTED_ITEMS = "imported_items"
+IMPORT_REPORT = "import_report"
 
 init_page("WP11 Demo | Descriptive Info")
 
@@ -11,7 +18,35 @@ st.write("## Items")
 st.write("**Information about items in this collection.**")
 
 if PREFIX in st.session_state and st.session_state[PREFIX]:
-    items = enumerate(load_files(st.session_state.get(PREFIX)))
+    data = item_data()
+    with st.expander("Import or export item information"):
+        ids = load_files(st.session_state.get(PREFIX))[listing.ID].to_pylist()
+        uploaded = st.file_uploader("Import titles and descriptions from a CSV or NDJSON file",
+                                    type=["csv", "ndjson", "jsonl"])
+        # NB: the uploaded file is returned on every rerun, but only imported once
+        if uploaded is not None and st.session_state.get(IMPORTED_ITEMS) != uploaded.id:
+            try:
+                report = bulkmeta.import_items(io.TextIOWrapper(uploaded, encoding="utf-8-sig", newline=""),
+                                               bulkmeta.guess_format(uploaded.name), data, ids)
+                st.session_state[IMPORTED_ITEMS] = uploaded.id
+                st.session_state[IMPORT_REPORT] = report
+            except ValueError as e:
+                st.error(f"Unable to import {uploaded.name}: {e}")
+        if IMPORT_REPORT in st.session_state:
+            report = st.session_state[IMPORT_REPORT]
+            st.success(f"Read {report.rows} rows, updating {report.updated} items")
+            if report.unknown_count or report.missing_count:
+                st.warning(report.summary())
+
+        fmt = st.radio("Export format", [bulkmeta.CSV, bulkmeta.NDJSON], horizontal=True)
+        # NB: the file is only made when asked for, not on every rerun
+        if st.button("Export"):
+            out = io.StringIO()
+            bulkmeta.export_items(out, fmt, data, ids)
+            st.download_button("Download", out.getvalue(), file_name=f"items.{fmt}",
+                               mime="text/csv" if fmt == bulkmeta.CSV else "application/x-ndjson")
+
+    items = enumerate(listing.rows(load_files(st.session_state.get(PREFIX))))
     if items:
         for i, (ident, url, thumb_url) in items:
             col1, col2 = st.columns(2)
@@ -20,17 +55,15 @@ if PREFIX in st.session_state and st.session_state[PREFIX]:
                                 style="border: 1px solid #ccc"/></a>
                                 """, unsafe_allow_html=True)
             col1.caption(ident)
-            ead_title = item_key(ident, KEYS.TITLE)
-            st.session_state[ead_title] = col2.text_input(f"Name {i + 1}",
-                                                          value=value_or_default(ead_title),
-                                                          placeholder="Title",
-                                                          label_visibility="hidden")
-            ead_scope = item_key(ident, KEYS.SCOPE)
-            st.session_state[ead_scope] = col2.text_area(f"Scope {i + 1}",
-                                                         value=value_or_default(ead_scope),
-                                                         placeholder="Description",
-                                                         label_visibility="hidden",
-                                                         height=30)
+            data.set(ident, KEYS.TITLE, col2.text_input(f"Name {i + 1}",
+                                                        value=data.get(ident, KEYS.TITLE),
+                                                        placeholder="Title",
+                                                        label_visibility="hidden"))
+            data.set(ident, KEYS.SCOPE, col2.text_area(f"Scope {i + 1}",
+                                                       value=data.get(ident, KEYS.SCOPE),
+                                                       placeholder="Description",
+                                                       label_visibility="hidden",
+                                                       height=30))
             st.divider()
     else:
         st.write("### No files available")
@@ -1,49 +1,15 @@
-import requests
+import time
+
 import streamlit as st
-from polling2 import TimeoutException
 from streamlit_extras.switch_page_button import switch_page
 
-from ead import Ead
-from iiif import IIIFManifest
-from lib import make_archive, init_page, SITE_ID, PREFIX, IIIF_SETTINGS, MODE, FORMAT, web_builder, storage
-from website import make_html
-
-
-def wait_for_url(url: str):
-    import polling2
-
-    def step():
-        try:
-            r = requests.get(url)
-            return r.status_code == 200
-        except requests.ConnectionError:
-            return False
-
-    try:
-        polling2.poll(
-            step,
-            step=5,
-            timeout=10 * 60
-        )
-    except TimeoutException:
-        pass
-
-
-def preparing_site(ident: str):
-    """Poll Cloudfront distribution deployment. This is typically much
-    slower than waiting for the local edge location to be available."""
-    import polling2
-
-    def check(data):
-        return data.status == 'Deployed'
-
-    polling2.poll(
-        lambda: web_builder().get_site(ident),
-        check_success=check,
-        step=5,
-        timeout=10 * 60
-    )
+from jobs import DONE
+from lib import make_archive, init_page, SITE_ID, PREFIX, MODE, FORMAT, PUBLISH_JOB, job_runner, \
+    preview_server, storage, BUILD_CACHE_DIR, PREVIEW_PORT
+from publish import PUBLISH_STAGES
 
+# How often to check on a running publish job, in seconds
+POLL_INTERVAL = 2
 
 init_page("WP11 Demo | Publish")
 st.write("## Publish Data")
@@ -53,6 +19,10 @@ st.write("**Create a website using this description.**")
 # Build the representation...
 desc = make_archive()
 
+job_id = st.session_state.get(PUBLISH_JOB)
+job = job_runner().get(job_id) if job_id else None
+running = job is not None and not job.finished()
+
 update_id = st.session_state.get(SITE_ID, None)
 if update_id:
     st.info(f"Update site with code: {update_id}")
@@ -60,53 +30,70 @@ else:
     st.info("""Publishing this data will create a website containing the metadata for this
                collection and a browser for any images.""")
 
-if st.button("Publish Website", disabled=PREFIX not in st.session_state):
-    prefix = st.session_state.get(PREFIX)
-    name = desc.slug()
-
-    site_data = web_builder().get_or_create_site(name, update_id)
-    st.session_state[SITE_ID] = site_data.id
-    st.session_state[MODE] = "edit"
-    domain = site_data.domain
-
-    st.divider()
-    url = f"https://{domain}"
-
-    st.write("Generating EAD...")
-    xml = Ead().to_xml(desc, url)
-
-    st.write("Generating IIIF manifest...")
-    manifest = IIIFManifest(
-        baseurl=url,
-        name=name,
-        service_url=IIIF_SETTINGS.server_url,
-        image_format=st.session_state.get(FORMAT),
-        prefix=prefix).to_json(desc)
-
-    st.write("Generating website...")
-    html = make_html(name, desc, site_data.id)
-
-    st.write("Uploading data...")
-    state = desc.to_data() | {
+if st.button("Publish Website", disabled=PREFIX not in st.session_state or running):
+    data = desc.to_data() | {
         PREFIX: st.session_state.get(PREFIX),
         FORMAT: st.session_state.get(FORMAT)
     }
-    storage().upload(name, site_data.origin_id, html, xml, manifest, state)
+    job = job_runner().submit("publish", dict(site_id=update_id), data)
+    st.session_state[PUBLISH_JOB] = job.id
 
-    with st.spinner("Preparing site..."):
-        if not update_id:
+if job:
+    st.divider()
+    site_id = job.state.get("site_id")
+    if site_id:
+        st.session_state[SITE_ID] = site_id
+        st.session_state[MODE] = "edit"
+    url = f"https://{job.state['domain']}" if "domain" in job.state else None
+
+    if not job.finished():
+        st.progress(len(job.completed) / len(PUBLISH_STAGES), text=job.message or "Waiting to start...")
+        if job.stage == "live" and not job.params.get("site_id"):
             st.info(f"Typically a new site will take **1-5 minutes** to become [live]({url})...")
-        #preparing_site(site_data.id)
-        wait_for_url(url)
-
-    st.markdown("### Done!")
-    st.write(f"""Save this ID for editing this site:""")
-    st.markdown(f"### `{site_data.id}`")
-
-    if update_id:
-        st.markdown(f"Updated site: [{url}]({url})")
+        if st.button("Cancel"):
+            job_runner().cancel(job.id)
+        # Check on the job again shortly
+        time.sleep(POLL_INTERVAL)
+        st.experimental_rerun()
+    elif job.status == DONE:
+        st.markdown("### Done!")
+        st.write(f"""Save this ID for editing this site:""")
+        st.markdown(f"### `{site_id}`")
+
+        if job.params.get("site_id"):
+            st.markdown(f"Updated site: [{url}]({url})")
+        else:
+            st.markdown(f"Your site is available at: [{url}]({url})")
     else:
-        st.markdown(f"Your site is available at: [{url}]({url})")
+        st.warning(f"Publishing {job.status} at stage: {job.stage}")
+        if job.error:
+            st.error(job.error)
+        if st.button("Resume"):
+            job_runner().resume(job.id)
+            st.experimental_rerun()
+
+    if job.state.get("timings"):
+        with st.expander("Timings"):
+            st.table(job.state["timings"])
+
+# NB: previews are only enabled when running the app locally, see `lib.PREVIEW_PORT`
+if PREVIEW_PORT:
+    st.divider()
+    with st.expander("Preview"):
+        st.write("""Build the site locally to check it before publishing. Only the parts
+                    changed since the last preview are rebuilt.""")
+        sample_size = st.number_input("Items to include (0 for all)", min_value=0, value=min(len(desc.items), 500),
+                                      help="Large collections can be previewed faster from a sample of their items")
+        if st.button("Build Preview", disabled=PREFIX not in st.session_state):
+            from buildcache import BuildCache
+            from instrument import Recorder
+            from preview import build
+            server = preview_server()
+            with st.spinner("Building preview..."):
+                server.update(build(desc, desc.slug(), server.url, storage(), st.session_state.get(FORMAT),
+                                    st.session_state.get(PREFIX), Recorder(), cache=BuildCache(BUILD_CACHE_DIR),
+                                    size=sample_size))
+            st.markdown(f"Preview available at: [{server.url}]({server.url})")
 
 st.divider()
 col1, col2 = st.columns(2)
@@ -0,0 +1,119 @@
+"""Local previews of a site, built in memory and served over HTTP, without
+creating a distribution or uploading anything.
+
+Previews are built with the publish pipeline, so with a build cache a
+rebuild after an edit only regenerates the parts of the site whose inputs
+changed. Large archives can be previewed from a sample of their items."""
+import dataclasses
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Tuple, Optional, Callable
+
+from buildcache import BuildCache
+from instrument import Recorder
+from microarchive import MicroArchive, Item
+from publish import generate
+from store import Store
+
+HOST = "127.0.0.1"
+PORT = 8500
+# The site key of previews, which have no distribution
+PREVIEW_KEY = "preview"
+# Headers allowing viewers on other origins to load the manifest and pages
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, HEAD, OPTIONS",
+    "Access-Control-Allow-Headers": "*",
+}
+
+
+def sample(items: List[Item], size: Optional[int]) -> List[Item]:
+    """Up to `size` items, evenly spaced through the listing so the
+    sample spans the whole hierarchy"""
+    if not size or size >= len(items):
+        return items
+    step = len(items) / size
+    return [items[int(i * step)] for i in range(size)]
+
+
+def build(desc: MicroArchive, name: str, url: str, store: Store, image_format: str, prefix: str,
+          recorder: Recorder, cache: Optional[BuildCache] = None, size: Optional[int] = None,
+          log: Callable[[str], None] = lambda msg: None) -> Dict[str, Tuple[str, bytes]]:
+    """Build a site preview, returning the (content type, body) of each file
+    by path. If `size` is given, only a sample of that many items is built."""
+    if size:
+        desc = dataclasses.replace(desc, items=sample(desc.items, size))
+    files = generate(desc, name, url, PREVIEW_KEY, store, image_format, prefix, recorder, log=log, cache=cache)
+    found = {
+        "index.html": ("text/html", files.index),
+        f"{name}.xml": ("text/xml", files.xml),
+        f"{name}.json": ("application/json", files.iiif),
+    }
+    found.update({filename: (content_type, data) for filename, content_type, data in files.search})
+    found.update({filename: ("text/html", data) for filename, data in files.pages.items()})
+    return {path: (content_type, data.encode('utf-8')) for path, (content_type, data) in found.items()}
+
+
+class PreviewServer:
+    """Serves a site's files from memory on a background thread. The files
+    can be replaced at any time with `update`."""
+
+    def __init__(self, host: str = HOST, port: int = PORT):
+        self.files: Dict[str, Tuple[str, bytes]] = {}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def send_cors(self):
+                for header, value in CORS_HEADERS.items():
+                    self.send_header(header, value)
+
+            def do_OPTIONS(self):
+                self.send_response(204)
+                self.send_cors()
+                self.end_headers()
+
+            def do_HEAD(self):
+                self.respond(body=False)
+
+            def do_GET(self):
+                self.respond(body=True)
+
+            def respond(self, body: bool):
+                path = urllib.parse.unquote(self.path.split("?")[0]).lstrip("/") or "index.html"
+                found = server.files.get(path)
+                if found is None:
+                    self.send_error(404)
+                    return
+                content_type, data = found
+                self.send_response(200)
+                self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("Cache-Control", "no-cache")
+                self.send_cors()
+                self.end_headers()
+                if body:
+                    self.wfile.write(data)
+
+            def log_message(self, fmt: str, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def update(self, files: Dict[str, Tuple[str, bytes]]):
+        # NB: replaced whole, so requests never see a partial build
+        self.files = files
+
+    def start(self) -> 'PreviewServer':
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,75 @@
+"""Opt-in profiling for command-line runs.
+
+Profiles are written as a `.pstats` file, readable with `pstats` or
+tools like snakeviz, and as a `.collapsed` file of sampled stacks in
+the "folded" format read by flamegraph.pl, speedscope and similar."""
+import cProfile
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, Optional, Any
+
+
+class Sampler:
+    """Periodically samples the stack of a thread from a background
+    thread, counting each distinct stack"""
+    def __init__(self, interval: float = 0.005, thread_id: Optional[int] = None):
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampler", daemon=True)
+
+    @staticmethod
+    def frame_name(frame) -> str:
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(self.frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write_collapsed(self, path: str):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                print(f"{stack} {count}", file=f)
+
+
+def profile(func: Callable[[], Any], directory: str, mode: str = "cprofile", interval: float = 0.005,
+            label: Callable[[], str] = lambda: "run") -> Any:
+    """Run `func`, sampling its stacks and, in `cprofile` mode, also
+    tracing it with cProfile. The output files are named after the
+    result of calling `label` once `func` has finished, so it can
+    include details only known after the run, like an item count."""
+    os.makedirs(directory, exist_ok=True)
+    sampler = Sampler(interval)
+    profiler = cProfile.Profile() if mode == "cprofile" else None
+    sampler.start()
+    if profiler:
+        profiler.enable()
+    try:
+        return func()
+    finally:
+        if profiler:
+            profiler.disable()
+        sampler.stop()
+        base = os.path.join(directory, f"{label()}-{time.strftime('%Y%m%dT%H%M%S')}")
+        if profiler:
+            profiler.dump_stats(base + ".pstats")
+        sampler.write_collapsed(base + ".collapsed")
+        print(f"Profile written to {base}.*", file=sys.stderr)
@@ -0,0 +1,201 @@
+"""The publish pipeline, shared by the CLI and background publish jobs"""
+import time
+from dataclasses import dataclass, asdict
+from datetime import date
+from typing import Dict, List, Tuple, Callable, Optional
+
+from buildcache import BuildCache, CACHE_VERSION, fingerprint, template_version
+
+from ead import Ead
+from iiif import IIIFManifest
+from instrument import Recorder
+from microarchive import MicroArchive
+from search import build_index
+from store import Store
+from website import Website, make_html, make_pages
+
+PREFIX = "prefix"
+FORMAT = "format"
+# How long to wait, in seconds, for a published site to become available
+WAIT_TIMEOUT = 10 * 60
+WAIT_STEP = 5
+# The stages of a publish job, in order
+PUBLISH_STAGES = ["site", "listing", "generate", "upload", "live"]
+
+
+@dataclass
+class SiteFiles:
+    """The generated files making up a website"""
+    index: str
+    xml: str
+    iiif: str
+    pages: Dict[str, str]
+    search: List[Tuple[str, str, str]]
+
+
+def generate(desc: MicroArchive, name: str, url: str, site_key: str, store: Store, image_format: str,
+             prefix: str, recorder: Recorder, log: Callable[[str], None] = lambda msg: None,
+             cache: Optional[BuildCache] = None, assets: Optional[Dict[str, str]] = None) -> SiteFiles:
+    """Generate the EAD, IIIF manifest, HTML pages and search index for a site.
+    If a `cache` is given, an unchanged build is taken from it whole, and the
+    unchanged parts of a changed build are reused. Only the last build of
+    each site is kept whole. `assets` are the URLs of
+    the self-hosted viewer assets, if the site can serve them."""
+    key = slot = None
+    if cache is not None:
+        with recorder.stage("cache"):
+            slot = fingerprint(name, site_key)
+            key = fingerprint(CACHE_VERSION, template_version(), desc.to_data(),
+                              [(item.id, item.url, item.thumb_url) for item in desc.items],
+                              name, url, site_key, asdict(store.iiif_settings), image_format, prefix, assets,
+                              # NB: the EAD records its creation date
+                              date.today())
+            cached = cache.get("site", slot)
+        if cached is not None and cached["key"] == key:
+            log("Using cached build...")
+            files = cached["files"]
+            return SiteFiles(**files | {"search": [tuple(f) for f in files["search"]]})
+
+    log("Generating EAD...")
+    with recorder.stage("ead"):
+        xml = Ead().to_xml(desc, url, cache=cache)
+
+    log("Generating IIIF manifest...")
+    iiif = IIIFManifest(
+        baseurl=url,
+        name=name,
+        service_url=store.iiif_settings.server_url,
+        image_format=image_format,
+        prefix=prefix,
+        tile_size=store.iiif_settings.tile_size)
+    with recorder.stage("iiif"):
+        manifest = iiif.to_json(desc)
+
+    log("Generating website...")
+    with recorder.stage("html"):
+        tree = desc.hierarchical_items()
+        html = make_html(name, desc, site_key, tree, search=True, assets=assets)
+        pages = make_pages(name, desc, site_key, iiif.canvas_id, tree, cache=cache)
+
+    log("Generating search index...")
+    with recorder.stage("search"):
+        search_files = [(filename, "application/json", data) for filename, data in build_index(desc).items()]
+
+    files = SiteFiles(html, xml, manifest, pages, search_files)
+    if cache is not None:
+        with recorder.stage("cache"):
+            cache.put("site", slot, dict(key=key, files=asdict(files)))
+            cache.prune()
+    return files
+
+
+def prepare_assets(store: Store, site_maker: Website, site_id: str, recorder: Recorder,
+                   log: Callable[[str], None] = lambda msg: None) -> Optional[Dict[str, str]]:
+    """Upload the self-hosted viewer assets to the bucket, unless they are
+    there already, returning their URLs by name. Returns None if the assets
+    can't be fetched or the site can't serve them yet, in which case the
+    site should use the third-party copies."""
+    import assets
+    from botocore.exceptions import ClientError
+    with recorder.watch(store.client, site_maker.client), recorder.stage("assets"):
+        try:
+            found = assets.fetch()
+        except OSError as e:
+            log(f"Unable to fetch viewer assets, using third-party copies: {e}")
+            return None
+        uploaded = store.put_missing(assets.uploads(found))
+        if uploaded:
+            log(f"Uploaded viewer assets: {', '.join(uploaded)}")
+        try:
+            serving = site_maker.ensure_assets(site_id)
+        except ClientError as e:
+            log(f"Unable to serve viewer assets from the site, using third-party copies: {e}")
+            return None
+        if not serving:
+            log("Site is not yet serving viewer assets, using third-party copies...")
+            return None
+    return {name: asset.href for name, asset in found.items()}
+
+
+def upload(store: Store, name: str, origin: str, files: SiteFiles, state: Dict, recorder: Recorder,
+           checkpoints: Optional[str] = None, log: Callable[[str], None] = lambda msg: None) -> List[str]:
+    """Upload a site's files, returning the names of the updated pages. If
+    a `checkpoints` directory is given, the upload is journaled there, so
+    if interrupted it can be resumed by uploading only what is missing."""
+    import asyncio
+    from aiostore import upload_site
+    from checkpoint import Journal
+    journal = Journal.open(checkpoints, store.settings.bucket, origin) if checkpoints else None
+    try:
+        if journal and journal.done:
+            log(f"Resuming upload, skipping {len(journal.done)} files already uploaded...")
+        with recorder.watch(store.client), recorder.stage("upload"):
+            changed = asyncio.run(upload_site(store, name, origin, files.index, files.xml, files.iiif, state,
+                                              {filename: data for filename, _, data in files.search},
+                                              files.pages, journal))
+        if journal:
+            journal.clear()
+    finally:
+        if journal:
+            journal.close()
+    return changed
+
+
+def wait_for_url(url: str, timeout: float = WAIT_TIMEOUT, step: float = WAIT_STEP,
+                 check: Callable[[], None] = lambda: None) -> bool:
+    """Poll until `url` is available, returning whether it became so before
+    the timeout. `check` is called before each attempt, and may raise to
+    stop waiting."""
+    import requests
+    deadline = time.monotonic() + timeout
+    while True:
+        check()
+        try:
+            if requests.get(url).status_code == 200:
+                return True
+        except requests.ConnectionError:
+            pass
+        if time.monotonic() + step > deadline:
+            return False
+        time.sleep(step)
+
+
+def publish_job(job, store: Store, site_maker: Website, cache: Optional[BuildCache] = None,
+                checkpoints: Optional[str] = None) -> Dict:
+    """Run a publish job. The job data is the flat archive data, including
+    its prefix and image format, and the job params optionally hold the
+    `site_id` of the site to update. Stages completed by an earlier, interrupted
+    run of the job are skipped, as are files it uploaded, given a
+    `checkpoints` directory."""
+    import listing
+    data = job.data
+    prefix, image_format = data.get(PREFIX), data.get(FORMAT)
+    name = MicroArchive.from_data(data, []).slug()
+    recorder = Recorder()
+
+    with job.stage("site", "Creating site..."):
+        if "site_id" not in job.state:
+            with recorder.watch(site_maker.client), recorder.stage("site"):
+                site = site_maker.get_or_create_site(name, job.params.get("site_id"))
+            job.state.update(site_id=site.id, domain=site.domain, origin_id=site.origin_id)
+    url = f"https://{job.state['domain']}"
+
+    if not job.done("upload"):
+        with job.stage("listing", "Listing files..."):
+            with recorder.watch(store.client), recorder.stage("listing"):
+                files = store.load_table(prefix)
+            assets = prepare_assets(store, site_maker, job.state["site_id"], recorder, log=job.progress)
+        with recorder.stage("model"):
+            desc = MicroArchive.from_data(data, listing.rows(files))
+        with job.stage("generate"):
+            site_files = generate(desc, name, url, job.state["site_id"], store, image_format, prefix, recorder,
+                                  log=job.progress, cache=cache, assets=assets)
+        with job.stage("upload", "Uploading data..."):
+            changed = upload(store, name, job.state["origin_id"], site_files, data, recorder, checkpoints,
+                             log=job.progress)
+            job.state.update(pages=len(site_files.pages), changed=len(changed), timings=recorder.rows())
+
+    with job.stage("live", "Waiting for the site to become available..."):
+        job.state["live"] = wait_for_url(url, check=job.check)
+
+    return dict(job.state, url=url)
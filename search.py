@@ -0,0 +1,108 @@
+"""Build a prebuilt, sharded inverted index for client-side search.
+
+The index is a set of static JSON files under `SEARCH_DIR`:
+
+ - `index.json`: the index parameters and the list of term shards
+ - `<prefix>.json`: the postings for all terms beginning with `prefix`,
+   as delta-encoded lists of document numbers
+ - `docs/<n>.json`: blocks of `[id, title]` pairs for the documents,
+   where document 0 is the collection itself
+
+so a browser only fetches the shards for the terms it is looking up
+and the document blocks for the results it shows."""
+import json
+import re
+from typing import Dict, List, Tuple, Iterable
+
+from microarchive import MicroArchive
+
+SEARCH_DIR = "search"
+PREFIX_LEN = 2
+MIN_TERM_LEN = 2
+DOC_BLOCK = 1000
+TERM_PATTERN = re.compile(r"\w+")
+
+
+def terms(*texts: str) -> Iterable[str]:
+    """Split text into the unique, lower-cased terms used by the index"""
+    found = set()
+    for text in texts:
+        if text:
+            found.update(t for t in TERM_PATTERN.findall(text.lower()) if len(t) >= MIN_TERM_LEN)
+    return found
+
+
+def _dumps(data) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def build_index(data: MicroArchive, block_size: int = DOC_BLOCK) -> Dict[str, str]:
+    """Index the item ids, titles and scope notes, plus the collection's
+    title, biographical history and scope, returning a dictionary of
+    site-relative filenames to JSON. Runs in time linear in the size
+    of the archive text."""
+    docs: List[Tuple[str, str]] = [("", data.identity.title)]
+    postings: Dict[str, List[int]] = {}
+
+    def add(num: int, found: Iterable[str]):
+        for term in found:
+            # documents are added in order, so each list stays sorted
+            postings.setdefault(term, []).append(num)
+
+    add(0, terms(data.identity.title, data.description.biog, data.description.scope))
+    for item in data.items:
+        add(len(docs), terms(item.id, item.identity.title, item.content.scope))
+        docs.append((item.id, item.identity.title))
+
+    shards: Dict[str, Dict[str, List[int]]] = {}
+    for term, nums in postings.items():
+        last, deltas = 0, []
+        for num in nums:
+            deltas.append(num - last)
+            last = num
+        shards.setdefault(term[:PREFIX_LEN], {})[term] = deltas
+
+    files = {
+        f"{SEARCH_DIR}/index.json": _dumps(dict(
+            version=1,
+            prefix=PREFIX_LEN,
+            min=MIN_TERM_LEN,
+            block=block_size,
+            docs=len(docs),
+            shards=sorted(shards.keys()))),
+    }
+    for prefix, shard in shards.items():
+        files[f"{SEARCH_DIR}/{prefix}.json"] = _dumps(shard)
+    for start in range(0, len(docs), block_size):
+        files[f"{SEARCH_DIR}/docs/{start // block_size}.json"] = _dumps(docs[start:start + block_size])
+    return files
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    import time
+
+    from microarchive import Identity, Description, Contact, Control, Item
+
+    parser = argparse.ArgumentParser(description='Time building the search index for a synthetic archive')
+    parser.add_argument('--items', type=int, nargs='+', default=[10_000, 100_000],
+                        help='the archive sizes to index')
+    args = parser.parse_args()
+
+    words = ["letter", "postcard", "photograph", "diary", "ghetto", "camp", "family", "school",
+             "Warsaw", "Amsterdam", "Prague", "Vienna", "1938", "1942", "1945", "deportation"]
+    for count in args.items:
+        archive = MicroArchive(
+            identity=Identity(title="Synthetic"),
+            description=Description(biog="Synthetic biography", scope="Synthetic scope"),
+            contact=Contact(),
+            control=Control(),
+            items=[Item.make(f"series{i % 100}/file{i // 100}/item{i}",
+                             Identity(title=f"{words[i % 16]} {words[(i * 7) % 16]} {i}"))
+                   for i in range(count)])
+        start = time.perf_counter()
+        index = build_index(archive)
+        elapsed = time.perf_counter() - start
+        size = sum(len(v.encode('utf-8')) for v in index.values())
+        print(f"{count} items: {elapsed:.3f}s, {len(index)} files, {size} bytes", file=sys.stderr)
@@ -0,0 +1,94 @@
+"""Loading a published site's stored metadata into a session's state.
+
+This is kept apart from the Streamlit app, which passes its session state
+and shared resources in, so it can be used and tested without it."""
+import datetime
+import time
+from dataclasses import dataclass
+from typing import Callable, Mapping, MutableMapping, Optional
+
+from lrucache import LRUCache
+from microarchive import ALL_KEYS, KEYS, ItemData
+from store import Store
+from website import Website, SiteInfo
+
+PREFIX = "prefix"
+FORMAT = "format"
+STORED_SITE = "stored_site"
+ITEM_DATA = "item_data"
+ITEM_CACHE = "item_cache"
+META_CACHE = "meta"
+SITE_CACHE = "site"
+# How often, at most, to check if a site's stored metadata has changed
+META_CHECK_INTERVAL = 300
+# The session keys holding the data of the site being described
+SITE_KEYS = ALL_KEYS + [PREFIX, FORMAT, ITEM_DATA, ITEM_CACHE]
+
+
+@dataclass
+class StoredSite:
+    """The site info and metadata ETag a session was hydrated from"""
+    site_id: str
+    info: SiteInfo
+    etag: Optional[str]
+    checked: float
+
+
+def item_data(state: MutableMapping) -> ItemData:
+    """The session's item-level metadata"""
+    if ITEM_DATA not in state:
+        state[ITEM_DATA] = ItemData()
+    return state[ITEM_DATA]
+
+
+def clear_site(state: MutableMapping):
+    """Remove the data of the site being described from the session, so
+    none of it carries over to another"""
+    for key in SITE_KEYS:
+        state.pop(key, None)
+    # NB: item values were once kept in the session as flat item keys
+    for key in [k for k in state.keys() if str(k).startswith(KEYS.ITEMS + ".")]:
+        state.pop(key, None)
+
+
+def load_stored_data(state: MutableMapping, site_id: str, store: Store, site_maker: Website,
+                     formats: Mapping[str, str], refresh: bool = False, cache: Optional[LRUCache] = None,
+                     clock: Callable[[], float] = time.time) -> SiteInfo:
+    """Load a site's stored metadata into the session state. This is done
+    once per site id: on subsequent reruns the stored site info is returned
+    without any AWS calls, unless a `refresh` is requested or, checked at
+    most every `META_CHECK_INTERVAL` seconds, the stored metadata has changed.
+    `formats` maps dataset prefixes to their formats."""
+    stored: Optional[StoredSite] = state.get(STORED_SITE)
+    if stored and stored.site_id == site_id and not refresh:
+        if clock() - stored.checked < META_CHECK_INTERVAL:
+            return stored.info
+        stored.checked = clock()
+        if store.meta_etag(stored.info.origin_id) == stored.etag:
+            return stored.info
+
+    cache = cache if cache is not None else LRUCache()
+    if refresh:
+        site_info = cache.put(SITE_CACHE, site_id, site_maker.get_site(site_id))
+    else:
+        site_info = cache.load(SITE_CACHE, site_id, lambda: site_maker.get_site(site_id))
+    # NB: the cached metadata may have been changed since by another
+    # session, so is checked before it is used
+    cached = cache.get(META_CACHE, site_info.origin_id)
+    if cached is None or refresh or store.meta_etag(site_info.origin_id) != cached[1]:
+        cached = cache.put(META_CACHE, site_info.origin_id, store.fetch_meta(site_info.origin_id))
+    meta, etag = cached
+    clear_site(state)
+    if meta:
+        for key in ALL_KEYS:
+            if key in meta and meta[key]:
+                if key == KEYS.DATE_DESC:
+                    state[key] = datetime.date.fromisoformat(meta[key])
+                else:
+                    state[key] = meta[key]
+        if PREFIX in meta:
+            state[PREFIX] = meta[PREFIX]
+            state[FORMAT] = formats.get(meta[PREFIX])
+        item_data(state).load(meta)
+    state[STORED_SITE] = StoredSite(site_id, site_info, etag, clock())
+    return site_info
@@ -1,16 +1,26 @@
+import hashlib
 import json
 import os
 import re
 import sys
 from dataclasses import dataclass
-from typing import Tuple, List, Optional, Dict
-from urllib.parse import quote_plus
+from typing import Tuple, List, Optional, Dict, Iterator, Union
 
-import boto3
-from botocore.exceptions import ClientError
+import metafile
 
 THUMB_DIR = ".thumb"
 EXT_PATTERN = re.compile('.*\\.(jpe?g|tiff?|png|gif|raw)$', re.IGNORECASE)
+# Private record of the content hashes of synced static pages
+PAGES_STATE = ".pages.json"
+# ...and of the search index files
+SEARCH_STATE = ".search.json"
+# The size of the client's connection pool, and so the number of
+# requests that can usefully be made in parallel
+MAX_CONNECTIONS = 32
+# Files larger than this are uploaded in parts of `PART_SIZE`, so an
+# interrupted upload can be resumed. NB: parts must be at least 5MiB.
+MULTIPART_THRESHOLD = 16 * 1024 * 1024
+PART_SIZE = 8 * 1024 * 1024
 
 
 @dataclass
@@ -19,11 +29,29 @@ class StoreSettings:
     region: str
     access_key: str
     secret_key: str
+    # If set, the location of S3 Inventory reports of the bucket, as
+    # "bucket/prefix", from which to list datasets. See `inventory`.
+    inventory: Optional[str] = None
 
 
 @dataclass
 class IIIFSettings:
-    server_url: str
+    # One image server URL, or several to spread images between by
+    # consistent hashing. See `iiif.ServerRing`.
+    server_url: Union[str, List[str]]
+    # If set, the image server's tile size, hinted to viewers
+    tile_size: Optional[int] = None
+
+
+@dataclass
+class Upload:
+    """A file to put in storage, relative to a site origin"""
+    filename: str
+    content_type: str
+    body: bytes
+    public: bool = True
+    encoding: Optional[str] = None
+    cache_control: Optional[str] = None
 
 
 @dataclass
@@ -34,75 +62,293 @@ class Store:
         self.client = self.aws_client("s3")
 
     def aws_client(self, service: str):
+        import boto3
+        from botocore.config import Config
         return boto3.client(service,
                             region_name=self.settings.region,
                             aws_access_key_id=self.settings.access_key,
-                            aws_secret_access_key=self.settings.secret_key)
+                            aws_secret_access_key=self.settings.secret_key,
+                            config=Config(max_pool_connections=MAX_CONNECTIONS))
 
-    def load_files(self, prefix: Optional[str] = None) -> List[Tuple[str, str, str]]:
+    def list_pages(self, prefix: str, bucket: Optional[str] = None) -> Iterator[List[Dict]]:
+        """List the metadata of all objects under `prefix`, a page at a time"""
+        args = dict(Bucket=bucket or self.settings.bucket, Prefix=prefix)
+        while True:
+            r = self.client.list_objects_v2(**args)
+            yield r.get("Contents", [])
+            if not r.get("IsTruncated"):
+                break
+            args["ContinuationToken"] = r["NextContinuationToken"]
+
+    def list_objects(self, prefix: str) -> Iterator[Dict]:
+        """List the metadata of all objects under `prefix`"""
+        for page in self.list_pages(prefix):
+            yield from page
+
+    def has_keys_after(self, prefix: str, key: Optional[str]) -> bool:
+        """Check with a single request whether there are objects under
+        `prefix` whose keys sort after `key`"""
+        r = self.client.list_objects_v2(Bucket=self.settings.bucket, Prefix=prefix, StartAfter=key or "", MaxKeys=1)
+        return bool(r.get("Contents"))
+
+    def load_table(self, prefix: Optional[str] = None) -> 'pyarrow.Table':
+        """List the images under `prefix` as a table of item ids, IIIF image
+        URLs and thumbnail URLs. See `listing`."""
+        import listing
         if not prefix:
-            return []
+            return listing.SCHEMA.empty_table()
+        if self.settings.inventory:
+            manifest = self.latest_inventory()
+            if manifest:
+                return self.load_inventory(manifest, prefix)
+            print(f"No inventory found at {self.settings.inventory}, listing bucket", file=sys.stderr)
+        pages = ([meta["Key"] for meta in page] for page in self.list_pages(prefix))
+        return listing.from_pages(pages, prefix, self.iiif_settings.server_url)
 
-        r = self.client.list_objects_v2(
-            Bucket=self.settings.bucket,
-            Prefix=prefix)
-        file_meta = [meta for meta in r["Contents"] if not meta["Key"].endswith("/")]
-        items = []
-        for i, meta in enumerate(file_meta):
-            key: str = meta["Key"]
-            if THUMB_DIR in key:
-                continue
-            if not EXT_PATTERN.match(key):
-                continue
-
-            path_no_ext = os.path.splitext(key)[0]
-            item_id = path_no_ext[len(prefix):]
-            url = self.iiif_settings.server_url + quote_plus(key) + "/full/max/0/default.jpg"
-            thumb_url = self.iiif_settings.server_url + quote_plus(key) + "/full/!75,100/0/default.jpg"
-            items.append((item_id, url, thumb_url))
-        return items
+    def latest_inventory(self) -> Optional[str]:
+        """The key of the most recent inventory manifest, if any"""
+        import inventory
+        bucket, _, prefix = self.settings.inventory.partition("/")
+        keys = [meta["Key"] for page in self.list_pages(prefix, bucket) for meta in page]
+        return inventory.latest(keys)
+
+    def load_inventory(self, manifest_key: str, prefix: str) -> 'pyarrow.Table':
+        """List the images under `prefix` from an S3 Inventory report, given
+        the key of its manifest in the inventory bucket"""
+        import tempfile
+        import inventory
+        import listing
+        bucket = self.settings.inventory.partition("/")[0]
+        r = self.client.get_object(Bucket=bucket, Key=manifest_key)
+        manifest = inventory.Manifest.load(r["Body"])
+        if manifest.source_bucket != self.settings.bucket:
+            raise ValueError(f"Inventory {manifest_key} is of bucket {manifest.source_bucket}, "
+                             f"not {self.settings.bucket}")
+
+        def pages() -> Iterator[List[str]]:
+            for key in manifest.files:
+                if manifest.file_format == inventory.CSV:
+                    r = self.client.get_object(Bucket=manifest.destination_bucket, Key=key)
+                    yield from inventory.read_keys(r["Body"], manifest, prefix)
+                else:
+                    # ORC and Parquet metadata is at the end of the file
+                    with tempfile.TemporaryFile() as f:
+                        self.client.download_fileobj(Bucket=manifest.destination_bucket, Key=key, Fileobj=f)
+                        f.seek(0)
+                        yield from inventory.read_keys(f, manifest, prefix)
+
+        # NB: sorted, as listing the bucket would be, since the order of
+        # keys across data files is not defined
+        keys = sorted(key for page in pages() for key in page)
+        return listing.from_pages((keys[i:i + listing.BATCH_SIZE] for i in range(0, len(keys), listing.BATCH_SIZE)),
+                                  prefix, self.iiif_settings.server_url)
+
+    def load_files(self, prefix: Optional[str] = None) -> List[Tuple[str, str, str]]:
+        """List the images under `prefix` as (item id, URL, thumbnail URL) tuples"""
+        import listing
+        return list(listing.rows(self.load_table(prefix)))
 
     def get_meta(self, origin: str, name: str = "<unnamed>") -> Optional[Dict]:
         """Fetch the micro-archive manifest from existing storage"""
-        import io
-        buf = io.BytesIO()
+        return self.fetch_meta(origin, name)[0]
+
+    def fetch_meta(self, origin: str, name: str = "<unnamed>") -> Tuple[Optional[Dict], Optional[str]]:
+        """Fetch the micro-archive manifest and its ETag from existing storage"""
+        from botocore.exceptions import ClientError
         origin_no_slash = origin[1:] if origin.startswith('/') else origin
         try:
-            self.client.download_fileobj(
+            r = self.client.get_object(
                 Bucket=self.settings.bucket,
-                Key=os.path.join(origin_no_slash, f".meta.json"),
-                Fileobj=buf
+                Key=os.path.join(origin_no_slash, f".meta.json")
             )
-            return json.loads(buf.getvalue().decode('utf-8'))
+            return metafile.load(r["Body"]), r["ETag"]
         except ClientError:
             print(f"Unable to find existing metadata for name {name} at origin {origin}", file=sys.stderr)
+            return None, None
+
+    def meta_etag(self, origin: str) -> Optional[str]:
+        """Fetch only the ETag of the micro-archive manifest, to check if it has changed"""
+        from botocore.exceptions import ClientError
+        origin_no_slash = origin[1:] if origin.startswith('/') else origin
+        try:
+            r = self.client.head_object(
+                Bucket=self.settings.bucket,
+                Key=os.path.join(origin_no_slash, f".meta.json")
+            )
+            return r["ETag"]
+        except ClientError:
             return None
 
-    def upload(self, name: str, origin: str, index: str, xml: str, iiif: str, meta: Dict):
-        """Upload website data to storage"""
-        bucket = self.settings.bucket
+    def read_meta(self, origin: str) -> Optional[Tuple[Dict, Iterator[Tuple[str, Dict[str, str]]]]]:
+        """Stream the micro-archive manifest, returning the collection-level
+        values and an iterator over each item's (id, values)"""
+        from botocore.exceptions import ClientError
         origin_no_slash = origin[1:] if origin.startswith('/') else origin
+        try:
+            r = self.client.get_object(
+                Bucket=self.settings.bucket,
+                Key=os.path.join(origin_no_slash, f".meta.json")
+            )
+            return metafile.read(r["Body"])
+        except ClientError:
+            return None
 
+    def uploads(self, name: str, index: str, xml: str, iiif: str, meta: Dict,
+                extra: Optional[List[Tuple[str, str, str]]] = None) -> List[Upload]:
+        """The files making up a website, plus any `extra` files given
+        as (filename, content type, data) tuples"""
         files = [
             ("index.html", "text/html", index),
             (f"{name}.xml", "text/xml", xml),
             (f"{name}.json", "application/json", iiif),
-        ]
-
-        # Upload a manifest privately
-        self.client.put_object(
-            Bucket=bucket,
-            Key=os.path.join(origin_no_slash, f".meta.json"),
-            ContentType="application/json",
-            Body=json.dumps(meta, indent=2, default=str).encode('utf-8')
+        ] + (extra or [])
+
+        # The manifest is uploaded privately, the rest with Public ACL
+        return [Upload(".meta.json", "application/x-ndjson", metafile.dumps(meta), public=False, encoding="gzip")] + [
+            Upload(filename, content_type, data.encode('utf-8')) for filename, content_type, data in files]
+
+    def put(self, origin: str, upload: Upload, journal: Optional['checkpoint.Journal'] = None):
+        """Put a single file in storage. If a `journal` is given, the file is
+        skipped if it records the same content as already uploaded, and the
+        upload is recorded in it. See `checkpoint`."""
+        origin_no_slash = origin[1:] if origin.startswith('/') else origin
+        args = dict(
+            Bucket=self.settings.bucket,
+            Key=os.path.join(origin_no_slash, upload.filename),
+            ContentType=upload.content_type,
         )
+        if upload.public:
+            args["ACL"] = 'public-read'
+        if upload.encoding:
+            args["ContentEncoding"] = upload.encoding
+        if upload.cache_control:
+            args["CacheControl"] = upload.cache_control
+        sha1 = hashlib.sha1(upload.body).hexdigest() if journal else None
+        if journal and journal.is_done(args["Key"], sha1):
+            return
+        if len(upload.body) > MULTIPART_THRESHOLD:
+            self.put_multipart(args, upload.body, journal, sha1)
+        else:
+            self.client.put_object(Body=upload.body, **args)
+        if journal:
+            journal.put(args["Key"], sha1)
+
+    def put_multipart(self, args: Dict, body: bytes, journal: Optional['checkpoint.Journal'] = None,
+                      sha1: Optional[str] = None):
+        """Upload a large file in parts, continuing the upload of the same
+        content recorded in the `journal`, if any"""
+        from botocore.exceptions import ClientError
+        key = args["Key"]
+        resumed = journal.resumable(key, sha1) if journal else None
+        if journal and resumed is None and key in journal.multipart:
+            # An upload of different content, which won't be completed
+            self.abort_multipart(key, journal.multipart[key].upload_id)
+            journal.abort(key)
+        if resumed:
+            upload_id, parts = resumed.upload_id, dict(resumed.parts)
+        else:
+            upload_id, parts = self.client.create_multipart_upload(**args)["UploadId"], {}
+            if journal:
+                journal.start(key, sha1, upload_id)
+        try:
+            for number, offset in enumerate(range(0, len(body), PART_SIZE), 1):
+                if number in parts:
+                    continue
+                r = self.client.upload_part(Bucket=args["Bucket"], Key=key, UploadId=upload_id,
+                                            PartNumber=number, Body=body[offset:offset + PART_SIZE])
+                parts[number] = r["ETag"]
+                if journal:
+                    journal.part(key, upload_id, number, r["ETag"])
+            self.client.complete_multipart_upload(
+                Bucket=args["Bucket"], Key=key, UploadId=upload_id,
+                MultipartUpload={"Parts": [{"PartNumber": n, "ETag": etag} for n, etag in sorted(parts.items())]})
+        except BaseException as e:
+            if resumed and isinstance(e, ClientError) and e.response.get("Error", {}).get("Code") == "NoSuchUpload":
+                # The recorded upload has since been aborted or expired
+                print(f"Unable to resume upload of {key}, restarting", file=sys.stderr)
+                journal.abort(key)
+                self.put_multipart(args, body, journal, sha1)
+                return
+            if not journal:
+                # NB: with nothing to resume it from, the uploaded parts
+                # would only be kept, and billed, until they expire
+                self.abort_multipart(key, upload_id)
+            raise
 
-        # Upload the rest with Public ACL
-        for filename, content_type, data in files:
-            self.client.put_object(
-                ACL='public-read',
-                Bucket=bucket,
-                Key=os.path.join(origin_no_slash, filename),
-                ContentType=content_type,
-                Body=data.encode('utf-8')
+    def abort_multipart(self, key: str, upload_id: str):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.abort_multipart_upload(Bucket=self.settings.bucket, Key=key, UploadId=upload_id)
+        except ClientError:
+            pass
+
+    def upload(self, name: str, origin: str, index: str, xml: str, iiif: str, meta: Dict,
+               extra: Optional[List[Tuple[str, str, str]]] = None):
+        """Upload website data to storage, plus any `extra` files given
+        as (filename, content type, data) tuples"""
+        for upload in self.uploads(name, index, xml, iiif, meta, extra):
+            self.put(origin, upload)
+
+    def put_missing(self, uploads: List[Upload]) -> List[str]:
+        """Put files at the root of the bucket, unless they are already
+        there, returning the names of those uploaded. Intended for files
+        whose names change whenever their content does."""
+        dirs = {os.path.dirname(upload.filename) + "/" for upload in uploads}
+        existing = {meta["Key"] for d in dirs for meta in self.list_objects(d)}
+        missing = [upload for upload in uploads if upload.filename not in existing]
+        for upload in missing:
+            self.put("", upload)
+        return [upload.filename for upload in missing]
+
+    def plan_sync(self, origin: str, files: Dict[str, str], content_type: str = "text/html",
+                  state_name: str = PAGES_STATE) -> Tuple[List[Upload], List[str], Optional[Upload]]:
+        """Work out which files have changed since the last sync, returning
+        those to upload, the names of those to delete, and the new sync state
+        to upload afterwards, if it has changed."""
+        import io
+        from botocore.exceptions import ClientError
+        origin_no_slash = origin[1:] if origin.startswith('/') else origin
+        buf = io.BytesIO()
+        try:
+            self.client.download_fileobj(
+                Bucket=self.settings.bucket,
+                Key=os.path.join(origin_no_slash, state_name),
+                Fileobj=buf
             )
+            previous = json.loads(buf.getvalue().decode('utf-8'))
+        except ClientError:
+            previous = {}
+
+        current = {}
+        changed = []
+        for filename, data in files.items():
+            body = data.encode('utf-8')
+            current[filename] = hashlib.sha1(body).hexdigest()
+            if previous.get(filename) != current[filename]:
+                changed.append(Upload(filename, content_type, body))
+
+        stale = [filename for filename in previous if filename not in current]
+        state = None
+        if changed or stale or not previous:
+            state = Upload(state_name, "application/json", json.dumps(current).encode('utf-8'), public=False)
+        return changed, stale, state
+
+    def delete(self, origin: str, filenames: List[str]):
+        origin_no_slash = origin[1:] if origin.startswith('/') else origin
+        for i in range(0, len(filenames), 1000):
+            self.client.delete_objects(
+                Bucket=self.settings.bucket,
+                Delete={"Objects": [{"Key": os.path.join(origin_no_slash, f)} for f in filenames[i:i + 1000]]}
+            )
+
+    def sync_files(self, origin: str, files: Dict[str, str], content_type: str = "text/html",
+                   state_name: str = PAGES_STATE) -> List[str]:
+        """Upload only those files whose content has changed since the last sync,
+        deleting any that are no longer present. Returns the uploaded names."""
+        changed, stale, state = self.plan_sync(origin, files, content_type, state_name)
+        for upload in changed:
+            self.put(origin, upload)
+        self.delete(origin, stale)
+        if state:
+            self.put(origin, state)
+        return [upload.filename for upload in changed]
@@ -0,0 +1,50 @@
+import asyncio
+
+from aiostore import AsyncStore, upload_site
+from test_utils import *
+
+
+def test_load_files_paginated(store):
+    for i in range(2500):
+        store.client.objects[f"data/item{i:04d}.jpg"] = b""
+    store.client.objects["data/.thumb/item0000.jpg"] = b""
+    files = store.load_files("data/")
+    assert len(files) == 2500
+    assert files[0] == ("item0000", "http://example.com/iiif/3/data%2Fitem0000.jpg/full/max/0/default.jpg",
+                        "http://example.com/iiif/3/data%2Fitem0000.jpg/full/!75,100/0/default.jpg")
+    assert len([c for c in store.client.calls if c[0] == "list_objects_v2"]) == 3
+
+
+def test_async_store(store):
+    for i in range(10):
+        store.client.objects[f"data{i % 2}/item{i}.jpg"] = b""
+    engine = AsyncStore(store, concurrency=4)
+
+    async def run():
+        listings = await engine.load_many(["data0/", "data1/"])
+        await engine.upload("test", "/site1", "<html/>", "<ead/>", "{}", {"title": "Test"},
+                            [("search/index.json", "application/json", "{}")])
+        synced = await engine.sync_files("/site1", {f"pages/{i}.html": str(i) for i in range(20)})
+        metas = await engine.get_metas(["/site1", "/site2"])
+        return listings, synced, metas
+
+    listings, synced, metas = asyncio.run(run())
+    assert [len(listings["data0/"]), len(listings["data1/"])] == [5, 5]
+    assert len(synced) == 20
+    assert metas == {"/site1": {"title": "Test"}, "/site2": None}
+    assert store.client.objects["site1/search/index.json"] == b"{}"
+    assert asyncio.run(engine.sync_files("/site1", {f"pages/{i}.html": str(i) for i in range(20)})) == []
+    engine.close()
+
+
+def test_upload_site_prunes_search(store):
+    def upload(search):
+        return asyncio.run(upload_site(store, "test", "/site1", "<html/>", "<ead/>", "{}", {"title": "Test"},
+                                       search, {"pages/a.html": "a"}))
+
+    assert upload({"search/index.json": "{}", "search/ab.json": "{}"}) == ["pages/a.html"]
+    store.client.calls.clear()
+    assert upload({"search/index.json": "{}", "search/cd.json": "{}"}) == []
+    assert "site1/search/ab.json" not in store.client.objects, "a stale shard was kept"
+    assert store.client.objects["site1/search/cd.json"] == b"{}"
+    assert ("put_object", "site1/search/index.json") not in store.client.calls
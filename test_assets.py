@@ -0,0 +1,78 @@
+import assets
+import publish
+from instrument import Recorder
+from website import make_html, ASSETS_PATTERN
+from test_utils import *
+
+
+def test_fetch_local(local_assets):
+    found = assets.fetch()
+    mirador = found["mirador"]
+    assert mirador.body == b"mirador"
+    assert mirador.filename.startswith("mirador-3.3.0.min.") and mirador.filename.endswith(".js")
+    assert mirador.href == f"/_assets/{mirador.filename}"
+    # The name changes with the content
+    (local_assets / mirador.source.filename).write_bytes(b"changed")
+    assert assets.fetch()["mirador"].filename != mirador.filename
+
+
+def test_make_html_assets(archive, local_assets):
+    hrefs = {name: asset.href for name, asset in assets.fetch().items()}
+    html = make_html("test", archive, "KEY", assets=hrefs)
+    assert f'<script defer src="{hrefs["mirador"]}"></script>' in html
+    assert f'<link rel="preload" href="{hrefs["barlow"]}" as="font"' in html
+    assert "unpkg.com" not in html and "fonts.googleapis.com" not in html
+    assert "unpkg.com" in make_html("test", archive, "KEY")
+
+
+def test_prepare_assets(store, site_maker, local_assets):
+    site = site_maker.create_site("test")
+    behaviors = site_maker.client.distributions[site.id]["DistributionConfig"]["CacheBehaviors"]["Items"]
+    assert [b["PathPattern"] for b in behaviors] == [ASSETS_PATTERN]
+
+    # Until the site is deployed the third-party copies are used
+    assert publish.prepare_assets(store, site_maker, site.id, Recorder()) is None
+    keys = [key for key in store.client.objects if key.startswith("_assets/")]
+    assert len(keys) == 3
+    upload = [call for call in store.client.calls if call[0] == "put_object"]
+    site_maker.client.deploy()
+    hrefs = publish.prepare_assets(store, site_maker, site.id, Recorder())
+    assert sorted(hrefs) == ["barlow", "mirador", "noto_serif"]
+    # Assets are only uploaded once
+    assert [call for call in store.client.calls if call[0] == "put_object"] == upload
+
+
+def test_ensure_assets_existing_site(site_maker):
+    site = site_maker.create_site("old")
+    config = site_maker.client.distributions[site.id]["DistributionConfig"]
+    # A distribution created before there were shared assets
+    del config["CacheBehaviors"]
+    config["Origins"] = {"Quantity": 1, "Items": config["Origins"]["Items"][:1]}
+    site_maker.client.deploy()
+
+    assert not site_maker.ensure_assets(site.id)
+    config = site_maker.client.distributions[site.id]["DistributionConfig"]
+    assert config["Origins"]["Quantity"] == 2
+    assert config["CacheBehaviors"]["Items"][0]["PathPattern"] == ASSETS_PATTERN
+    assert site_maker.get_site(site.id).origin_id == site.origin_id
+    site_maker.client.deploy()
+    assert site_maker.ensure_assets(site.id)
+
+
+def test_prepare_assets_not_permitted(store, site_maker, local_assets):
+    from botocore.exceptions import ClientError
+    site = site_maker.create_site("test")
+    site_maker.client.deploy()
+
+    def denied(**kwargs):
+        raise ClientError({"Error": {"Code": "AccessDenied", "Message": "Denied"}}, "GetDistribution")
+
+    site_maker.client.get_distribution = denied
+    assert publish.prepare_assets(store, site_maker, site.id, Recorder()) is None
+
+
+def test_assets_origin_distinct(site_maker):
+    # A collection whose name is that of the assets path
+    site = site_maker.create_site("assets")
+    origins = site_maker.client.distributions[site.id]["DistributionConfig"]["Origins"]["Items"]
+    assert len({origin["Id"] for origin in origins}) == 2
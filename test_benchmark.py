@@ -0,0 +1,38 @@
+from benchmark import Config, run, compare, synthetic_archive, measure
+
+
+def test_synthetic_archive():
+    data, files = synthetic_archive(Config(items=50, depth=2, fanout=5))
+    assert len(files) == 50
+    assert files[0][0] == "d1-0/d0-0/item0000000"
+    assert files[49][0] == "d1-1/d0-4/item0000049"
+
+
+def test_run():
+    # NB: no memory tracing, which makes loading language data very slow
+    result = run(Config(items=50, depth=2, fanout=5), memory=False, workers=1)
+    assert list(result["stages"].keys()) == [
+        "listing", "model", "hierarchy", "ead", "iiif", "html", "pages", "search", "upload"]
+    assert result["uploaded_bytes"] > 0
+
+
+def test_measure():
+    results = {}
+    value = measure("alloc", lambda: [0] * 100_000, results)
+    assert len(value) == 100_000
+    assert results["alloc"]["peak_bytes"] >= 800_000
+    assert results["alloc"]["seconds"] >= 0
+
+
+def test_compare():
+    def results(seconds: float):
+        return {"runs": [{"config": {"items": 10}, "memory": False, "stages": {"ead": {"seconds": seconds}}}]}
+
+    assert compare(results(1.0), results(1.0), 1.25) == []
+    assert compare(results(2.0), results(1.0), 1.25) == ["ead (10 items): 1.000s -> 2.000s"]
+    assert compare(results(0.02), results(0.01), 1.25) == [], "noise should be ignored"
+
+
+def test_run_listing():
+    from benchmark import run_listing
+    assert list(run_listing(1000)["stages"]) == ["listing_python", "listing_arrow"]
@@ -0,0 +1,88 @@
+import os
+import time
+
+import publish
+from buildcache import BuildCache, fingerprint
+from ead import Ead
+from instrument import Recorder
+from website import make_pages
+from test_utils import *
+
+
+def canvas_id(item_id: str) -> str:
+    return "http://example.com/iiif/3/" + item_id
+
+
+def test_fingerprint():
+    assert fingerprint({"a": 1, "b": [1, 2]}) == fingerprint({"b": [1, 2], "a": 1})
+    assert fingerprint({"a": 1}) != fingerprint({"a": 2})
+
+
+def test_ead_fragments(archive, tmp_path):
+    cache = BuildCache(str(tmp_path))
+    expected = Ead().to_xml(archive, "http://example.com")
+    assert Ead().to_xml(archive, "http://example.com", cache=cache) == expected
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert Ead().to_xml(archive, "http://example.com", cache=cache) == expected
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    # Only the changed subtree is regenerated
+    archive.items[0].identity.title = "Changed"
+    assert Ead().to_xml(archive, "http://example.com", cache=cache) == Ead().to_xml(archive, "http://example.com")
+    assert (cache.hits, cache.misses) == (3, 3)
+
+
+def test_page_fragments(archive, tmp_path):
+    cache = BuildCache(str(tmp_path))
+    expected = make_pages("test", archive, "KEY", canvas_id)
+    assert make_pages("test", archive, "KEY", canvas_id, cache=cache) == expected
+    assert make_pages("test", archive, "KEY", canvas_id, cache=cache) == expected
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    archive.items[3].content.scope = "Changed"
+    assert make_pages("test", archive, "KEY", canvas_id, cache=cache) == make_pages("test", archive, "KEY", canvas_id)
+    assert (cache.hits, cache.misses) == (3, 3)
+    # Different settings do not share pages
+    make_pages("test", archive, "OTHER", canvas_id, cache=cache)
+    assert cache.misses == 5
+
+
+def test_generate_cached(archive, store, tmp_path):
+    cache = BuildCache(str(tmp_path))
+
+    def generate():
+        return publish.generate(archive, "test", "http://example.com", "KEY", store, ".jpg", "data/", Recorder(),
+                                cache=cache)
+
+    files = generate()
+    assert cache.get("site", "missing") is None
+    hits = cache.hits
+    assert generate() == files
+    assert cache.hits == hits + 1
+
+    archive.identity.title = "Changed"
+    assert generate() != files
+    assert len([f for _, _, fs in os.walk(tmp_path / "site") for f in fs]) == 1, "a build was kept for each version"
+
+
+def test_concurrent_put(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    cache = BuildCache(str(tmp_path))
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(lambda i: cache.put("ead", "ab", str(i)), range(100)))
+    assert cache.get("ead", "ab") is not None
+    assert os.listdir(os.path.dirname(cache.path("ead", "ab"))) == ["ab.json"]
+
+
+def test_prune(tmp_path):
+    cache = BuildCache(str(tmp_path), max_bytes=20, max_age=3600)
+    for key in ["aa", "bb", "cc"]:
+        cache.put("ead", key, "0123456")  # 9 bytes as JSON
+    os.utime(cache.path("ead", "aa"), (0, 0))
+    os.utime(cache.path("ead", "bb"), (time.time() - 60, time.time() - 60))
+    assert cache.prune() == 1
+    assert cache.get("ead", "aa") is None, "an old artifact was kept"
+    cache.put("ead", "dd", "0123456")
+    assert cache.prune() == 1
+    assert cache.get("ead", "bb") is None, "the least recently used artifact was kept"
+    assert cache.get("ead", "cc") is not None and cache.get("ead", "dd") is not None
@@ -0,0 +1,74 @@
+import io
+import itertools
+
+import pytest
+
+import bulkmeta
+from microarchive import ItemData, KEYS
+
+
+def test_export_import_csv():
+    data = ItemData()
+    data.set("a", KEYS.TITLE, "Title A")
+    data.set("b", KEYS.SCOPE, "Scope, with \"quotes\"\nand lines")
+    out = io.StringIO()
+    assert bulkmeta.export_items(out, bulkmeta.CSV, data, ["a", "b", "c"]) == 3
+
+    imported = ItemData()
+    report = bulkmeta.import_items(io.StringIO(out.getvalue()), bulkmeta.CSV, imported, ["a", "b", "c"])
+    assert imported.values == data.values
+    assert (report.rows, report.updated, report.unknown_count, report.missing_count) == (3, 2, 0, 0)
+
+
+def test_import_ndjson_report():
+    data = ItemData()
+    data.set("a", KEYS.TITLE, "Old")
+    data.set("a", KEYS.SCOPE, "Kept")
+    data.set("b", KEYS.TITLE, "Cleared")
+    lines = [
+        '{"id": "a", "title": "New"}',
+        '',
+        '{"id": "b", "title": ""}',
+        '{"id": "x", "title": "Unknown"}',
+    ]
+    report = bulkmeta.import_items(io.StringIO("\n".join(lines)), bulkmeta.NDJSON, data, ["a", "b", "c", "d"])
+    assert data.values == {"a": {KEYS.TITLE: "New", KEYS.SCOPE: "Kept"}}
+    assert (report.rows, report.updated) == (3, 2)
+    assert (report.unknown_count, report.unknown) == (1, ["x"])
+    assert (report.missing_count, report.missing) == (2, ["c", "d"])
+    assert "2 items not in file: c, d" in report.summary()
+
+
+def test_import_errors():
+    with pytest.raises(ValueError):
+        bulkmeta.import_items(io.StringIO("name,title\na,A\n"), bulkmeta.CSV, ItemData(), ["a"])
+    with pytest.raises(ValueError):
+        bulkmeta.import_items(io.StringIO('{"title": "A"}\n'), bulkmeta.NDJSON, ItemData(), ["a"])
+    with pytest.raises(ValueError, match="Row 2 is not an object"):
+        bulkmeta.import_items(io.StringIO('{"id": "a"}\n[1]\n'), bulkmeta.NDJSON, ItemData(), ["a"])
+    with pytest.raises(ValueError, match="Row 1 is not valid JSON"):
+        bulkmeta.import_items(io.StringIO('{"id": \n'), bulkmeta.NDJSON, ItemData(), ["a"])
+    with pytest.raises(ValueError):
+        bulkmeta.guess_format("items.xlsx")
+    assert bulkmeta.guess_format("Items.JSONL") == bulkmeta.NDJSON
+
+
+def test_import_all_or_nothing():
+    data = ItemData()
+    data.set("a", KEYS.TITLE, "Old")
+    lines = ['{"id": "a", "title": "New"}', '{"id": "b", "title": 1}']
+    with pytest.raises(ValueError, match="Row 2"):
+        bulkmeta.import_items(io.StringIO("\n".join(lines)), bulkmeta.NDJSON, data, ["a", "b"])
+    assert data.values == {"a": {KEYS.TITLE: "Old"}}, "rows before the invalid one were imported"
+
+
+def test_import_streams():
+    count = 100000
+
+    # Rows generated as they are read, as from a file
+    rows = itertools.chain(["id,title,scope\n"], (f"item{i},Title {i},\n" for i in range(count)))
+    report = bulkmeta.import_items(rows, bulkmeta.CSV, ItemData(), ["item1"])
+    assert report.rows == count
+    assert report.updated == 1
+    assert report.unknown_count == count - 1
+    assert len(report.unknown) == bulkmeta.MAX_REPORTED
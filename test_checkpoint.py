@@ -0,0 +1,125 @@
+import pytest
+
+import store as store_module
+from checkpoint import Journal, JournalLocked
+from store import Upload
+from test_utils import store
+
+
+@pytest.fixture
+def small_parts(monkeypatch):
+    monkeypatch.setattr(store_module, "MULTIPART_THRESHOLD", 10)
+    monkeypatch.setattr(store_module, "PART_SIZE", 4)
+
+
+def test_journal_replay(tmp_path):
+    journal = Journal.open(str(tmp_path), "bucket", "/site1")
+    journal.put("site1/index.html", "abc")
+    journal.start("site1/big.xml", "def", "upload1")
+    journal.part("site1/big.xml", "upload1", 1, '"etag1"')
+    with open(journal.path, 'a') as f:
+        f.write('{"op": "part", "key": "site1/big')  # interrupted mid-write
+    journal.close()
+
+    journal = Journal.open(str(tmp_path), "bucket", "site1")
+    assert journal.is_done("site1/index.html", "abc")
+    assert not journal.is_done("site1/index.html", "changed")
+    assert journal.resumable("site1/big.xml", "def").parts == {1: '"etag1"'}
+    assert journal.resumable("site1/big.xml", "changed") is None
+    journal.clear()
+    assert not Journal.open(str(tmp_path), "bucket", "site1").done
+
+
+def test_journal_locked(tmp_path):
+    journal = Journal.open(str(tmp_path), "bucket", "site1")
+    with pytest.raises(JournalLocked):
+        Journal.open(str(tmp_path), "bucket", "site1")
+    journal.close()
+    Journal.open(str(tmp_path), "bucket", "site1").clear()
+
+
+def test_resume_multipart(store, small_parts, tmp_path):
+    body = b"0123456789abcdefghij"
+    journal = Journal.open(str(tmp_path), "test", "site1")
+    upload_part = store.client.upload_part
+
+    def failing(**kwargs):
+        if kwargs["PartNumber"] == 3:
+            raise ConnectionError("network down")
+        return upload_part(**kwargs)
+
+    store.client.upload_part = failing
+    with pytest.raises(ConnectionError):
+        store.put("site1", Upload("big.xml", "text/xml", body), journal)
+    store.client.upload_part = upload_part
+    journal.close()
+
+    store.client.calls.clear()
+    journal = Journal.open(str(tmp_path), "test", "site1")
+    store.put("site1", Upload("big.xml", "text/xml", body), journal)
+    journal.close()
+    assert store.client.objects["site1/big.xml"] == body
+    assert store.client.calls == [("upload_part", "site1/big.xml", 3), ("upload_part", "site1/big.xml", 4),
+                                  ("upload_part", "site1/big.xml", 5), ("complete_multipart_upload", "site1/big.xml")]
+
+    # Once recorded as done, unchanged content is skipped
+    store.client.calls.clear()
+    store.put("site1", Upload("big.xml", "text/xml", body), Journal.open(str(tmp_path), "test", "site1"))
+    assert store.client.calls == []
+
+
+def test_resume_expired_multipart(store, small_parts, tmp_path):
+    import hashlib
+    journal = Journal.open(str(tmp_path), "test", "site1")
+    body = b"0123456789abcdefghij"
+    journal.start("site1/big.xml", hashlib.sha1(body).hexdigest(), "expired")
+    store.put("site1", Upload("big.xml", "text/xml", body), journal)
+    assert store.client.objects["site1/big.xml"] == body
+    assert ("create_multipart_upload", "site1/big.xml") in store.client.calls
+
+
+def test_changed_content_aborts_upload(store, small_parts, tmp_path):
+    journal = Journal.open(str(tmp_path), "test", "site1")
+    upload_id = store.client.create_multipart_upload(Bucket="test", Key="site1/big.xml")["UploadId"]
+    journal.start("site1/big.xml", "0" * 40, upload_id)
+    store.put("site1", Upload("big.xml", "text/xml", b"0123456789abcdefghij"), journal)
+    assert ("abort_multipart_upload", "site1/big.xml") in store.client.calls
+    assert store.client.uploads == {}
+
+
+def test_resume_publish(store, tmp_path):
+    from instrument import Recorder
+    from publish import SiteFiles, upload
+    files = SiteFiles("<html/>", "<ead/>", "{}", {f"pages/{i}.html": str(i) for i in range(20)}, [])
+    put_object = store.client.put_object
+    count = [0]
+
+    def failing(**kwargs):
+        count[0] += 1
+        if count[0] > 10:
+            raise ConnectionError("network down")
+        put_object(**kwargs)
+
+    store.client.put_object = failing
+    with pytest.raises(ConnectionError):
+        upload(store, "test", "/site1", files, {"title": "Test"}, Recorder(), str(tmp_path))
+    store.client.put_object = put_object
+
+    store.client.calls.clear()
+    upload(store, "test", "/site1", files, {"title": "Test"}, Recorder(), str(tmp_path))
+    puts = [c for c in store.client.calls if c[0] == "put_object"]
+    # 26 files, including the pages and search states, of which 10 were uploaded
+    assert len(puts) == 26 - 10
+    assert all(f"site1/pages/{i}.html" in store.client.objects for i in range(20))
+    assert list(tmp_path.iterdir()) == [], "the journal is removed once done"
+
+
+def test_failed_multipart_aborted(store, small_parts):
+    def failing(**kwargs):
+        raise ConnectionError("network down")
+
+    store.client.upload_part = failing
+    with pytest.raises(ConnectionError):
+        store.put("site1", Upload("big.xml", "text/xml", b"0123456789abcdefghij"))
+    assert ("abort_multipart_upload", "site1/big.xml") in store.client.calls
+    assert store.client.uploads == {}
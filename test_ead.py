@@ -32,3 +32,16 @@ def test_to_xml(archive):
     item5 = doc.find('./e:archdesc/e:did/e:materialspec/e:extptr', EAD_NS)
     assert item5 is not None, "could not find 'materialspec/extptr' element"
     assert item5.attrib.get('{http://www.w3.org/1999/xlink}href') == "https://example.com/ead.xml"
+
+
+def test_to_xml_parallel(archive):
+    assert Ead().to_xml(archive, "https://example.com/ead.xml", workers=2) == \
+           Ead().to_xml(archive, "https://example.com/ead.xml", workers=1)
+
+
+def test_langmaterial(archive):
+    archive.description.lang = ["de", "fr"]
+    xml = Ead().to_xml(archive)
+    assert '<language langcode="deu">German</language>' in xml
+    assert '<language langcode="fra">French</language>' in xml
+    assert archive.description.languages() == ["German", "French"]
@@ -18,3 +18,62 @@ def test_to_json(archive):
     assert value_of(data, "structures", 0, "label", "en", 0) == "Dir1"
     assert value_of(data, "structures", 0, "items", 0, "label", "en", 0) == "Dir1-1"
     assert len(value_of(data, "structures", 0, "items")) == 2
+
+
+def test_image_service(archive):
+    iiif = IIIFManifest(
+        baseurl="http://example.com/",
+        name="test",
+        service_url="http://example.com/iiif/3/",
+        image_format=".tif",
+        prefix="foobar/")
+    data = json.loads(iiif.to_json(archive))
+    body = value_of(data, "items", 0, "items", 0, "items", 0, "body")
+    service = "http://example.com/iiif/3/foobar%2FDir1%2FDir1-1%2Fitem1.tif"
+    assert body["id"] == service + "/full/max/0/default.jpg"
+    assert body["service"] == [{"id": service, "type": "ImageService3", "profile": "level1"}]
+    assert value_of(data, "items", 0, "thumbnail", 0, "id") == service + "/full/!100,150/0/default.jpg"
+
+    iiif.tile_size = 512
+    iiif.sizes = [{"width": 150, "height": 200}]
+    data = json.loads(iiif.to_json(archive))
+    service = value_of(data, "items", 3, "items", 0, "items", 0, "body", "service", 0)
+    assert service["tiles"] == [{"width": 512, "scaleFactors": [1, 2, 4, 8, 16]}]
+    assert service["sizes"] == [{"width": 150, "height": 200}]
+
+
+def test_server_ring():
+    from iiif import ServerRing
+    servers = [f"http://iiif{i}.example.com/iiif/3/" for i in range(4)]
+    keys = [f"data/dir{i % 10}/item{i}" for i in range(4000)]
+    ring = ServerRing(servers)
+    assigned = [ring.server(key) for key in keys]
+    assert [servers[i] for i in ring.indices(keys)] == assigned
+    assert all(600 < assigned.count(server) < 1400 for server in servers), "images are spread evenly"
+
+    # Adding a server only moves images to the new one
+    grown = ServerRing(servers + ["http://iiif4.example.com/iiif/3/"])
+    moved = [(a, b) for a, b in zip(assigned, map(grown.server, keys)) if a != b]
+    assert all(b == "http://iiif4.example.com/iiif/3/" for _, b in moved)
+    assert len(moved) < len(keys) * 0.3
+
+    assert ServerRing(servers[0]).server("anything") == servers[0]
+
+
+def test_sharded_manifest(archive):
+    import listing
+    servers = ["http://iiif1.example.com/iiif/3/", "http://iiif2.example.com/iiif/3/"]
+    iiif = IIIFManifest(baseurl="http://example.com/", name="test", service_url=servers,
+                        image_format=".jpg", prefix="foobar/")
+    data = json.loads(iiif.to_json(archive))
+    # The manifest and the listing agree on the server for each image
+    rows = listing.python_rows([f"foobar/{item.id}.jpg" for item in archive.items], "foobar/", servers)
+    for canvas, (_, url, _) in zip(data["items"], rows):
+        assert value_of(canvas, "items", 0, "items", 0, "body", "id") == url
+    # Canvas ids do not depend on the servers
+    reordered = IIIFManifest(baseurl="http://example.com/", name="test", service_url=list(reversed(servers)),
+                             image_format=".jpg", prefix="foobar/")
+    assert [canvas["id"] for canvas in json.loads(reordered.to_json(archive))["items"]] == \
+           [canvas["id"] for canvas in data["items"]]
+    assert iiif.canvas_id("a") == IIIFManifest(baseurl="http://example.com/", name="test", service_url=servers[0],
+                                               image_format=".jpg", prefix="foobar/").canvas_id("a")
@@ -0,0 +1,49 @@
+import io
+import json
+
+import boto3
+from botocore.stub import Stubber
+
+from instrument import Recorder
+
+
+def test_recorder():
+    out = io.StringIO()
+    recorder = Recorder(trace_memory=True, out=out, prefix="test/")
+    with recorder.stage("alloc"):
+        data = [0] * 100_000
+    with recorder.stage("noop"):
+        pass
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [line["name"] for line in lines] == ["alloc", "noop"]
+    assert lines[0]["prefix"] == "test/"
+    assert lines[0]["peak_bytes"] >= 800_000
+    assert lines[1]["peak_bytes"] < lines[0]["peak_bytes"], "peak not reset between stages"
+    assert [row["name"] for row in recorder.rows()] == ["alloc", "noop", "total"]
+
+
+def test_watch():
+    client = boto3.client("s3", region_name="eu-west-1", aws_access_key_id="test", aws_secret_access_key="test")
+    stubber = Stubber(client)
+    for _ in range(3):
+        stubber.add_response("put_object", {})
+    stubber.activate()
+
+    recorder = Recorder()
+    with recorder.watch(client), recorder.stage("upload"):
+        client.put_object(Bucket="test", Key="a", Body=b"hello")
+    client.put_object(Bucket="test", Key="b", Body=b"unwatched")
+    assert recorder.stages[0].api_calls == 1
+    assert recorder.stages[0].upload_bytes == 5
+
+    with recorder.watch(client), recorder.stage("text"):
+        client.put_object(Bucket="test", Key="c", Body="héllo")
+    assert recorder.stages[1].upload_bytes == 6, "characters counted, not bytes"
+
+
+def test_close(tmp_path):
+    with Recorder(out=open(tmp_path / "metrics.jsonl", 'w')) as recorder:
+        with recorder.stage("noop"):
+            pass
+    assert recorder.out.closed
+    assert json.loads((tmp_path / "metrics.jsonl").read_text())["name"] == "noop"
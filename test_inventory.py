@@ -0,0 +1,124 @@
+import gzip
+import io
+import json
+from urllib.parse import quote_plus
+
+import pyarrow as pa
+import pytest
+
+import inventory
+import listing
+from test_utils import store
+
+KEYS = ["data/a/img1.jpg", "data/a/img 2.jpg", "data/b/ünï+cøde.tif", "data/.thumb/img1.jpg",
+        "data/b/", "other/img3.jpg", "data/c/img4.png"]
+SERVER_URL = "http://example.com/iiif/3/"
+
+
+def manifest(fmt: str, schema: str, files):
+    return {
+        "sourceBucket": "test",
+        "destinationBucket": "arn:aws:s3:::inventories",
+        "fileFormat": fmt,
+        "fileSchema": schema,
+        "files": [{"key": f, "size": 0, "MD5checksum": ""} for f in files],
+    }
+
+
+def csv_report(rows) -> bytes:
+    lines = "".join(",".join(f'"{v}"' for v in row) + "\n" for row in rows)
+    return gzip.compress(lines.encode("utf-8"))
+
+
+def parquet_report(columns) -> bytes:
+    import pyarrow.parquet as pq
+    buf = io.BytesIO()
+    # Small row groups, so the file is read in several batches
+    pq.write_table(pa.table(columns), buf, row_group_size=2)
+    return buf.getvalue()
+
+
+def test_manifest_schemas():
+    csv = inventory.Manifest.parse(manifest("CSV", "Bucket, Key, VersionId, IsLatest, IsDeleteMarker, Size", []))
+    assert csv.columns == ["bucket", "key", "version_id", "is_latest", "is_delete_marker", "size"]
+    assert csv.destination_bucket == "inventories"
+    orc = inventory.Manifest.parse(manifest("ORC", "struct<bucket:string,key:string,size:bigint>", []))
+    assert orc.columns == ["bucket", "key", "size"]
+    parquet = inventory.Manifest.parse(manifest(
+        "Parquet", "message s3.inventory { required binary bucket (STRING); required binary key (STRING); "
+                   "optional int64 size; }", []))
+    assert parquet.columns == ["bucket", "key", "size"]
+    with pytest.raises(ValueError):
+        inventory.Manifest.parse(manifest("XML", "", []))
+
+
+def test_decode_keys():
+    keys = ["data/a/img 2.jpg", "data/b/ünï+cøde.tif", "50%.jpg"]
+    encoded = pa.array([quote_plus(key) for key in keys])
+    assert inventory.decode_keys(encoded).to_pylist() == keys
+
+
+def test_read_csv_versions(tmp_path):
+    data = manifest("CSV", "Bucket, Key, VersionId, IsLatest, IsDeleteMarker", ["data.csv.gz"])
+    path = tmp_path / "data.csv.gz"
+    path.write_bytes(csv_report([
+        ["test", quote_plus("data/a/img1.jpg"), "v2", "true", "false"],
+        ["test", quote_plus("data/a/img1.jpg"), "v1", "false", "false"],
+        ["test", quote_plus("data/a/gone.jpg"), "v3", "true", "true"],
+        ["test", quote_plus("other/img3.jpg"), "v4", "true", "false"],
+    ]))
+    with open(path, "rb") as f:
+        keys = [key for batch in inventory.read_keys(f, inventory.Manifest.parse(data), "data/") for key in batch]
+    assert keys == ["data/a/img1.jpg"]
+
+
+def test_latest():
+    assert inventory.latest([
+        "reports/test/all/2024-01-01T01-00Z/manifest.json",
+        "reports/test/all/2024-01-02T01-00Z/manifest.checksum",
+        "reports/test/all/2024-01-02T01-00Z/manifest.json",
+        "reports/test/all/hive/dt=2024-01-03-01-00/symlink.txt",
+    ]) == "reports/test/all/2024-01-02T01-00Z/manifest.json"
+    assert inventory.latest([]) is None
+
+
+def test_load_inventory_csv(store):
+    store.settings.inventory = "inventories/reports/test/all/"
+    # Split over two files, unsorted
+    store.client.objects.update({
+        "reports/test/all/2024-01-01T01-00Z/manifest.json": json.dumps(
+            manifest("CSV", "Bucket, Key, Size", ["reports/data/1.csv.gz", "reports/data/2.csv.gz"])).encode(),
+        "reports/data/1.csv.gz": csv_report([["test", quote_plus(key), "1"] for key in KEYS[4:]]),
+        "reports/data/2.csv.gz": csv_report([["test", quote_plus(key), "1"] for key in KEYS[:4]]),
+    })
+    table = store.load_table("data/")
+    assert list(listing.rows(table)) == listing.python_rows(sorted(k for k in KEYS if k.startswith("data/")),
+                                                            "data/", SERVER_URL)
+    assert table.num_rows == 4
+    assert ("list_objects_v2", "data/") not in store.client.calls
+
+
+def test_load_inventory_parquet(store):
+    store.settings.inventory = "inventories/reports/"
+    store.client.objects.update({
+        "reports/test/all/2024-01-01T01-00Z/manifest.json": json.dumps(
+            manifest("Parquet", "message s3.inventory { required binary bucket; required binary key; }",
+                     ["reports/data/1.parquet"])).encode(),
+        "reports/data/1.parquet": parquet_report({"bucket": ["test"] * len(KEYS), "key": KEYS}),
+    })
+    assert list(listing.rows(store.load_table("data/"))) == listing.python_rows(
+        sorted(k for k in KEYS if k.startswith("data/")), "data/", SERVER_URL)
+
+
+def test_load_inventory_other_bucket(store):
+    store.settings.inventory = "inventories/reports/"
+    store.client.objects["reports/test/all/2024-01-01T01-00Z/manifest.json"] = json.dumps(
+        manifest("CSV", "Bucket, Key", []) | {"sourceBucket": "other"}).encode()
+    with pytest.raises(ValueError):
+        store.load_table("data/")
+
+
+def test_no_inventory(store):
+    store.settings.inventory = "inventories/reports/"
+    store.client.objects["data/a/img1.jpg"] = b""
+    assert store.load_table("data/").num_rows == 1
@@ -0,0 +1,141 @@
+import json
+import threading
+import time
+
+import pytest
+
+import publish
+from jobs import Job, JobRunner, JobContext, DONE, FAILED, CANCELLED, INTERRUPTED, QUEUED
+from microarchive import KEYS
+from website import SiteInfo
+from test_utils import *
+
+
+def wait(runner: JobRunner, job_id: str):
+    runner.shutdown(wait=True)
+    return runner.get(job_id)
+
+
+def test_run_job(tmp_path):
+    def handler(job: JobContext):
+        with job.stage("one", "Stage one..."):
+            job.state["x"] = job.params["x"]
+        with job.stage("two"):
+            job.progress("Halfway...")
+        return {"y": job.params["x"] * 2}
+
+    runner = JobRunner(str(tmp_path), {"test": handler})
+    job = runner.submit("test", {"x": 2})
+    job = wait(runner, job.id)
+    assert job.status == DONE
+    assert job.completed == ["one", "two"]
+    assert job.state == {"x": 2}
+    assert job.result == {"y": 4}
+
+    # The job state is persisted
+    assert JobRunner(str(tmp_path), {}).get(job.id) == job
+
+
+def test_job_data(tmp_path):
+    runner = JobRunner(str(tmp_path), {"test": lambda job: {"length": len(job.data["title"])}})
+    job = wait(runner, runner.submit("test", {}, {"title": "Test"}).id)
+    assert job.result == {"length": 4}
+    assert "Test" not in (tmp_path / f"{job.id}.json").read_text(), "the data was saved with the job state"
+    # The data is not taken for another job's state
+    assert [j.id for j in JobRunner(str(tmp_path), {}).list()] == [job.id]
+    assert not (tmp_path / f"{job.id}.data").exists(), "the data of a done job was kept"
+
+
+def test_retention(tmp_path):
+    runner = JobRunner(str(tmp_path), {})
+    runner.save(Job("old", "test", {}, status=DONE))
+    runner.save(Job("failed", "test", {}, status=FAILED))
+    with open(tmp_path / "old.json", 'r') as f:
+        data = json.load(f)
+    with open(tmp_path / "old.json", 'w') as f:
+        json.dump(data | {"updated": time.time() - 3600}, f)
+    runner = JobRunner(str(tmp_path), {}, retention=60)
+    assert [job.id for job in runner.list()] == ["failed"]
+    assert not (tmp_path / "old.json").exists()
+
+
+def test_failed_job(tmp_path):
+    def handler(job: JobContext):
+        raise ValueError("Bad thing")
+
+    runner = JobRunner(str(tmp_path), {"test": handler})
+    job = wait(runner, runner.submit("test", {}).id)
+    assert job.status == FAILED
+    assert job.error == "ValueError: Bad thing"
+    with pytest.raises(ValueError):
+        runner.submit("unknown", {})
+
+
+def test_cancel_and_resume(tmp_path):
+    started, release = threading.Event(), threading.Event()
+    runs = []
+
+    def handler(job: JobContext):
+        runs.append(list(job.job.completed))
+        if not job.done("one"):
+            with job.stage("one"):
+                started.set()
+                release.wait(5)
+        with job.stage("two"):
+            pass
+
+    runner = JobRunner(str(tmp_path), {"test": handler})
+    job = runner.submit("test", {})
+    started.wait(5)
+    runner.cancel(job.id)
+    release.set()
+    job = wait(runner, job.id)
+    assert job.status == CANCELLED
+    assert job.completed == ["one"]
+
+    runner = JobRunner(str(tmp_path), {"test": handler})
+    job = wait(runner, runner.resume(job.id).id)
+    assert job.status == DONE
+    assert job.completed == ["one", "two"]
+    assert runs == [[], ["one"]]
+    with pytest.raises(ValueError):
+        runner.resume(job.id)
+
+
+def test_interrupted(tmp_path):
+    runner = JobRunner(str(tmp_path), {})
+    stuck = Job("abc", "test", {}, status=QUEUED)
+    runner.save(stuck)
+    assert JobRunner(str(tmp_path), {}).get("abc").status == INTERRUPTED
+
+
+class FakeSiteMaker:
+    def __init__(self, store):
+        self.client = store.client
+        self.created = []
+
+    def get_or_create_site(self, name, site_id=None):
+        self.created.append(name)
+        return SiteInfo("SITE1", "site1.example.com", "/site1", "Deployed")
+
+    def ensure_assets(self, site_id):
+        return True
+
+
+def test_publish_job(tmp_path, store, monkeypatch, local_assets):
+    for i in range(3):
+        store.client.objects[f"data/dir/item{i}.jpg"] = b""
+    monkeypatch.setattr(publish, "wait_for_url", lambda url, check: True)
+    site_maker = FakeSiteMaker(store)
+    runner = JobRunner(str(tmp_path), {"publish": lambda job: publish.publish_job(job, store, site_maker)})
+    data = {KEYS.TITLE: "Test Site", KEYS.DATE_DESC: "2023-01-01", publish.PREFIX: "data/", publish.FORMAT: ".jpg"}
+    job = wait(runner, runner.submit("publish", {}, data).id)
+    assert job.status == DONE, job.error
+    assert job.completed == publish.PUBLISH_STAGES
+    assert job.result["url"] == "https://site1.example.com"
+    assert job.result["pages"] == 4
+    assert [row["name"] for row in job.state["timings"]][:4] == ["site", "listing", "assets", "model"]
+    assert "site1/test-site.xml" in store.client.objects
+    assert "site1/pages/dir/item0.html" in store.client.objects
+    assert site_maker.created == ["test-site"]
+    assert b"/_assets/mirador-3.3.0.min." in store.client.objects["site1/index.html"]
@@ -0,0 +1,14 @@
+import languages
+
+
+def test_data_file_current():
+    # NB: if this fails, regenerate the data file with `python languages.py`
+    assert languages.table() == languages.build()
+
+
+def test_lookup():
+    assert languages.lookup("de") == languages.Language("de", "German", "deu")
+    assert languages.name("fr") == "French"
+    assert "en" in languages.codes()
+    # Codes not in the table are still looked up
+    assert languages.lookup("en-GB").alpha3 == "eng"
@@ -0,0 +1,39 @@
+import listing
+from benchmark import listing_keys
+from test_utils import *
+
+SERVER = "http://example.com/iiif/3/"
+
+
+def test_from_keys():
+    keys = ["pré/dir/", "pré/dir/a file.JPG", "pré/dir/.thumb/a file.jpg", "pré/b.tif", "pré/c.txt",
+            "pré/d&e/ü.png", "pré/v1.2/img.jpeg", "pré/a..jpg"]
+    table = listing.from_keys(keys, "pré/", SERVER)
+    assert table[listing.ID].to_pylist() == ["dir/a file", "b", "d&e/ü", "v1.2/img", "a."]
+    assert table[listing.URL][0].as_py() == SERVER + "pr%C3%A9%2Fdir%2Fa+file.JPG/full/max/0/default.jpg"
+    assert table[listing.THUMB_URL][2].as_py() == SERVER + "pr%C3%A9%2Fd%26e%2F%C3%BC.png/full/!75,100/0/default.jpg"
+    assert list(listing.rows(table)) == listing.python_rows(keys, "pré/", SERVER)
+
+
+def test_from_pages(monkeypatch):
+    keys = listing_keys(3000)
+    pages = [keys[i:i + 1000] for i in range(0, len(keys), 1000)]
+    monkeypatch.setattr(listing, "BATCH_SIZE", 1500)
+    table = listing.from_pages(pages, "bench/", SERVER)
+    assert list(listing.rows(table)) == listing.python_rows(keys, "bench/", SERVER)
+    assert listing.from_pages([], "bench/", SERVER).num_rows == 0
+
+
+def test_load_table(store):
+    store.client.objects["data/a b.jpg"] = b""
+    store.client.objects["data/.thumb/a b.jpg"] = b""
+    assert store.load_table("data/")[listing.ID].to_pylist() == ["a b"]
+    assert store.load_table(None).num_rows == 0
+
+
+def test_sharded():
+    servers = [SERVER, "http://example.org/iiif/3/", "http://example.net/iiif/3/"]
+    keys = listing_keys(1000)
+    table = listing.from_keys(keys, "bench/", servers)
+    assert list(listing.rows(table)) == listing.python_rows(keys, "bench/", servers)
+    assert {url.split("bench")[0] for url in table[listing.URL].to_pylist()} == set(servers)
@@ -0,0 +1,104 @@
+import threading
+import time
+
+import pyarrow as pa
+import pytest
+
+from lrucache import LRUCache, size_of
+
+
+def test_load():
+    cache = LRUCache()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return {"title": "Test", "langs": ["en"]}
+
+    value = cache.load("meta", "/site1", loader)
+    assert cache.load("meta", "/site1", loader) is value, "values are not copied"
+    assert len(calls) == 1
+    with pytest.raises(TypeError):
+        value["title"] = "Changed"
+    assert value["langs"] == ["en"]
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.entries) == (1, 1, 1)
+
+
+def test_load_once():
+    cache = LRUCache()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return pa.table({"id": ["a", "b"]})
+
+    threads = [threading.Thread(target=cache.load, args=("listing", "data/", loader)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+
+
+def test_load_once_uncached():
+    cache = LRUCache(max_bytes=10)
+    calls, values = [], []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return pa.table({"id": [f"item{i}" for i in range(100)]})
+
+    threads = [threading.Thread(target=lambda: values.append(cache.load("listing", "data/", loader)))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1, "a value too large to cache was loaded again by waiting threads"
+    assert all(value is values[0] for value in values)
+    assert cache.loading == {} and cache.stats().entries == 0
+
+    # Once no thread is waiting it isn't kept
+    cache.load("listing", "data/", loader)
+    assert len(calls) == 2
+
+
+def test_evict_lru():
+    table = pa.table({"id": [f"item{i}" for i in range(1000)]})
+    cache = LRUCache(max_bytes=size_of(table) * 2 + 10)
+    cache.put("listing", "a/", table)
+    cache.put("listing", "b/", table)
+    cache.get("listing", "a/")
+    cache.put("listing", "c/", table)
+    assert cache.get("listing", "b/") is None, "the least recently used is evicted"
+    assert cache.get("listing", "a/") is table
+    assert cache.stats().evictions == 1
+    assert cache.stats().size <= cache.max_bytes
+
+    cache.put("listing", "huge/", pa.table({"id": [f"item{i}" for i in range(10000)]}))
+    assert cache.get("listing", "huge/") is None, "values over budget are not cached"
+    assert cache.get("listing", "c/") is table
+
+
+def test_ttl():
+    now = [0.0]
+    cache = LRUCache(ttl=10, clock=lambda: now[0])
+    cache.put("site", "E1", "info")
+    now[0] = 5
+    assert cache.get("site", "E1") == "info"
+    now[0] = 11
+    assert cache.get("site", "E1") is None
+    assert cache.stats().entries == 0
+
+
+def test_invalidate():
+    cache = LRUCache()
+    for key in ["data/", "data/sub/", "other/"]:
+        cache.put("listing", key, [key])
+    cache.put("meta", "data/", {})
+    assert cache.invalidate("listing", "data/") == 2
+    assert cache.get("listing", "other/") == ("other/",)
+    assert cache.get("meta", "data/") == {}
@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+from typing import Dict
+
+# Third-party modules that are slow to import and needed only by some stages
+HEAVY_MODULES = {"boto3", "iiif_prezi3", "pydantic", "jinja2", "langcodes", "slugify", "pyarrow"}
+
+
+def import_times(*args: str) -> Dict[str, int]:
+    """Run Python with `-X importtime`, returning the cumulative import
+    time of each module, in microseconds"""
+    r = subprocess.run([sys.executable, "-X", "importtime", *args], capture_output=True, text=True,
+                       cwd=os.path.dirname(os.path.realpath(__file__)), env=os.environ | {"S3_REGION": "eu-west-1"})
+    assert r.returncode == 0, r.stderr
+    times = {}
+    for line in r.stderr.splitlines():
+        if line.startswith("import time:") and not line.endswith("package"):
+            _, cumulative, name = line.split("|")
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_startup_imports():
+    times = import_times("-c", "import make_website")
+    print(f"make_website import time: {times['make_website'] / 1000:.1f}ms")
+    assert not HEAVY_MODULES & times.keys()
+
+
+def test_ead_imports():
+    times = import_times("make_website.py", "--ead")
+    assert not {"iiif_prezi3", "pydantic", "jinja2", "pyarrow"} & times.keys()
@@ -0,0 +1,48 @@
+import io
+import json
+
+import metafile
+from microarchive import item_key, KEYS
+from test_utils import *
+
+
+@pytest.fixture
+def meta(archive):
+    return archive.to_data() | {"prefix": "foobar/", "format": ".jpg"}
+
+
+def test_round_trip(meta):
+    assert metafile.loads(metafile.dumps(meta)) == meta
+    assert metafile.loads(metafile.dumps(meta, compress=False)) == meta
+
+
+def test_deterministic(meta):
+    import time
+    first = metafile.dumps(meta)
+    time.sleep(1.1)  # NB: gzip timestamps are in whole seconds
+    assert metafile.dumps(meta) == first
+
+
+def test_read_v1(meta):
+    v1 = json.dumps(meta, indent=2, default=str).encode('utf-8')
+    assert metafile.loads(v1) == meta
+    data, items = metafile.read(io.BytesIO(v1))
+    assert data[KEYS.TITLE] == "Test"
+    assert dict(items)["Dir1/item2"] == {KEYS.TITLE: "Item2"}
+
+
+def test_read_streaming(meta):
+    data, items = metafile.read(io.BytesIO(metafile.dumps(meta)))
+    assert data == {k: v for k, v in meta.items() if not k.startswith("items.")}
+    assert next(items) == ("Dir1/Dir1-1/item1", {KEYS.TITLE: "Item1"})
+    assert len(list(items)) == 3
+
+
+def test_smaller():
+    meta = {}
+    for i in range(1000):
+        meta[item_key(f"series/file/item{i}", KEYS.TITLE)] = f"Item {i}"
+        meta[item_key(f"series/file/item{i}", KEYS.SCOPE)] = f"Description of item {i}"
+    v1 = json.dumps(meta, indent=2).encode('utf-8')
+    assert len(metafile.dumps(meta, compress=False)) < len(v1) * 0.75
+    assert len(metafile.dumps(meta)) < len(v1) / 5
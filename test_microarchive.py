@@ -1,4 +1,6 @@
-from microarchive import Control
+from datetime import date
+
+from microarchive import Control, ItemData, item_key, KEYS
 from test_utils import *
 
 @pytest.fixture
@@ -26,6 +28,15 @@ def test_hierarchical_items(archive: MicroArchive):
     assert hierarchy[1].items[1].id == "Dir2/item4"
 
 
+def test_hierarchical_items_unchanged(archive: MicroArchive):
+    # An item whose id is also the path of others
+    archive.items.append(Item.make(id="Dir1", identity=Identity(title="Dir1")))
+    first = archive.hierarchical_items()
+    assert archive.hierarchical_items() == first, "the hierarchy changed when made again"
+    assert all(item.items == [] for item in archive.items), "the archive's items were changed"
+    assert [it.id for it in first[0].items] == ["Dir1/Dir1-1", "Dir1/item2"]
+
+
 def test_hierarchical_items_no_hierarchy(flat_archive: MicroArchive):
     no_hierarchy = flat_archive.hierarchical_items()
     assert len(no_hierarchy) == 2, "flat archive has unexpected number of top-level items"
@@ -35,3 +46,29 @@ def test_leaf_dirs(archive: MicroArchive):
     leaf_dirs = archive.leaf_dirs()
     assert ['Dir1/Dir1-1', 'Dir2/Dir2-1'] == [
         it.id for it in leaf_dirs], "unexpected leaf dirs"
+
+
+def test_item_data():
+    data = ItemData.from_flat({
+        "title": "Collection",
+        item_key("Dir1/item.v2", KEYS.TITLE): "Item 2",
+        item_key("Dir1/item1", KEYS.SCOPE): "",
+    })
+    assert len(data) == 1, "empty values should be ignored"
+    assert data.get("Dir1/item.v2", KEYS.TITLE) == "Item 2", "ids with dots should be split correctly"
+    assert data.take_dirty() == {"Dir1/item.v2"}
+
+    assert not data.set("Dir1/item.v2", KEYS.TITLE, "Item 2")
+    assert data.set("Dir1/item1", KEYS.SCOPE, "Scope 1")
+    assert data.take_dirty() == {"Dir1/item1"}
+    assert data.take_dirty() == set()
+
+    assert data.set("Dir1/item.v2", KEYS.TITLE, "")
+    assert data.to_flat() == {item_key("Dir1/item1", KEYS.SCOPE): "Scope 1"}
+
+
+def test_from_data_to_data(archive: MicroArchive):
+    data = archive.to_data()
+    files = [(item.id, None, None) for item in archive.items]
+    # NB: from_data defaults the description date to today
+    assert MicroArchive.from_data(data, files).to_data() == data | {KEYS.DATE_DESC: date.today().isoformat()}
@@ -0,0 +1,49 @@
+import dataclasses
+
+import requests
+
+import preview
+from buildcache import BuildCache
+from instrument import Recorder
+from microarchive import Identity
+from test_utils import archive, store
+
+
+def test_sample(archive):
+    assert preview.sample(archive.items, None) == archive.items
+    assert preview.sample(archive.items, 10) == archive.items
+    assert [item.id for item in preview.sample(archive.items, 2)] == ["Dir1/Dir1-1/item1", "Dir2/Dir2-1/item3"]
+
+
+def test_build(archive, store, tmp_path):
+    cache = BuildCache(str(tmp_path))
+    files = preview.build(archive, "test", "http://localhost", store, ".jpg", "data/", Recorder(), cache=cache)
+    assert files["index.html"][0] == "text/html"
+    assert "test.xml" in files and "test.json" in files
+    assert not store.client.calls, "previews should not touch storage"
+
+    # A rebuild after an edit reuses the unchanged pages
+    edited = dataclasses.replace(archive, identity=Identity(title="Edited", extent="1 box"))
+    hits = cache.hits
+    assert preview.build(edited, "test", "http://localhost", store, ".jpg", "data/", Recorder(), cache=cache) != files
+    assert cache.hits > hits
+
+    sampled = preview.build(archive, "test", "http://localhost", store, ".jpg", "data/", Recorder(), size=2)
+    assert len(sampled) < len(files)
+
+
+def test_server():
+    server = preview.PreviewServer(port=0).start()
+    try:
+        server.update({"index.html": ("text/html", b"<html></html>"), "test.json": ("application/json", b"{}")})
+        r = requests.get(server.url + "/")
+        assert r.status_code == 200 and r.content == b"<html></html>"
+        r = requests.get(server.url + "/test.json", headers={"Origin": "http://viewer.example.com"})
+        assert r.headers["Access-Control-Allow-Origin"] == "*"
+        assert r.headers["Content-Type"].startswith("application/json")
+        assert requests.options(server.url + "/test.json").status_code == 204
+        assert requests.get(server.url + "/missing.html").status_code == 404
+        server.update({"pages/dir/a file.html": ("text/html", b"<html>A</html>")})
+        assert requests.get(server.url + "/pages/dir/a%20file.html").content == b"<html>A</html>"
+    finally:
+        server.stop()
@@ -0,0 +1,31 @@
+import os
+import pstats
+
+from profiling import profile
+
+
+def busy():
+    total = 0
+    for i in range(2_000_000):
+        total += i
+    return total
+
+
+def test_profile(tmp_path):
+    assert profile(busy, str(tmp_path), interval=0.001, label=lambda: "test-4items") == sum(range(2_000_000))
+    files = sorted(os.listdir(tmp_path))
+    assert [os.path.splitext(f)[1] for f in files] == [".collapsed", ".pstats"]
+    assert files[0].startswith("test-4items-")
+
+    stats = pstats.Stats(str(tmp_path / files[1]))
+    assert any(func[2] == "busy" for func in stats.stats)
+    with open(tmp_path / files[0]) as f:
+        stacks = f.read().splitlines()
+    assert stacks, "no stacks sampled"
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in stacks)
+    assert any("test_profiling.py:busy" in line for line in stacks)
+
+
+def test_profile_sample_only(tmp_path):
+    profile(busy, str(tmp_path), mode="sample", interval=0.001)
+    assert [os.path.splitext(f)[1] for f in os.listdir(tmp_path)] == [".collapsed"]
@@ -0,0 +1,26 @@
+import json
+
+from search import build_index, SEARCH_DIR
+from test_utils import *
+
+
+def lookup(files: Dict[str, str], term: str):
+    meta = json.loads(files[f"{SEARCH_DIR}/index.json"])
+    shard = json.loads(files[f"{SEARCH_DIR}/{term[:meta['prefix']]}.json"])
+    num, found = 0, []
+    for delta in shard.get(term, []):
+        num += delta
+        block = json.loads(files[f"{SEARCH_DIR}/docs/{num // meta['block']}.json"])
+        found.append(block[num % meta["block"]][0])
+    return found
+
+
+def test_build_index(archive):
+    files = build_index(archive, block_size=2)
+    meta = json.loads(files[f"{SEARCH_DIR}/index.json"])
+    assert meta["docs"] == 5, "collection plus four items"
+    assert f"{SEARCH_DIR}/docs/2.json" in files
+    assert lookup(files, "item3") == ["Dir2/Dir2-1/item3"]
+    assert lookup(files, "dir1") == ["Dir1/Dir1-1/item1", "Dir1/item2"]
+    assert lookup(files, "paragraph") == [""], "collection scope not indexed"
+    assert all(f"{SEARCH_DIR}/{prefix}.json" in files for prefix in meta["shards"])
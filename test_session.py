@@ -0,0 +1,88 @@
+import datetime
+
+import session
+from session import load_stored_data, item_data, STORED_SITE, ITEM_CACHE, PREFIX, FORMAT, META_CHECK_INTERVAL
+from microarchive import KEYS
+from test_utils import store, site_maker
+
+FORMATS = {"data/": "jpeg"}
+
+
+def publish(store, site, **meta):
+    store.upload("test", site.origin_id, "<html/>", "<ead/>", "{}", meta)
+
+
+def test_load_stored_data(store, site_maker):
+    site = site_maker.create_site("one")
+    publish(store, site, title="One", datedesc="2023-01-02", prefix="data/", **{"items.a.title": "A"})
+    state = {}
+    now = [1000.0]
+
+    def load(refresh: bool = False):
+        return load_stored_data(state, site.id, store, site_maker, FORMATS, refresh=refresh,
+                                clock=lambda: now[0])
+
+    assert load().id == site.id
+    assert state[KEYS.TITLE] == "One"
+    assert state[KEYS.DATE_DESC] == datetime.date(2023, 1, 2)
+    assert state[PREFIX] == "data/" and state[FORMAT] == "jpeg"
+    assert item_data(state).get("a", KEYS.TITLE) == "A"
+
+    # Reruns use the session's copy, without any AWS calls
+    store.client.calls.clear()
+    site_maker.client.calls.clear()
+    state[KEYS.TITLE] = "Unpublished"
+    assert load().id == site.id
+    assert store.client.calls == [] and site_maker.client.calls == []
+    assert state[KEYS.TITLE] == "Unpublished"
+
+    # The stored metadata is only checked for changes periodically
+    publish(store, site, title="Changed", prefix="data/")
+    now[0] += META_CHECK_INTERVAL - 1
+    load()
+    assert state[KEYS.TITLE] == "Unpublished"
+    now[0] += 1
+    load()
+    assert state[KEYS.TITLE] == "Changed"
+    assert KEYS.DATE_DESC not in state
+    assert item_data(state).get("a", KEYS.TITLE) == ""
+
+    # ...unless a refresh is requested
+    state[KEYS.TITLE] = "Unpublished"
+    load(refresh=True)
+    assert state[KEYS.TITLE] == "Changed"
+
+
+def test_load_other_site(store, site_maker):
+    one, two = site_maker.create_site("one"), site_maker.create_site("two")
+    publish(store, one, title="One", extent="1 box", prefix="data/", **{"items.a.title": "A"})
+    publish(store, two, title="Two")
+    state = {"items.a.scope": "Old"}
+    load_stored_data(state, one.id, store, site_maker, FORMATS)
+    state[ITEM_CACHE] = {"a": object()}
+
+    load_stored_data(state, two.id, store, site_maker, FORMATS)
+    assert state[STORED_SITE].site_id == two.id
+    assert state[KEYS.TITLE] == "Two"
+    assert not any(key in state for key in [KEYS.EXTENT, PREFIX, FORMAT, ITEM_CACHE, "items.a.scope"]), \
+        "the last site's data was kept"
+    assert item_data(state).get("a", KEYS.TITLE) == ""
+
+
+def test_clear_site():
+    state = {KEYS.TITLE: "Title", PREFIX: "data/", "items.a.title": "A", "siteid": "E1"}
+    session.clear_site(state)
+    assert state == {"siteid": "E1"}
+
+
+def test_refresh_bypasses_cache(store, site_maker):
+    from lrucache import LRUCache
+    site = site_maker.create_site("one")
+    publish(store, site, title="One")
+    cache, state = LRUCache(), {}
+    assert load_stored_data(state, site.id, store, site_maker, FORMATS, cache=cache).status == "InProgress"
+    site_maker.client.deploy()
+    assert load_stored_data({}, site.id, store, site_maker, FORMATS, cache=cache).status == "InProgress"
+    assert load_stored_data(state, site.id, store, site_maker, FORMATS, refresh=True, cache=cache).status == \
+           "Deployed", "the cached site info was used"
+    assert load_stored_data({}, site.id, store, site_maker, FORMATS, cache=cache).status == "Deployed"
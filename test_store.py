@@ -0,0 +1,12 @@
+from test_utils import *
+
+
+def test_fetch_meta(store):
+    assert store.fetch_meta("/origin") == (None, None)
+    assert store.meta_etag("/origin") is None
+    store.upload("test", "/origin", "<html/>", "<ead/>", "{}", {"title": "Test"})
+    meta, etag = store.fetch_meta("/origin")
+    assert meta == {"title": "Test"}
+    assert etag is not None and store.meta_etag("/origin") == etag
+    store.upload("test", "/origin", "<html/>", "<ead/>", "{}", {"title": "Changed"})
+    assert store.meta_etag("/origin") != etag
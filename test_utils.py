@@ -50,3 +50,188 @@ def value_of(data: Dict, *keys: Union[str, int]):
     return elem
 
 
+class FakeS3:
+    """A minimal in-memory stand-in for the boto3 S3 client"""
+    def __init__(self):
+        import types
+        from botocore.hooks import HierarchicalEmitter
+        self.objects = {}
+        self.uploads = {}
+        self.calls = []
+        self.meta = types.SimpleNamespace(events=HierarchicalEmitter())
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, IfMatch: str = None, IfNoneMatch: str = None,
+                   **kwargs):
+        from botocore.exceptions import ClientError
+        self.calls.append(("put_object", Key))
+        if (IfNoneMatch == "*" and Key in self.objects) or \
+                (IfMatch is not None and (Key not in self.objects or IfMatch != self._etag(Key))):
+            raise ClientError({"Error": {"Code": "PreconditionFailed", "Message": "Stale"}}, "PutObject")
+        self.objects[Key] = Body
+        return {"ETag": self._etag(Key)}
+
+    def download_fileobj(self, Bucket: str, Key: str, Fileobj):
+        self.calls.append(("download_fileobj", Key))
+        Fileobj.write(self._get(Key))
+
+    def get_object(self, Bucket: str, Key: str, **kwargs):
+        import io
+        self.calls.append(("get_object", Key))
+        return {"Body": io.BytesIO(self._get(Key)), "ETag": self._etag(Key)}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs):
+        self.calls.append(("head_object", Key))
+        return {"ContentLength": len(self._get(Key)), "ETag": self._etag(Key)}
+
+    def create_multipart_upload(self, Bucket: str, Key: str, **kwargs):
+        self.calls.append(("create_multipart_upload", Key))
+        upload_id = f"upload{len(self.uploads)}"
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body: bytes):
+        import hashlib
+        self.calls.append(("upload_part", Key, PartNumber))
+        self._upload(UploadId)[PartNumber] = Body
+        return {"ETag": '"' + hashlib.md5(Body).hexdigest() + '"'}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: Dict):
+        self.calls.append(("complete_multipart_upload", Key))
+        parts = self._upload(UploadId)
+        self.objects[Key] = b"".join(parts[p["PartNumber"]] for p in MultipartUpload["Parts"])
+        del self.uploads[UploadId]
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str):
+        self.calls.append(("abort_multipart_upload", Key))
+        self._upload(UploadId)
+        del self.uploads[UploadId]
+
+    def _upload(self, upload_id: str) -> Dict:
+        from botocore.exceptions import ClientError
+        if upload_id not in self.uploads:
+            raise ClientError({"Error": {"Code": "NoSuchUpload", "Message": "Not Found"}}, "UploadPart")
+        return self.uploads[upload_id]
+
+    def _get(self, key: str) -> bytes:
+        from botocore.exceptions import ClientError
+        if key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": "Not Found"}}, "GetObject")
+        return self.objects[key]
+
+    def _etag(self, key: str) -> str:
+        import hashlib
+        return '"' + hashlib.md5(self.objects[key]).hexdigest() + '"'
+
+    def delete_objects(self, Bucket: str, Delete: Dict):
+        self.calls.append(("delete_objects", len(Delete["Objects"])))
+        for obj in Delete["Objects"]:
+            self.objects.pop(obj["Key"], None)
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = "", MaxKeys: int = 1000, ContinuationToken: str = "",
+                        StartAfter: str = "", **kwargs):
+        self.calls.append(("list_objects_v2", Prefix))
+        after = ContinuationToken or StartAfter
+        keys = [key for key in sorted(self.objects) if key.startswith(Prefix) and key > after]
+        r = {"Contents": [{"Key": key, "ETag": self._etag(key), "Size": len(self.objects[key])}
+                          for key in keys[:MaxKeys]], "IsTruncated": len(keys) > MaxKeys}
+        if r["IsTruncated"]:
+            r["NextContinuationToken"] = keys[MaxKeys - 1]
+        return r
+
+
+@pytest.fixture
+def store():
+    from store import Store, StoreSettings, IIIFSettings
+    s = Store(StoreSettings(bucket="test", region="eu-west-1", access_key="test", secret_key="test"),
+              IIIFSettings(server_url="http://example.com/iiif/3/"))
+    s.client = FakeS3()
+    return s
+
+
+class FakeCloudFront:
+    """A minimal in-memory stand-in for the boto3 CloudFront client.
+    New and updated distributions stay "InProgress" until `deploy` is called."""
+    def __init__(self):
+        import types
+        from botocore.hooks import HierarchicalEmitter
+        self.distributions = {}
+        self.etags = {}
+        self.calls = []
+        self.meta = types.SimpleNamespace(events=HierarchicalEmitter())
+
+    def create_distribution(self, DistributionConfig: Dict):
+        self.calls.append(("create_distribution", DistributionConfig["Comment"]))
+        ident = f"DIST{len(self.distributions) + 1}"
+        self.distributions[ident] = {
+            "Id": ident,
+            "Status": "InProgress",
+            "DomainName": f"{ident.lower()}.cloudfront.net",
+            "DistributionConfig": DistributionConfig,
+        }
+        self.etags[ident] = 1
+        return {"Distribution": self.distributions[ident], "ETag": "E1"}
+
+    def get_distribution(self, Id: str):
+        from botocore.exceptions import ClientError
+        self.calls.append(("get_distribution", Id))
+        if Id not in self.distributions:
+            raise ClientError({"Error": {"Code": "NoSuchDistribution", "Message": "Not Found"}}, "GetDistribution")
+        return {"Distribution": self.distributions[Id], "ETag": f"E{self.etags[Id]}"}
+
+    def get_distribution_config(self, Id: str):
+        import copy
+        self.calls.append(("get_distribution_config", Id))
+        return {"DistributionConfig": copy.deepcopy(self.distributions[Id]["DistributionConfig"]),
+                "ETag": f"E{self.etags[Id]}"}
+
+    def update_distribution(self, Id: str, IfMatch: str, DistributionConfig: Dict):
+        from botocore.exceptions import ClientError
+        self.calls.append(("update_distribution", Id))
+        if IfMatch != f"E{self.etags[Id]}":
+            raise ClientError({"Error": {"Code": "PreconditionFailed", "Message": "Stale"}}, "UpdateDistribution")
+        self.etags[Id] += 1
+        self.distributions[Id] |= {"DistributionConfig": DistributionConfig, "Status": "InProgress"}
+        return {"Distribution": self.distributions[Id], "ETag": f"E{self.etags[Id]}"}
+
+    def list_distributions(self, Marker: str = "", MaxItems: str = "2"):
+        self.calls.append(("list_distributions", Marker))
+        idents = [ident for ident in sorted(self.distributions) if ident > Marker]
+        page = idents[:int(MaxItems)]
+        r = {"Items": [{
+            "Id": ident,
+            "Status": self.distributions[ident]["Status"],
+            "DomainName": self.distributions[ident]["DomainName"],
+            "Comment": self.distributions[ident]["DistributionConfig"]["Comment"],
+            "Enabled": self.distributions[ident]["DistributionConfig"]["Enabled"],
+            "Origins": self.distributions[ident]["DistributionConfig"]["Origins"],
+        } for ident in page], "IsTruncated": len(idents) > len(page)}
+        if r["IsTruncated"]:
+            r["NextMarker"] = page[-1]
+        return {"DistributionList": r}
+
+    def deploy(self):
+        for dist in self.distributions.values():
+            dist["Status"] = "Deployed"
+
+
+@pytest.fixture
+def site_maker():
+    from store import StoreSettings
+    from website import Website
+    w = Website(StoreSettings(bucket="test", region="eu-west-1", access_key="test", secret_key="test"),
+                pool_size=2)
+    w.client = FakeCloudFront()
+    w.pool.s3 = FakeS3()
+    return w
+
+
+@pytest.fixture
+def local_assets(tmp_path, monkeypatch):
+    """Local copies of the viewer assets, so they aren't downloaded"""
+    import assets
+    directory = tmp_path / "assets"
+    directory.mkdir()
+    for source in assets.SOURCES:
+        (directory / source.filename).write_bytes(source.name.encode('utf-8'))
+    monkeypatch.setattr(assets, "LOCAL_DIR", str(directory))
+    return directory
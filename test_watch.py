@@ -0,0 +1,130 @@
+import types
+
+import metafile
+from jobs import JobRunner
+from watch import Watcher
+from test_utils import store
+
+
+class FakeSites:
+    def get_site(self, site_id: str):
+        return types.SimpleNamespace(origin_id=f"/{site_id}")
+
+
+def test_watch(store, tmp_path):
+    store.client.objects["site1/.meta.json"] = metafile.dumps({"title": "Test", "prefix": "data/"})
+    store.client.objects["data/a.jpg"] = b"a"
+    published = []
+
+    def publish(job):
+        published.append(job.params | dict(data=job.data))
+        store.client.objects["site1/.meta.json"] = metafile.dumps(job.data)
+
+    runner = JobRunner(str(tmp_path / "jobs"), {"publish": publish}, workers=1)
+    now = [1000.0]
+    watcher = Watcher(store, FakeSites(), runner, ["site1"], str(tmp_path / "watch"),
+                      debounce=60, scan_interval=3600, clock=lambda: now[0])
+
+    def cycle(after: float = 10):
+        now[0] += after
+        metrics = watcher.cycle()
+        runner.executor.submit(lambda: None).result()  # let any job run
+        return metrics
+
+    # The first cycle only records the state
+    assert cycle()["changed"] == 0
+    store.client.calls.clear()
+    assert cycle()["changed"] == 0
+    assert [c[0] for c in store.client.calls] == ["head_object", "list_objects_v2"], "checks are cheap"
+
+    # A burst of uploads is published once, after it settles
+    store.client.objects["data/b.jpg"] = b"b"
+    assert cycle()["changed"] == 1
+    store.client.objects["data/c.jpg"] = b"c"
+    assert cycle()["pending"] == 1
+    assert cycle(30)["pending"] == 1
+    assert cycle(60)["submitted"] == 1
+    assert len(published) == 1 and published[0]["site_id"] == "site1"
+    assert published[0]["data"]["prefix"] == "data/"
+
+    # The publish's own metadata update is not a change
+    assert cycle()["published"] == 1
+    assert cycle()["changed"] == 0
+
+    # An overwritten file is only found by the periodic full listing
+    store.client.objects["data/a.jpg"] = b"changed"
+    assert cycle()["changed"] == 0
+    assert cycle(3600)["changed"] == 1
+
+    # State survives a restart
+    restarted = Watcher(store, FakeSites(), runner, ["site1"], str(tmp_path / "watch"), clock=lambda: now[0])
+    assert restarted.sites["site1"].listing.count == 3
+    assert restarted.sites["site1"].changed is not None
+    runner.shutdown()
+
+
+def test_watch_metadata_edit(store, tmp_path):
+    store.client.objects["site1/.meta.json"] = metafile.dumps({"title": "Test", "prefix": "data/"})
+    runner = JobRunner(str(tmp_path / "jobs"), {"publish": lambda job: None}, workers=1)
+    now = [1000.0]
+    watcher = Watcher(store, FakeSites(), runner, ["site1"], str(tmp_path / "watch"), debounce=0,
+                      clock=lambda: now[0])
+    watcher.cycle()
+    store.client.objects["site1/.meta.json"] = metafile.dumps({"title": "Edited", "prefix": "data/"})
+    metrics = watcher.cycle()
+    assert metrics["changed"] == 1 and metrics["submitted"] == 1
+    assert "seconds" in metrics and "api_calls" in metrics
+    runner.shutdown()
+
+
+def test_watch_edit_while_publishing(store, tmp_path):
+    store.client.objects["site1/.meta.json"] = metafile.dumps({"title": "Test", "prefix": "data/"})
+
+    def publish(job):
+        store.client.objects["site1/.meta.json"] = metafile.dumps(job.data)
+        # Edited while the job runs
+        store.client.objects["site1/.meta.json"] = metafile.dumps({"title": "Edited", "prefix": "data/"})
+
+    runner = JobRunner(str(tmp_path / "jobs"), {"publish": publish}, workers=1)
+    now = [1000.0]
+    watcher = Watcher(store, FakeSites(), runner, ["site1"], str(tmp_path / "watch"), debounce=0,
+                      clock=lambda: now[0])
+    watcher.cycle()
+    store.client.objects["site1/.meta.json"] = metafile.dumps({"title": "Changed", "prefix": "data/"})
+    assert watcher.cycle()["submitted"] == 1
+    runner.executor.submit(lambda: None).result()
+    metrics = watcher.cycle()
+    assert metrics["published"] == 1 and metrics["changed"] == 1, "the edit made while publishing was missed"
+    runner.shutdown()
+
+
+def test_watch_failure_backoff(store, tmp_path):
+    store.client.objects["site1/.meta.json"] = metafile.dumps({"title": "Test", "prefix": "data/"})
+
+    def publish(job):
+        raise ValueError("Always fails")
+
+    runner = JobRunner(str(tmp_path / "jobs"), {"publish": publish}, workers=1)
+    now = [1000.0]
+    watcher = Watcher(store, FakeSites(), runner, ["site1"], str(tmp_path / "watch"), debounce=10,
+                      clock=lambda: now[0])
+
+    def cycle(after: float):
+        now[0] += after
+        metrics = watcher.cycle()
+        runner.executor.submit(lambda: None).result()
+        return metrics
+
+    cycle(0)
+    store.client.objects["site1/.meta.json"] = metafile.dumps({"title": "Changed", "prefix": "data/"})
+    cycle(1)
+    assert cycle(10)["submitted"] == 1
+    assert cycle(1)["failed"] == 1
+    # Retried after twice the debounce, then four times
+    assert cycle(15)["pending"] == 1
+    assert cycle(5)["submitted"] == 1
+    assert cycle(1)["failed"] == 1
+    assert cycle(30)["pending"] == 1
+    assert cycle(10)["submitted"] == 1
+    assert watcher.sites["site1"].failures == 2
+    runner.shutdown()
@@ -0,0 +1,135 @@
+from website import make_pages, make_html
+from test_utils import *
+
+
+def canvas_id(item_id: str) -> str:
+    return "http://example.com/iiif/3/" + item_id
+
+
+def test_make_pages(archive):
+    pages = make_pages("test", archive, "KEY", canvas_id)
+    assert sorted(pages.keys()) == [
+        "pages/Dir1/Dir1-1/index.html",
+        "pages/Dir1/Dir1-1/item1.html",
+        "pages/Dir1/index.html",
+        "pages/Dir1/item2.html",
+        "pages/Dir2/Dir2-1/index.html",
+        "pages/Dir2/Dir2-1/item3.html",
+        "pages/Dir2/index.html",
+        "pages/Dir2/item4.html",
+    ]
+    item = pages["pages/Dir1/Dir1-1/item1.html"]
+    assert "<h1>Item1</h1>" in item
+    assert 'href="/pages/Dir1/index.html"' in item, "missing breadcrumb link"
+    assert "canvas=http%3A//example.com/iiif/3/Dir1/Dir1-1/item1" in item
+    directory = pages["pages/Dir1/index.html"]
+    assert 'href="/pages/Dir1/item2.html"' in directory, "missing child link"
+    assert "canvas=http%3A//example.com/iiif/3/Dir1/Dir1-1/item1" in directory, "directory links first item"
+
+
+def test_make_pages_parallel(archive):
+    assert make_pages("test", archive, "KEY", canvas_id, workers=2) == \
+           make_pages("test", archive, "KEY", canvas_id, workers=1)
+
+
+def test_make_html_contents(archive):
+    html = make_html("test", archive, "KEY", archive.hierarchical_items())
+    assert 'href="/pages/Dir1/index.html"' in html
+
+
+def test_sync_files(store):
+    pages = {"pages/a.html": "A", "pages/b.html": "B"}
+    assert store.sync_files("/origin", pages) == ["pages/a.html", "pages/b.html"]
+    assert store.sync_files("/origin", pages) == [], "unchanged pages were uploaded again"
+    assert store.sync_files("/origin", {"pages/a.html": "A2"}) == ["pages/a.html"]
+    assert "origin/pages/b.html" not in store.client.objects, "stale page not removed"
+    assert store.client.objects["origin/pages/a.html"] == b"A2"
+
+
+def test_client_created_lazily():
+    from store import StoreSettings
+    from website import Website
+    site_maker = Website(StoreSettings(bucket="test", region="eu-west-1", access_key="test", secret_key="test"))
+    assert "client" not in site_maker.__dict__
+
+
+def test_distribution_pool(site_maker):
+    from website import SITE_COMMENT
+    pool, client = site_maker.pool, site_maker.client
+    # With nothing in the pool, a site is created, and the pool filled
+    site = site_maker.get_or_create_site("first")
+    assert site.status == "InProgress"
+    assert site.origin_id.startswith("/webdata_")
+    pool.filling.join()
+    assert len(pool.distributions()) == 2
+    assert pool.fill() == []
+    # Pooled distributions are not claimed until deployed
+    assert pool.available() == []
+    client.deploy()
+    assert len(pool.available()) == 2
+
+    site = site_maker.get_or_create_site("second")
+    # NB: the claim updates the distribution, which is then deployed again
+    assert site.status == "InProgress"
+    assert client.distributions[site.id]["DistributionConfig"]["Comment"] == f"{SITE_COMMENT}: second"
+    # The claim is refilled in the background
+    pool.filling.join()
+    assert len(pool.distributions()) == 2
+    assert len(pool.available()) == 1
+    assert not any(call[0] == "list_distributions" for call in client.calls), "all distributions were listed"
+
+
+def test_distribution_pool_claim_race(site_maker):
+    pool, client = site_maker.pool, site_maker.client
+    assert len(pool.fill()) == 2
+    client.deploy()
+    first = pool.available()[0]
+    # Another process claims the first distribution after it is listed
+    # but before its config is updated here
+    get_config = client.get_distribution_config
+
+    def claimed_elsewhere(Id: str):
+        r = get_config(Id)
+        if Id == first.id:
+            client.etags[Id] += 1
+        return r
+
+    client.get_distribution_config = claimed_elsewhere
+    site = pool.claim("mine")
+    assert site is not None and site.id != first.id
+    pool.refill().join()
+
+
+def test_distribution_pool_fill_lease(site_maker):
+    import json
+    import time
+    from website import POOL_KEY, POOL_LEASE
+    pool, s3 = site_maker.pool, site_maker.pool.s3
+    # Another process is filling the pool
+    s3.objects[POOL_KEY] = json.dumps(dict(ids=[], filling=time.time())).encode('utf-8')
+    assert pool.fill() == []
+    # ...but stopped before it finished
+    s3.objects[POOL_KEY] = json.dumps(dict(ids=[], filling=time.time() - POOL_LEASE)).encode('utf-8')
+    assert len(pool.fill()) == 2
+    assert json.loads(s3.objects[POOL_KEY])["filling"] is None
+    assert [d["Id"] for d in pool.distributions()] == sorted(site_maker.client.distributions)
+
+
+def test_distribution_pool_conditional_writes(site_maker):
+    import boto3
+    from botocore.stub import Stubber, ANY
+    from website import POOL_KEY
+    pool = site_maker.pool
+    # NB: a real client, so the conditional write parameters are
+    # validated against the S3 service model
+    pool.s3 = boto3.client("s3", region_name="eu-west-1", aws_access_key_id="test", aws_secret_access_key="test")
+    with Stubber(pool.s3) as stub:
+        stub.add_response("put_object", {"ETag": '"1"'}, dict(Bucket="test", Key=POOL_KEY, Body=ANY,
+                                                             ContentType="application/json", IfNoneMatch="*"))
+        stub.add_response("put_object", {"ETag": '"2"'}, dict(Bucket="test", Key=POOL_KEY, Body=ANY,
+                                                             ContentType="application/json", IfMatch='"1"'))
+        stub.add_client_error("put_object", "PreconditionFailed", http_status_code=412)
+        assert pool.save(dict(ids=[], filling=None), None) == '"1"'
+        assert pool.save(dict(ids=["DIST1"], filling=None), '"1"') == '"2"'
+        assert pool.save(dict(ids=[], filling=None), '"1"') is None
+        stub.assert_no_pending_responses()
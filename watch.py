@@ -0,0 +1,231 @@
+"""Watch published sites and republish them when their data changes.
+
+Each cycle checks every site's metadata ETag with a HEAD request, and
+probes its dataset prefix for keys after the last one seen with a single
+`StartAfter` listing request. New keys, which usually arrive in name
+order, are found this way; deleted and overwritten ones are found by a
+full listing of the prefix every `scan_interval` seconds, compared with a
+digest of the last. A site is republished once no further change has been
+seen for `debounce` seconds, so a burst of uploads triggers one publish.
+Publishes run as background jobs, a bounded number at a time, and are
+incremental given a build cache. A site whose publish fails is retried
+after a wait that doubles with each failure."""
+import hashlib
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, TextIO, Callable
+
+from instrument import Recorder
+from jobs import JobRunner, DONE
+from publish import PREFIX
+from store import Store, THUMB_DIR, EXT_PATTERN
+from website import Website
+
+STATE_FILE = "watch.json"
+# How often to check the sites, in seconds
+INTERVAL = 60
+# How long a site's data must be unchanged before it is republished
+DEBOUNCE = 120
+# How often to fully list each dataset, to find deleted or changed files
+SCAN_INTERVAL = 60 * 60
+# The most a site whose publishes keep failing waits before it is retried,
+# the wait doubling with each failure
+MAX_BACKOFF = 6 * 60 * 60
+
+
+@dataclass
+class Listing:
+    """A summary of a dataset's images, as of the last full listing. The
+    last key is that of any file, so a probe after it finds any new file."""
+    last_key: Optional[str] = None
+    count: int = 0
+    last_modified: Optional[str] = None
+    digest: Optional[str] = None
+
+
+@dataclass
+class WatchedSite:
+    site_id: str
+    origin_id: Optional[str] = None
+    prefix: Optional[str] = None
+    meta_etag: Optional[str] = None
+    listing: Listing = field(default_factory=Listing)
+    # When the dataset was last fully listed
+    scanned: float = 0.0
+    # When a change not yet published was last seen
+    changed: Optional[float] = None
+    # The running publish job, if any
+    job: Optional[str] = None
+    published: Optional[float] = None
+    # How many publishes have failed since the last that succeeded
+    failures: int = 0
+    # The digest of the metadata the running or last job published
+    job_digest: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'WatchedSite':
+        return cls(**data | {"listing": Listing(**data.get("listing", {}))})
+
+
+def digest(meta: Optional[Dict]) -> str:
+    """A digest of a site's metadata"""
+    return hashlib.sha1(json.dumps(meta, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def scan(store: Store, prefix: str) -> Listing:
+    """List a dataset's images in full, summarising them"""
+    digest = hashlib.sha1()
+    listing = Listing()
+    for page in store.list_pages(prefix):
+        for meta in page:
+            key = meta["Key"]
+            listing.last_key = max(listing.last_key or key, key)
+            if THUMB_DIR in key or not EXT_PATTERN.match(key):
+                continue
+            digest.update(f"{key}\0{meta.get('ETag')}\n".encode('utf-8'))
+            listing.count += 1
+            if meta.get("LastModified"):
+                modified = str(meta["LastModified"])
+                listing.last_modified = max(listing.last_modified or modified, modified)
+    listing.digest = digest.hexdigest()
+    return listing
+
+
+class Watcher:
+    def __init__(self, store: Store, site_maker: Website, runner: JobRunner, site_ids: List[str],
+                 directory: str, interval: float = INTERVAL, debounce: float = DEBOUNCE,
+                 scan_interval: float = SCAN_INTERVAL, out: Optional[TextIO] = None,
+                 clock: Callable[[], float] = time.time):
+        self.store = store
+        self.site_maker = site_maker
+        self.runner = runner
+        self.directory = directory
+        self.interval = interval
+        self.debounce = debounce
+        self.scan_interval = scan_interval
+        self.out = out
+        self.clock = clock
+        self.cycles = 0
+        os.makedirs(directory, exist_ok=True)
+        self.sites = self.load()
+        for site_id in site_ids:
+            self.sites.setdefault(site_id, WatchedSite(site_id))
+        self.sites = {site_id: self.sites[site_id] for site_id in site_ids}
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, STATE_FILE)
+
+    def load(self) -> Dict[str, WatchedSite]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r') as f:
+            return {site_id: WatchedSite.from_dict(data) for site_id, data in json.load(f).items()}
+
+    def save(self):
+        with open(self.path + ".tmp", 'w') as f:
+            json.dump({site_id: asdict(site) for site_id, site in self.sites.items()}, f, indent=2)
+        os.replace(self.path + ".tmp", self.path)
+
+    def check(self, site: WatchedSite, now: float) -> bool:
+        """Check if a site's metadata or images have changed since the last
+        check, updating its recorded state"""
+        changed = False
+        if site.origin_id is None:
+            site.origin_id = self.site_maker.get_site(site.site_id).origin_id
+        etag = self.store.meta_etag(site.origin_id)
+        if etag != site.meta_etag:
+            meta = self.store.get_meta(site.origin_id, site.site_id) or {}
+            changed = site.meta_etag is not None
+            site.meta_etag, site.prefix = etag, meta.get(PREFIX)
+        if not site.prefix:
+            return changed
+
+        # NB: a full listing is only needed periodically, or to update
+        # the last key once new keys are found
+        if (now - site.scanned >= self.scan_interval or changed
+                or self.store.has_keys_after(site.prefix, site.listing.last_key)):
+            listing = scan(self.store, site.prefix)
+            changed = changed or (site.listing.digest is not None and listing.digest != site.listing.digest)
+            site.listing, site.scanned = listing, now
+        return changed
+
+    def finish(self, site: WatchedSite, now: float, metrics: Dict):
+        """Record the outcome of a site's finished publish job"""
+        job = self.runner.get(site.job)
+        site.job = None
+        if job is None or job.status != DONE:
+            metrics["failed"] += 1
+            site.failures += 1
+            print(f"Republishing {site.site_id} failed: {job.error if job else 'job lost'}", file=sys.stderr)
+            site.changed = site.changed or now
+            return
+        metrics["published"] += 1
+        site.published, site.failures = now, 0
+        # NB: the job's own metadata update is not a change, but an edit
+        # made while it ran is, so the metadata is only taken as seen if
+        # it is what the job published
+        meta, etag = self.store.fetch_meta(site.origin_id, site.site_id)
+        if digest(meta) == site.job_digest:
+            site.meta_etag = etag
+
+    def visit(self, site: WatchedSite, now: float, metrics: Dict):
+        """Check a site, publishing it if its changes have settled"""
+        if site.job:
+            job = self.runner.get(site.job)
+            if job is not None and not job.finished():
+                # NB: the job will update the site's metadata, so
+                # it is only checked again once the job is done
+                metrics["running"] += 1
+                return
+            self.finish(site, now, metrics)
+        if self.check(site, now):
+            metrics["changed"] += 1
+            site.changed = now
+        if site.changed is None:
+            return
+        wait = self.debounce
+        if site.failures:
+            wait = max(wait, min(self.debounce * 2 ** site.failures, MAX_BACKOFF))
+        if now - site.changed < wait:
+            metrics["pending"] += 1
+            return
+        data = self.store.get_meta(site.origin_id, site.site_id)
+        if data is None:
+            return
+        job = self.runner.submit("publish", dict(site_id=site.site_id), data)
+        site.job, site.changed, site.job_digest = job.id, None, digest(data)
+        metrics["submitted"] += 1
+        metrics["running"] += 1
+
+    def cycle(self) -> Dict:
+        """Check each site, publishing those whose changes have settled,
+        and return the cycle's metrics"""
+        now = self.clock()
+        metrics = dict(cycle=self.cycles, sites=len(self.sites), changed=0, pending=0, submitted=0,
+                       running=0, published=0, failed=0)
+        recorder = Recorder()
+        with recorder.watch(self.store.client), recorder.stage("cycle") as stage:
+            for site in self.sites.values():
+                try:
+                    self.visit(site, now, metrics)
+                except Exception as e:
+                    print(f"Unable to check site {site.site_id}: {e}", file=sys.stderr)
+            self.save()
+        self.cycles += 1
+        metrics |= stage.to_dict()
+        if self.out:
+            print(json.dumps(metrics), file=self.out, flush=True)
+        return metrics
+
+    def run(self, cycles: Optional[int] = None):
+        """Check the sites every `interval` seconds, until interrupted or
+        the given number of cycles have run"""
+        while cycles is None or self.cycles < cycles:
+            started = time.monotonic()
+            self.cycle()
+            if cycles is None or self.cycles < cycles:
+                time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
@@ -1,18 +1,48 @@
+import functools
+import json
+import multiprocessing
 import os
-from dataclasses import dataclass
-from typing import Optional
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from typing import Optional, Callable, Dict, List, Tuple
+from urllib.parse import quote
 
-import boto3
-
-from microarchive import MicroArchive
+from buildcache import BuildCache, fingerprint, subtree, template_version
+from microarchive import MicroArchive, Item
 from store import StoreSettings
-from jinja2 import Environment, FileSystemLoader, select_autoescape
 
-env = Environment(
-    extensions=['jinja_markdown.MarkdownExtension'],
-    loader=FileSystemLoader(os.path.dirname(os.path.realpath(__file__))),
-    autoescape=select_autoescape()
-)
+
+@functools.lru_cache(maxsize=None)
+def env():
+    """The template environment, created on first use since loading
+    Jinja and Markdown is slow"""
+    from jinja2 import Environment, FileSystemLoader, select_autoescape
+    return Environment(
+        extensions=['jinja_markdown.MarkdownExtension'],
+        loader=FileSystemLoader(os.path.dirname(os.path.realpath(__file__))),
+        autoescape=select_autoescape()
+    )
+
+# The site directory holding static per-item and per-directory pages
+PAGES_DIR = "pages"
+
+# The comment marking distributions created by this tool, and spare
+# distributions waiting in the pool. NB: CloudFront allows 128 characters.
+SITE_COMMENT = "Created by the EHRI-3 WP11 Demo tool"
+POOL_COMMENT = SITE_COMMENT + " (unclaimed)"
+MAX_COMMENT = 128
+# The bucket key of the record of the pool's distributions, and how long,
+# in seconds, a process filling the pool holds it before another may
+POOL_KEY = ".distribution-pool.json"
+POOL_LEASE = 10 * 60
+# The path of the assets shared by all sites, and the id prefix of the origin
+# serving them. NB: site origin ids start with the bucket name, so this can't
+# be the id of a site's origin.
+ASSETS_PATTERN = "_assets/*"
+ASSETS_ORIGIN = "assets-"
 
 
 def get_random_string(length: int) -> str:
@@ -39,16 +69,111 @@ class SiteInfo:
         return f"https://{self.domain}"
 
 
-def make_html(slug: str, desc: MicroArchive, site_key: str) -> str:
-    return  env.get_template("index.html.j2").render(name=slug, key=site_key, data=desc)
+def page_path(item: Item) -> str:
+    """The site-relative path of the static page for an item or directory"""
+    if item.is_dir():
+        return f"{PAGES_DIR}/{item.id}/index.html"
+    return f"{PAGES_DIR}/{item.id}.html"
+
+
+def page_href(item: Item) -> str:
+    return "/" + quote(page_path(item))
+
+
+def make_html(slug: str, desc: MicroArchive, site_key: str, contents: Optional[List[Item]] = None,
+              search: bool = False, assets: Optional[Dict[str, str]] = None) -> str:
+    """Render the site index page. If `contents` is given, the top-level
+    items are linked to their static pages. If `search` is set the page
+    includes a search box querying the prebuilt index. If `assets` is
+    given, mapping asset names to URLs, the viewer and fonts are loaded
+    from there rather than from third-party CDNs."""
+    links = [(item.identity.title or item.id, page_href(item)) for item in contents or []]
+    return env().get_template("index.html.j2").render(name=slug, key=site_key, data=desc, contents=links,
+                                                    search=search, assets=assets)
+
+
+def _render_page(context: Dict) -> str:
+    return env().get_template("page.html.j2").render(**context)
+
+
+def make_pages(slug: str, desc: MicroArchive, site_key: str, canvas_id: Callable[[str], str],
+               items: Optional[List[Item]] = None, workers: int = 1,
+               cache: Optional[BuildCache] = None) -> Dict[str, str]:
+    """Render a lightweight static page for every directory and item in the
+    archive, returning a dictionary of site-relative path to HTML.
+
+    Each page links to the viewer with the item's canvas (or, for directories,
+    the canvas of its first item) preselected. Pass the result of
+    `desc.hierarchical_items()` as `items` to avoid computing it again. If
+    `workers` is more than one the pages are rendered in parallel on that many
+    processes. If a `cache` is given, the pages of unchanged top-level subtrees
+    are reused."""
+    def first_item(item: Item) -> Item:
+        while item.items:
+            item = item.items[0]
+        return item
+
+    def walk(item: Item, trail: List[Tuple[str, str]], contexts: List[Tuple[str, Dict]]):
+        title = item.identity.title or os.path.basename(item.id)
+        contexts.append((page_path(item), dict(
+            name=slug,
+            key=site_key,
+            collection=desc.identity.title,
+            id=item.id,
+            title=title,
+            scope=item.content.scope,
+            trail=trail,
+            children=[(c.identity.title or os.path.basename(c.id), page_href(c), c.is_dir()) for c in item.items],
+            canvas=canvas_id(first_item(item).id),
+        )))
+        for child in item.items:
+            walk(child, trail + [(title, page_href(item))], contexts)
+
+    pages: Dict[str, str] = {}
+    # The contexts of each top-level subtree to render, with its cache key
+    groups: List[Tuple[Optional[str], List[Tuple[str, Dict]]]] = []
+    for top in items if items is not None else desc.hierarchical_items():
+        key = None
+        if cache is not None:
+            key = fingerprint(template_version(), subtree(top), slug, site_key, desc.identity.title,
+                              canvas_id(first_item(top).id))
+            cached = cache.get("pages", key)
+            if cached is not None:
+                pages.update(cached)
+                continue
+        contexts: List[Tuple[str, Dict]] = []
+        walk(top, [], contexts)
+        groups.append((key, contexts))
+
+    contexts = [context for _, group in groups for context in group]
+    if workers > 1 and contexts:
+        # NB: see `ead.Ead.components` on spawning the workers
+        with ProcessPoolExecutor(workers, multiprocessing.get_context("spawn")) as pool:
+            chunks = max(1, len(contexts) // (workers * 4))
+            rendered = iter(pool.map(_render_page, [c for _, c in contexts], chunksize=chunks))
+    else:
+        rendered = (_render_page(c) for _, c in contexts)
+
+    for key, group in groups:
+        group_pages = {path: html for (path, _), html in zip(group, rendered)}
+        if cache is not None:
+            cache.put("pages", key, group_pages)
+        pages.update(group_pages)
+    return pages
 
 
 class Website:
-    def __init__(self, settings: StoreSettings):
+    def __init__(self, settings: StoreSettings, pool_size: int = 0):
         self.settings = settings
-        self.client = self.client("cloudfront")
+        self.pool = DistributionPool(self, pool_size) if pool_size else None
 
-    def client(self, service: str):
+    @functools.cached_property
+    def client(self):
+        """The CloudFront client, created on first use"""
+        return self.aws_client("cloudfront")
+
+    def aws_client(self, service: str):
+        import boto3
         return boto3.client(service,
                             region_name=self.settings.region,
                             aws_access_key_id=self.settings.access_key,
@@ -56,11 +181,12 @@ class Website:
 
     def get_or_create_site(self, name: str, site_id: Optional[str] = None) -> SiteInfo:
         """If site_id is given, fetch the distribution info.
-        Otherwise, create the distribution."""
+        Otherwise, claim a distribution from the pool, if there is one
+        available, or create the distribution."""
         if site_id:
             return self.get_site(site_id)
-        else:
-            return self.create_site(name)
+        site = self.pool.claim(name) if self.pool else None
+        return site or self.create_site(name)
 
     def get_site(self, site_id: str) -> SiteInfo:
         """Get the distribution info for the given `site_id`"""
@@ -72,7 +198,27 @@ class Website:
             origin_id=r["Distribution"]["DistributionConfig"]["Origins"]["Items"][0]["OriginPath"]
         )
 
-    def create_site(self, name: str) -> SiteInfo:
+    def ensure_assets(self, site_id: str) -> bool:
+        """Check a site serves the bucket's shared assets, adding the
+        behavior to do so to distributions created before there was one.
+        Returns whether the assets are served yet, which they won't be
+        until an updated distribution is deployed."""
+        r = self.client.get_distribution(Id=site_id)
+        config = r["Distribution"]["DistributionConfig"]
+        behaviors = config.get("CacheBehaviors", {}).get("Items", [])
+        if any(b["PathPattern"] == ASSETS_PATTERN for b in behaviors):
+            return r["Distribution"]["Status"] == "Deployed"
+
+        origin = assets_origin(self.settings.bucket, self.settings.region)
+        if not any(o["Id"] == origin["Id"] for o in config["Origins"]["Items"]):
+            config["Origins"]["Items"].append(origin)
+            config["Origins"]["Quantity"] = len(config["Origins"]["Items"])
+        behaviors.append(assets_behavior(self.settings.bucket))
+        config["CacheBehaviors"] = {"Quantity": len(behaviors), "Items": behaviors}
+        self.client.update_distribution(Id=site_id, IfMatch=r["ETag"], DistributionConfig=config)
+        return False
+
+    def create_site(self, name: str, comment: str = SITE_COMMENT) -> SiteInfo:
         """Create a new site with the given name as the origin id"""
         bucket = self.settings.bucket
         region = self.settings.region
@@ -100,9 +246,9 @@ class Website:
                 'DefaultRootObject': 'index.html',
                 'HttpVersion': 'http2and3',
                 'PriceClass': 'PriceClass_100',
-                'Comment': 'Created by the EHRI-3 WP11 Demo tool',
+                'Comment': comment,
                 'Origins': {
-                    'Quantity': 1,
+                    'Quantity': 2,
                     'Items': [{
                         'Id': origin_id,
                         'OriginPath': "/" + key_prefix[:-1],  # slash must be at the start
@@ -111,7 +257,11 @@ class Website:
                         'S3OriginConfig': {
                             'OriginAccessIdentity': ''
                         }
-                    }]
+                    }, assets_origin(bucket, region)]
+                },
+                'CacheBehaviors': {
+                    'Quantity': 1,
+                    'Items': [assets_behavior(bucket)]
                 },
                 'DefaultCacheBehavior': {
                     # 'CachePolicyId': '658327ea-f89d-4fab-a63d-7e88639e58f6',  # CachingOptimized (from docs)
@@ -139,4 +289,167 @@ class Website:
         )
 
 
+def assets_origin(bucket: str, region: str) -> Dict:
+    """The distribution origin serving the bucket's shared assets"""
+    return {
+        'Id': ASSETS_ORIGIN + bucket,
+        'OriginPath': '',
+        'DomainName': f"{bucket}.s3.{region}.amazonaws.com",
+        'S3OriginConfig': {
+            'OriginAccessIdentity': ''
+        }
+    }
+
+
+def assets_behavior(bucket: str) -> Dict:
+    """The cache behavior for the shared assets, which never change"""
+    return {
+        'PathPattern': ASSETS_PATTERN,
+        'CachePolicyId': '658327ea-f89d-4fab-a63d-7e88639e58f6',  # CachingOptimized (from docs)
+        'TargetOriginId': ASSETS_ORIGIN + bucket,
+        'ViewerProtocolPolicy': 'allow-all',
+        'Compress': True,
+        'AllowedMethods': {
+            'Quantity': 2,
+            'Items': ['GET', 'HEAD'],
+            'CachedMethods': {
+                'Quantity': 2,
+                'Items': ['GET', 'HEAD']
+            }
+        }
+    }
+
+
+class DistributionPool:
+    """Keeps up to `size` spare, pre-created distributions, so that a new
+    site can go live as soon as its files are uploaded rather than after
+    waiting minutes for a new distribution to deploy.
+
+    The ids of the pool's distributions are recorded in the bucket, so
+    only they are fetched rather than every distribution listed. Spare
+    distributions are marked by their comment, which is the only thing
+    changed when one is claimed. Claiming is done with a conditional
+    update, so concurrent claimers, even in other processes, cannot take
+    the same distribution. Filling takes a lease on the record, so only
+    one process fills the pool at a time."""
+    def __init__(self, website: Website, size: int):
+        self.website = website
+        self.size = size
+        self.lock = threading.Lock()
+        self.filling: Optional[threading.Thread] = None
+
+    @functools.cached_property
+    def s3(self):
+        """The S3 client, for the pool record, created on first use"""
+        return self.website.aws_client("s3")
+
+    def record(self) -> Tuple[Dict, Optional[str]]:
+        """The pool record, holding the ids of its distributions and when
+        the running fill, if any, started, and the record's ETag"""
+        from botocore.exceptions import ClientError
+        try:
+            r = self.s3.get_object(Bucket=self.website.settings.bucket, Key=POOL_KEY)
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchKey":
+                return dict(ids=[], filling=None), None
+            raise
+        return json.loads(r["Body"].read()), r["ETag"]
+
+    def save(self, record: Dict, etag: Optional[str]) -> Optional[str]:
+        """Replace the pool record, if it is unchanged since it was read
+        with the given ETag. Returns the new ETag, or None if it changed."""
+        from botocore.exceptions import ClientError
+        condition = dict(IfMatch=etag) if etag else dict(IfNoneMatch="*")
+        try:
+            r = self.s3.put_object(Bucket=self.website.settings.bucket, Key=POOL_KEY,
+                                   Body=json.dumps(record).encode('utf-8'), ContentType="application/json",
+                                   **condition)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("PreconditionFailed", "ConditionalRequestConflict"):
+                return None
+            raise
+        return r["ETag"]
+
+    def distributions(self, ids: Optional[List[str]] = None) -> List[Dict]:
+        """The pool's distributions, deployed or not, leaving out those
+        since claimed or deleted. By default, those recorded are fetched."""
+        from botocore.exceptions import ClientError
+        dists = []
+        for ident in ids if ids is not None else self.record()[0]["ids"]:
+            try:
+                dist = self.website.client.get_distribution(Id=ident)["Distribution"]
+            except ClientError as e:
+                if e.response["Error"]["Code"] == "NoSuchDistribution":
+                    continue
+                raise
+            if dist["DistributionConfig"]["Comment"] == POOL_COMMENT:
+                dists.append(dist)
+        return dists
+
+    def available(self) -> List[SiteInfo]:
+        """The deployed distributions ready to be claimed"""
+        return [SiteInfo(
+            id=d["Id"],
+            status=d["Status"],
+            domain=d["DomainName"],
+            origin_id=d["DistributionConfig"]["Origins"]["Items"][0]["OriginPath"]
+        ) for d in self.distributions() if d["Status"] == "Deployed" and d["DistributionConfig"]["Enabled"]]
+
+    def claim(self, name: str) -> Optional[SiteInfo]:
+        """Take a deployed distribution from the pool for the site with the
+        given name, refilling the pool in the background. Returns None if
+        none are available."""
+        from botocore.exceptions import ClientError
+        client = self.website.client
+        claimed = None
+        for site in self.available():
+            r = client.get_distribution_config(Id=site.id)
+            config = r["DistributionConfig"]
+            if config["Comment"] != POOL_COMMENT:
+                continue
+            config["Comment"] = f"{SITE_COMMENT}: {name}"[:MAX_COMMENT]
+            try:
+                r = client.update_distribution(Id=site.id, IfMatch=r["ETag"], DistributionConfig=config)
+            except ClientError as e:
+                # Someone else claimed it first
+                if e.response["Error"]["Code"] == "PreconditionFailed":
+                    continue
+                raise
+            # NB: the update is deployed again, so the status changes
+            claimed = replace(site, status=r["Distribution"]["Status"])
+            break
+        self.refill()
+        return claimed
+
+    def fill(self) -> List[SiteInfo]:
+        """Create distributions until the pool has `size` of them. If
+        another process is filling the pool, this does nothing."""
+        with self.lock:
+            record, etag = self.record()
+            if record.get("filling") and time.time() - record["filling"] < POOL_LEASE:
+                return []
+            ids = [d["Id"] for d in self.distributions(record["ids"])]
+            if len(ids) >= self.size:
+                return []
+            etag = self.save(dict(ids=ids, filling=time.time()), etag)
+            created = []
+            try:
+                while etag is not None and len(ids) < self.size:
+                    site = self.website.create_site("pool_" + get_random_string(5), comment=POOL_COMMENT)
+                    created.append(site)
+                    ids.append(site.id)
+                    # NB: recorded as each is created, in case this process stops
+                    etag = self.save(dict(ids=ids, filling=time.time()), etag)
+                    if etag is None:
+                        print(f"The distribution pool record changed while filling it: {site.id} is "
+                              f"not recorded", file=sys.stderr)
+            finally:
+                if etag is not None:
+                    self.save(dict(ids=ids, filling=None), etag)
+            return created
 
+    def refill(self) -> threading.Thread:
+        """Fill the pool in a background thread"""
+        self.filling = threading.Thread(target=self.fill, name="distribution-pool", daemon=True)
+        self.filling.start()
+        return self.filling